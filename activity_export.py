@@ -0,0 +1,232 @@
+import io
+import os
+import csv
+
+# CSV每积累多少字节发送一次
+EXPORT_CHUNK_BYTES = int(os.getenv('EXPORT_CHUNK_BYTES', 64 * 1024))
+# Parquet/Arrow每积累多少行写出一个row group（record batch），决定导出时的内存上限
+EXPORT_BATCH_ROWS = int(os.getenv('EXPORT_BATCH_ROWS', 50000))
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+CSV = 'csv'
+
+MIME_TYPES = {
+    PARQUET: 'application/vnd.apache.parquet',
+    ARROW: 'application/vnd.apache.arrow.stream',
+    CSV: 'text/csv; charset=utf-8'
+}
+
+# 活动表的列：(列名, 类型, 取值函数)
+ACTIVITY_COLUMNS = [
+    ('id', 'int', lambda a: a.get('id')),
+    ('name', 'str', lambda a: a.get('name')),
+    ('sport_type', 'str', lambda a: a.get('sport_type') or a.get('type')),
+    ('start_date', 'str', lambda a: a.get('start_date')),
+    ('start_date_local', 'str', lambda a: a.get('start_date_local')),
+    ('timezone', 'str', lambda a: a.get('timezone')),
+    ('distance_m', 'float', lambda a: a.get('distance')),
+    ('moving_time_s', 'int', lambda a: a.get('moving_time')),
+    ('elapsed_time_s', 'int', lambda a: a.get('elapsed_time')),
+    ('total_elevation_gain_m', 'float', lambda a: a.get('total_elevation_gain')),
+    ('elev_high_m', 'float', lambda a: a.get('elev_high')),
+    ('elev_low_m', 'float', lambda a: a.get('elev_low')),
+    ('average_speed_mps', 'float', lambda a: a.get('average_speed')),
+    ('max_speed_mps', 'float', lambda a: a.get('max_speed')),
+    ('average_heartrate', 'float', lambda a: a.get('average_heartrate')),
+    ('max_heartrate', 'float', lambda a: a.get('max_heartrate')),
+    ('average_cadence', 'float', lambda a: a.get('average_cadence')),
+    ('average_watts', 'float', lambda a: a.get('average_watts')),
+    ('kilojoules', 'float', lambda a: a.get('kilojoules')),
+    ('suffer_score', 'float', lambda a: a.get('suffer_score')),
+    ('start_lat', 'float', lambda a: (a.get('start_latlng') or [None, None])[0]),
+    ('start_lng', 'float', lambda a: (a.get('start_latlng') or [None, None])[1]),
+    ('summary_polyline', 'str', lambda a: (a.get('map') or {}).get('summary_polyline')),
+]
+
+# 流数据表的列（每个采样点一行），对应get_activity_streams保存的字段
+STREAM_COLUMNS = [
+    ('activity_id', 'int'),
+    ('time', 'int'),
+    ('distance', 'float'),
+    ('altitude', 'float'),
+    ('heartrate', 'float'),
+    ('cadence', 'float'),
+    ('watts', 'float'),
+    ('velocity', 'float'),
+    ('grade', 'float'),
+    ('pace', 'float'),
+]
+
+
+def available_formats():
+    """当前环境支持的导出格式，Parquet和Arrow需要安装pyarrow"""
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return [CSV]
+    return [PARQUET, ARROW, CSV]
+
+
+def activity_batches(activities, batch_rows=EXPORT_BATCH_ROWS):
+    """
+    把活动列表转换为按列组织的批次
+
+    Yields:
+        {列名: 值列表}
+    """
+    batch = {name: [] for name, _, _ in ACTIVITY_COLUMNS}
+    count = 0
+    for activity in activities:
+        for name, _, getter in ACTIVITY_COLUMNS:
+            batch[name].append(getter(activity))
+        count += 1
+        if count >= batch_rows:
+            yield batch
+            batch = {name: [] for name, _, _ in ACTIVITY_COLUMNS}
+            count = 0
+    if count:
+        yield batch
+
+
+def stream_batches(streams_items, batch_rows=EXPORT_BATCH_ROWS):
+    """
+    把各活动的流数据展开为每个采样点一行，按列组织成批次
+
+    Args:
+        streams_items: 逐个产生 (活动ID, 流数据字典) 的迭代器，只在处理到时才读取
+        batch_rows: 每批的大约行数，单个活动的采样点不拆分到两个批次
+
+    Yields:
+        {列名: 值列表}
+    """
+    names = [name for name, _ in STREAM_COLUMNS[1:]]
+    batch = {name: [] for name, _ in STREAM_COLUMNS}
+    count = 0
+    for activity_id, streams in streams_items:
+        if not streams:
+            continue
+        length = max((len(streams.get(name) or []) for name in names), default=0)
+        if not length:
+            continue
+        batch['activity_id'].extend([activity_id] * length)
+        for name in names:
+            values = streams.get(name) or []
+            batch[name].extend(values[:length])
+            # 某些流缺失或比其他流短时用空值补齐
+            if len(values) < length:
+                batch[name].extend([None] * (length - len(values)))
+        count += length
+        if count >= batch_rows:
+            yield batch
+            batch = {name: [] for name, _ in STREAM_COLUMNS}
+            count = 0
+    if count:
+        yield batch
+
+
+def write_csv(columns, batches, chunk_bytes=EXPORT_CHUNK_BYTES):
+    """
+    以CSV格式逐块输出，带UTF-8 BOM，Excel打开中文活动名称时不会乱码
+
+    Args:
+        columns: [(列名, 类型), ...]
+        batches: activity_batches或stream_batches产生的批次
+
+    Yields:
+        bytes
+    """
+    names = [column[0] for column in columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(names)
+    for batch in batches:
+        for row in zip(*(batch[name] for name in names)):
+            writer.writerow(row)
+            if buffer.tell() >= chunk_bytes:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _ChunkSink:
+    """供pyarrow写入的文件对象，写入的数据暂存后由生成器取走发送"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+    return pa.schema([(column[0], types[column[1]]) for column in columns])
+
+
+def write_arrow(columns, batches, file_format=PARQUET):
+    """
+    以Parquet或Arrow IPC流格式逐批输出，每个批次写成一个row group（record batch）后发送
+
+    Args:
+        columns: [(列名, 类型), ...]
+        batches: activity_batches或stream_batches产生的批次
+        file_format: PARQUET 或 ARROW
+
+    Yields:
+        bytes
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    sink = _ChunkSink()
+    if file_format == PARQUET:
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    else:
+        writer = pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    try:
+        for batch in batches:
+            record_batch = pa.record_batch([pa.array(batch[field.name], type=field.type) for field in schema],
+                                           schema=schema)
+            if file_format == PARQUET:
+                writer.write_batch(record_batch, row_group_size=record_batch.num_rows)
+            else:
+                writer.write_batch(record_batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def export_rows(columns, batches, file_format):
+    """按格式选择输出方式，返回bytes生成器"""
+    if file_format == CSV:
+        return write_csv(columns, batches)
+    return write_arrow(columns, batches, file_format)
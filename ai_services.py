@@ -1,10 +1,9 @@
 import os
-import requests
 import json
 import asyncio
-import aiohttp
 import re
 from dotenv import load_dotenv
+from route_analysis import summarize_route
 
 # 加载环境变量
 load_dotenv()
@@ -12,7 +11,7 @@ load_dotenv()
 class AIService:
     def __init__(self):
         self.api_key = os.getenv('DEEPSEEK_API_KEY')
-        self.base_url = "https://api.deepseek.com/v1"
+        self.base_url = os.getenv('DEEPSEEK_BASE_URL', "https://api.deepseek.com/v1")
         
         if not self.api_key:
             raise ValueError("DeepSeek API密钥未设置。请在.env文件中添加DEEPSEEK_API_KEY。")
@@ -54,17 +53,19 @@ class AIService:
 
         """
     
-    async def generate_training_advice_stream(self, gpx_data, weather_data, match_date, timeout=None):
+    def prepare_prompt_data(self, gpx_data, weather_data, route_token_budget=None, terrain_text=None, load_text=None, weather_text=None, route_summary=None):
         """
-        根据GPX和天气数据生成训练建议，使用流式响应
-        
+        准备提示词中的路线和天气数据
+
         Args:
             gpx_data: GPX数据对象
             weather_data: 天气数据列表
-            match_date: 比赛日期
-            timeout: 请求超时设置
+            route_token_budget: 路线摘要的token预算
+            terrain_text: 训练地形与比赛地形的对比文本（可选）
+            load_text: 当前训练负荷（体能、疲劳、状态）的文本（可选）
+            weather_text: 天气摘要文本（可选），如沿路线的天气表或气候统计，有时代替最近一年的天气
+            route_summary: 预先计算的路线摘要 (文本, 结构化摘要)（可选），提供时不再重新计算
         """
-        # 准备路线数据
         total_distance = gpx_data['stats']['distance']
         elevation_gain = gpx_data['stats']['elevation_gain']
         elevation_loss = gpx_data['stats']['elevation_loss']
@@ -74,70 +75,60 @@ class AIService:
             avg_grade = (elevation_gain / (total_distance * 1000)) * 100
         else:
             avg_grade = 0
-            
-        # 计算每公里爬升下降
-        km_segments = []
-        distances = gpx_data['elevation_data']['distances']
-        elevations = gpx_data['elevation_data']['elevations']
         
-        if len(distances) > 0 and len(elevations) > 0:
-            curr_km = 1
-            last_elevation = elevations[0]
-            last_dist = 0
-            km_gain = 0
-            km_loss = 0
-            
-            for i in range(1, len(distances)):
-                dist = distances[i]
-                elev = elevations[i]
-                
-                # 计算高度差
-                elev_diff = elev - last_elevation
-                if elev_diff > 0:
-                    km_gain += elev_diff
-                else:
-                    km_loss += abs(elev_diff)
-                    
-                # 如果超过了当前公里，记录数据
-                if int(dist) > curr_km:
-                    # 计算该公里的平均坡度
-                    km_dist = dist - last_dist
-                    if km_dist > 0:
-                        km_grade = (km_gain / (km_dist * 1000)) * 100
-                    else:
-                        km_grade = 0
-                        
-                    # 添加到公里数据
-                    km_segments.append({
-                        'km': curr_km,
-                        'gain': round(km_gain, 1),
-                        'loss': round(km_loss, 1),
-                        'grade': round(km_grade, 1)
-                    })
-                    
-                    # 重置数据
-                    curr_km = int(dist) + 1
-                    last_dist = dist
-                    km_gain = 0
-                    km_loss = 0
-                
-                last_elevation = elev
+        # 生成覆盖全程的路线摘要，替代逐公里数据
+        if route_summary is None:
+            route_summary = summarize_route(gpx_data, token_budget=route_token_budget)
+        km_data_text, route_summary = route_summary
         
         # 准备天气数据摘要
         weather_summary = "无天气数据"
         if weather_data and len(weather_data) > 0:
             latest_weather = weather_data[-1]  # 最近一年的天气数据
             weather_summary = f"温度: {latest_weather.get('temperature')}°C, 湿度: {latest_weather.get('humidity')}%, 降水: {latest_weather.get('precipitation')}mm, 风速: {latest_weather.get('windspeed')}km/h"
+        if weather_text:
+            weather_summary = weather_text
+        
+        return {
+            'total_distance': total_distance,
+            'elevation_gain': elevation_gain,
+            'elevation_loss': elevation_loss,
+            'avg_grade': avg_grade,
+            'km_data_text': km_data_text,
+            'route_summary': route_summary,
+            'weather_summary': weather_summary,
+            'terrain_text': terrain_text or "无训练历史数据",
+            'load_text': load_text or "无训练负荷数据"
+        }
+    
+    async def generate_training_advice_stream(self, gpx_data, weather_data, match_date, timeout=None, route_token_budget=None, terrain_text=None, load_text=None, weather_text=None, prompt_data=None):
+        """
+        根据GPX和天气数据生成训练建议，使用流式响应
         
-        # 构建公里分段数据文本
-        km_data_text = ""
-        if km_segments:
-            km_data_text = "\n\n### 公里分段数据:\n"
-            for seg in km_segments[:15]:  # 限制最多15个公里的数据，避免提示词过长
-                km_data_text += f"- 第{seg['km']}公里: 爬升{seg['gain']}米, 下降{seg['loss']}米, 平均坡度{seg['grade']}%\n"
-            
-            if len(km_segments) > 15:
-                km_data_text += f"- ...(共{len(km_segments)}公里)\n"
+        Args:
+            gpx_data: GPX数据对象
+            weather_data: 天气数据列表
+            match_date: 比赛日期
+            timeout: 请求超时设置
+            route_token_budget: 路线摘要的token预算
+            terrain_text: 训练地形与比赛地形的对比文本（可选）
+            load_text: 当前训练负荷的文本（可选）
+            weather_text: 天气摘要文本（可选）
+            prompt_data: 预先准备的路线和天气数据（可选），提供时不再重新计算，训练地形和训练负荷仍使用本次的参数
+        """
+        # 准备路线和天气数据
+        if prompt_data is None:
+            prompt_data = self.prepare_prompt_data(gpx_data, weather_data, route_token_budget, terrain_text, load_text, weather_text)
+        else:
+            prompt_data = dict(prompt_data, terrain_text=terrain_text or "无训练历史数据", load_text=load_text or "无训练负荷数据")
+        total_distance = prompt_data['total_distance']
+        elevation_gain = prompt_data['elevation_gain']
+        elevation_loss = prompt_data['elevation_loss']
+        avg_grade = prompt_data['avg_grade']
+        km_data_text = prompt_data['km_data_text']
+        weather_summary = prompt_data['weather_summary']
+        terrain_text = prompt_data['terrain_text']
+        load_text = prompt_data['load_text']
 
         import datetime
         time_now = datetime.datetime.now()
@@ -154,6 +145,12 @@ class AIService:
         - 平均坡度: {avg_grade:.1f}%;
         - 分段数据：{km_data_text};
         
+        ## 训练地形与比赛地形对比:
+        {terrain_text}
+        
+        ## 当前训练负荷:
+        {load_text}
+        
         ## 比赛日当天的天气预报数据:
         {weather_summary}
 
@@ -180,6 +177,9 @@ class AIService:
         content = ""
         reasoning_content_end_flag = False
         
+        # aiohttp导入较慢，延迟到第一次请求时导入
+        import aiohttp
+        
         # 获取实际的超时设置
         actual_timeout = timeout or aiohttp.ClientTimeout(total=300)
         
@@ -235,7 +235,7 @@ class AIService:
                 print(f"错误堆栈: {traceback.format_exc()}")
                 yield f"\n\nAI请求出错: {str(e)}"
 
-    async def generate_training_advice_stream_with_custom_prompts(self, gpx_data, weather_data, match_date, custom_system_prompt, custom_user_prompt, timeout=None):
+    async def generate_training_advice_stream_with_custom_prompts(self, gpx_data, weather_data, match_date, custom_system_prompt, custom_user_prompt, timeout=None, route_token_budget=None, terrain_text=None, load_text=None, weather_text=None, prompt_data=None):
         """
         使用自定义提示词根据GPX和天气数据生成训练建议，使用流式响应
         
@@ -246,81 +246,25 @@ class AIService:
             custom_system_prompt: 用户自定义的系统提示词
             custom_user_prompt: 用户自定义的用户提示词
             timeout: 请求超时设置
+            route_token_budget: 路线摘要的token预算
+            terrain_text: 训练地形与比赛地形的对比文本（可选）
+            load_text: 当前训练负荷的文本（可选）
+            weather_text: 天气摘要文本（可选）
+            prompt_data: 预先准备的路线和天气数据（可选），提供时不再重新计算，训练地形和训练负荷仍使用本次的参数
         """
-        # 准备路线数据
-        total_distance = gpx_data['stats']['distance']
-        elevation_gain = gpx_data['stats']['elevation_gain']
-        elevation_loss = gpx_data['stats']['elevation_loss']
-        
-        # 计算平均坡度
-        if total_distance > 0:
-            avg_grade = (elevation_gain / (total_distance * 1000)) * 100
+        # 准备路线和天气数据
+        if prompt_data is None:
+            prompt_data = self.prepare_prompt_data(gpx_data, weather_data, route_token_budget, terrain_text, load_text, weather_text)
         else:
-            avg_grade = 0
-            
-        # 计算每公里爬升下降
-        km_segments = []
-        distances = gpx_data['elevation_data']['distances']
-        elevations = gpx_data['elevation_data']['elevations']
-        
-        if len(distances) > 0 and len(elevations) > 0:
-            curr_km = 1
-            last_elevation = elevations[0]
-            last_dist = 0
-            km_gain = 0
-            km_loss = 0
-            
-            for i in range(1, len(distances)):
-                dist = distances[i]
-                elev = elevations[i]
-                
-                # 计算高度差
-                elev_diff = elev - last_elevation
-                if elev_diff > 0:
-                    km_gain += elev_diff
-                else:
-                    km_loss += abs(elev_diff)
-                    
-                # 如果超过了当前公里，记录数据
-                if int(dist) > curr_km:
-                    # 计算该公里的平均坡度
-                    km_dist = dist - last_dist
-                    if km_dist > 0:
-                        km_grade = (km_gain / (km_dist * 1000)) * 100
-                    else:
-                        km_grade = 0
-                        
-                    # 添加到公里数据
-                    km_segments.append({
-                        'km': curr_km,
-                        'gain': round(km_gain, 1),
-                        'loss': round(km_loss, 1),
-                        'grade': round(km_grade, 1)
-                    })
-                    
-                    # 重置数据
-                    curr_km = int(dist) + 1
-                    last_dist = dist
-                    km_gain = 0
-                    km_loss = 0
-                
-                last_elevation = elev
-        
-        # 准备天气数据摘要
-        weather_summary = "无天气数据"
-        if weather_data and len(weather_data) > 0:
-            latest_weather = weather_data[-1]  # 最近一年的天气数据
-            weather_summary = f"温度: {latest_weather.get('temperature')}°C, 湿度: {latest_weather.get('humidity')}%, 降水: {latest_weather.get('precipitation')}mm, 风速: {latest_weather.get('windspeed')}km/h"
-        
-        # 构建公里分段数据文本
-        km_data_text = ""
-        if km_segments:
-            km_data_text = "\n\n### 公里分段数据:\n"
-            for seg in km_segments[:15]:  # 限制最多15个公里的数据，避免提示词过长
-                km_data_text += f"- 第{seg['km']}公里: 爬升{seg['gain']}米, 下降{seg['loss']}米, 平均坡度{seg['grade']}%\n"
-            
-            if len(km_segments) > 15:
-                km_data_text += f"- ...(共{len(km_segments)}公里)\n"
+            prompt_data = dict(prompt_data, terrain_text=terrain_text or "无训练历史数据", load_text=load_text or "无训练负荷数据")
+        total_distance = prompt_data['total_distance']
+        elevation_gain = prompt_data['elevation_gain']
+        elevation_loss = prompt_data['elevation_loss']
+        avg_grade = prompt_data['avg_grade']
+        km_data_text = prompt_data['km_data_text']
+        weather_summary = prompt_data['weather_summary']
+        terrain_text = prompt_data['terrain_text']
+        load_text = prompt_data['load_text']
 
         import datetime
         time_now = datetime.datetime.now()
@@ -334,6 +278,8 @@ class AIService:
             avg_grade=avg_grade,
             km_data_text=km_data_text,
             weather_summary=weather_summary,
+            terrain_text=terrain_text,
+            load_text=load_text,
             time_now_str=time_now_str,
             match_date=match_date
         )
@@ -354,6 +300,9 @@ class AIService:
         content = ""
         reasoning_content_end_flag = False
         
+        # aiohttp导入较慢，延迟到第一次请求时导入
+        import aiohttp
+        
         # 获取实际的超时设置
         actual_timeout = timeout or aiohttp.ClientTimeout(total=300)
         
@@ -409,9 +358,6 @@ class AIService:
                 print(f"错误堆栈: {traceback.format_exc()}")
                 yield f"\n\nAI请求出错: {str(e)}"
 
-# 单例模式
-ai_service = AIService()
-
 # 单元测试代码
 async def run_test():
     """单元测试函数，用于测试API调用"""
@@ -440,6 +386,8 @@ async def run_test():
 
     match_date = "2026-01-18"
     
+    ai_service = AIService()
+    
     print("正在测试...\n")
     content = ""
     async for chunk in ai_service.generate_training_advice_stream(gpx_data, weather_data, match_date):
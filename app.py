@@ -1,32 +1,63 @@
-from flask import Flask, request, redirect, url_for, render_template, session, send_from_directory, jsonify, Response, make_response
+from flask import Flask, request, redirect, url_for, render_template, session, send_from_directory, jsonify, Response, make_response, g, abort
 import requests
 import os
 import json
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-import polyline
-import gpxpy
-import gpxpy.gpx
-from geopy.distance import geodesic
 import asyncio
 from ai_services import AIService  # 修正导入方式
+from sse_utils import coalesce_stream, sse_event
+from route_encoding import (encode_route_compact, compact_streams, choose_content_encoding, compress_body, COMPRESS_MIN_BYTES,
+                            STREAM_DECIMALS, STREAM_POINTS)
+from gpx_pool import analyze_gpx_file, submit_gpx_file, pool_stats, GpxPoolBusy, GPX_MAX_BYTES, GPX_ASYNC_BYTES
+from store_sweeper import start_sweeper, touch_data_file, read_last_sweep, STATUS_SUFFIX
+from session_store import SqliteSessionInterface
+from token_manager import TokenManager, token_key, needs_refresh
+from webhook_queue import WebhookQueue, start_webhook_worker
+from strava_rate_limit import RateLimitScheduler, strava_priority, BACKGROUND
+from llm_admission import LLMAdmission, AdmissionRejected
+from route_index import RouteIndex
+from training_load import TrainingLoadStore, load_series, summarize_load, render_training_load
+from terrain_histograms import TerrainHistogramStore, TERRAIN_SPORT_TYPES, route_grade_histogram, compare_terrain, render_terrain_comparison
+from race_prediction import GradePaceStore, predict_route
+from route_weather import WeatherFetcher, build_route_weather, weather_cell
+from route_precompute import (PrecomputePipeline, profile_step, geometry_step, weather_step, prompt_step, weather_text_for_date,
+                              stored_route_summary, stored_grade_histogram, stored_route_samples, stored_prompt_data,
+                              PRECOMPUTE_ENABLED, PRECOMPUTE_WAIT, PENDING, RUNNING)
+from page_cache import ResponseCache, make_etag, directory_version, DASHBOARD_CACHE_TTL, ACTIVITY_CACHE_TTL
+from fragment_cache import FragmentCache, enable_bytecode_cache
+from memory_profile import MemoryProfiler, render_metrics
+from activity_export import (available_formats, activity_batches, stream_batches, export_rows, ACTIVITY_COLUMNS, STREAM_COLUMNS,
+                             MIME_TYPES, CSV)
+from flask.json import htmlsafe_dumps
+from markupsafe import Markup
 import uuid
 from werkzeug.utils import secure_filename
+from werkzeug.http import is_resource_modified
 import pickle  # 导入pickle模块用于数据序列化
+import tempfile
 import secrets
 import time
-import aiohttp
+import copy
+import threading
+try:
+    import fcntl  # 跨进程文件锁，仅在类Unix系统可用
+except ImportError:
+    fcntl = None
 
 # 加载环境变量
 load_dotenv()
 
 WEATHER_API_KEY = os.getenv('VISUAL_CROSSING_API_KEY')
+WEATHER_BASE_URL = os.getenv('VISUAL_CROSSING_BASE_URL', "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline")
+# 单次天气请求的超时（秒），并发请求时避免某个请求一直占用线程
+WEATHER_REQUEST_TIMEOUT = float(os.getenv('WEATHER_REQUEST_TIMEOUT', 15))
 
 # 用于临时存储GPX和天气数据的字典
 temp_data_store = {}
 
 # 数据存储路径
-DATA_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_store')
+DATA_STORE_DIR = os.getenv('DATA_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data_store'))
 if not os.path.exists(DATA_STORE_DIR):
     os.makedirs(DATA_STORE_DIR)
 
@@ -37,7 +68,10 @@ def load_data_from_file(data_id):
         file_path = os.path.join(DATA_STORE_DIR, f"{data_id}.pkl")
         if os.path.exists(file_path):
             with open(file_path, 'rb') as f:
-                return pickle.load(f)
+                data = pickle.load(f)
+            # 记录访问时间，供清理时按最近最少访问淘汰
+            touch_data_file(DATA_STORE_DIR, data_id)
+            return data
         return None
     except Exception as e:
         print(f"加载数据错误: {str(e)}")
@@ -48,15 +82,88 @@ def save_data_to_file(data_id, data):
     """保存数据到文件系统"""
     try:
         file_path = os.path.join(DATA_STORE_DIR, f"{data_id}.pkl")
-        with open(file_path, 'wb') as f:
+        # 先写临时文件再原子替换，避免其他worker读到写了一半的文件
+        with tempfile.NamedTemporaryFile('wb', dir=DATA_STORE_DIR, prefix='.', suffix='.tmp', delete=False) as f:
             pickle.dump(data, f)
+        os.replace(f.name, file_path)
         return True
     except Exception as e:
         print(f"保存数据错误: {str(e)}")
         return False
 
+# 合并更新路线数据时使用的跨worker文件锁
+DATA_UPDATE_LOCK_FILE = '.update.lock'
+_data_update_lock = threading.Lock()
+
+def update_data_entry(data_id, updates):
+    """
+    把字段合并到路线数据中
+
+    在文件锁内重新读取最新的数据再写回，避免后台预计算和不同worker中的请求同时更新同一路线时互相覆盖。
+
+    Returns:
+        合并后的路线数据，数据不存在时返回None
+    """
+    with _data_update_lock, open(os.path.join(DATA_STORE_DIR, DATA_UPDATE_LOCK_FILE), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        data = load_data_from_file(data_id)
+        if data is None:
+            return None
+        data.update(updates)
+        save_data_to_file(data_id, data)
+        if 'precompute' in updates:
+            save_precompute_status(data_id, updates['precompute'])
+        temp_data_store[data_id] = data
+        return data
+
+def save_precompute_status(data_id, status):
+    """
+    把预计算状态另存为小文件，供等待预计算的请求轮询，不必反复读取整个路线数据
+
+    预计算结束后删除状态文件，异常退出留下的文件由store_sweeper按过期时间清理。
+    """
+    file_path = os.path.join(DATA_STORE_DIR, f"{data_id}{STATUS_SUFFIX}")
+    try:
+        if status.get('status') in (PENDING, RUNNING):
+            with tempfile.NamedTemporaryFile('w', dir=DATA_STORE_DIR, prefix='.', suffix='.tmp', delete=False) as f:
+                json.dump(status, f)
+            os.replace(f.name, file_path)
+        elif os.path.exists(file_path):
+            os.remove(file_path)
+    except OSError as e:
+        print(f"保存预计算状态错误: {str(e)}")
+
+def load_precompute_status(data_id):
+    """读取预计算状态，预计算已结束或没有预计算时返回None"""
+    try:
+        with open(os.path.join(DATA_STORE_DIR, f"{data_id}{STATUS_SUFFIX}")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def wait_for_precompute(data_id, stored_data, step, timeout=None):
+    """
+    上传后的预计算还没有完成指定步骤时，等待其结果
+
+    Returns:
+        最新的路线数据；没有预计算或等待超时时返回传入的数据
+    """
+    deadline = time.time() + (PRECOMPUTE_WAIT if timeout is None else timeout)
+    while True:
+        status = (stored_data.get('precompute') or {}).get('steps', {}).get(step)
+        if not status or status['status'] not in (PENDING, RUNNING) or time.time() >= deadline:
+            return stored_data
+        time.sleep(0.2)
+        # 轮询状态文件，步骤结束（或预计算已结束）后才读取一次完整的路线数据
+        progress = load_precompute_status(data_id)
+        if ((progress or {}).get('steps', {}).get(step) or {}).get('status') in (PENDING, RUNNING):
+            continue
+        return load_data_from_file(data_id) or stored_data
+
 def decode_polyline(encoded_polyline):
     """解码Strava的polyline编码"""
+    import polyline  # 延迟导入，gunicorn preload时由warm_up提前加载
     try:
         return polyline.decode(encoded_polyline)
     except:
@@ -86,21 +193,72 @@ def get_bounds(points):
 
 app = Flask(__name__, static_folder='static')
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24))  # 用于session加密
+# 编译好的模板保存到磁盘，worker重启后不必重新编译
+enable_bytecode_cache(app.jinja_env)
+
+# 服务端session：cookie中只保存session id，提示词和令牌等数据保存在SQLite中
+# 设置 SESSION_BACKEND=cookie 可以回退到Flask默认的cookie session
+SESSION_DB_PATH = os.environ.get('SESSION_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sessions.db'))
+if os.environ.get('SESSION_BACKEND', 'sqlite') == 'sqlite':
+    app.session_interface = SqliteSessionInterface(SESSION_DB_PATH)
+
+# Strava令牌管理：服务端缓存令牌，跨worker合并并发刷新
+token_manager = TokenManager(SESSION_DB_PATH)
+# Strava请求调度：所有worker共享限额用量，用户访问优先于后台同步
+strava_scheduler = RateLimitScheduler(SESSION_DB_PATH)
+# 推送事件预取活动时最多排队等待的时间（秒），超过后事件延后处理
+WEBHOOK_STRAVA_WAIT = float(os.environ.get('WEBHOOK_STRAVA_WAIT', 30))
+# 训练建议生成的准入控制：限制全局和每个session的并发数，超出的请求排队或直接返回429
+llm_admission = LLMAdmission(SESSION_DB_PATH)
+
+# Strava数据和渲染页面的缓存，所有worker共享，用于ETag条件请求
+CACHE_DB_PATH = os.environ.get('CACHE_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache.db'))
+response_cache = ResponseCache(CACHE_DB_PATH)
+# 历史活动路线的空间索引，用于查找与比赛路线重合的历史活动
+route_index = RouteIndex(CACHE_DB_PATH)
+# 每个活动的坡度和配速直方图，用于对比比赛路线与训练地形
+terrain_store = TerrainHistogramStore(CACHE_DB_PATH)
+# 每个活动在各坡度的距离和用时，用于拟合运动员的坡度-配速模型并预测比赛用时
+grade_pace_store = GradePaceStore(CACHE_DB_PATH)
+# 每个活动的训练负荷（TRIMP），用于计算体能、疲劳和状态曲线
+training_loads = TrainingLoadStore(CACHE_DB_PATH)
+# 每次同步最多向Strava请求多少个活动的流数据，其余活动在之后的请求中逐步补齐
+TERRAIN_SYNC_FETCH_LIMIT = int(os.environ.get('TERRAIN_SYNC_FETCH_LIMIT', 20))
+# Strava推送订阅：验证令牌在创建订阅时提供，订阅ID用于校验推送来源。
+# 创建订阅时只需要验证令牌，两者都设置后才接收和处理推送事件
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.environ.get('STRAVA_WEBHOOK_VERIFY_TOKEN')
+STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.environ.get('STRAVA_WEBHOOK_SUBSCRIPTION_ID')
+STRAVA_WEBHOOK_ENABLED = bool(STRAVA_WEBHOOK_VERIFY_TOKEN and STRAVA_WEBHOOK_SUBSCRIPTION_ID)
+if STRAVA_WEBHOOK_VERIFY_TOKEN and not STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+    print("未设置STRAVA_WEBHOOK_SUBSCRIPTION_ID，不接收Strava推送事件（只响应创建订阅时的验证请求）")
+webhook_queue = WebhookQueue(SESSION_DB_PATH)
+# 活动列表的缓存时间。开启推送后新活动、修改和删除都由推送事件更新缓存，可以缓存更久
+ACTIVITIES_CACHE_TTL = int(os.environ.get('ACTIVITIES_CACHE_TTL', 24 * 3600 if STRAVA_WEBHOOK_ENABLED else DASHBOARD_CACHE_TTL))
+# 模板版本，模板更新后缓存的页面自动失效
+TEMPLATE_VERSION, TEMPLATE_MTIME = directory_version(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates'))
+# 活动表格行、地图数据和详情页JSON等页面片段的缓存，整页缓存失效时只重新渲染有变化的片段
+fragment_cache = FragmentCache()
+# 按路由抽样记录请求的内存分配峰值和分配位置（MEMORY_PROFILE_RATE大于0时开启）
+memory_profiler = MemoryProfiler()
+# 访问/debug/下所有调试接口的令牌，未设置时这些接口返回404
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
 
 # Strava API配置
 CLIENT_ID = int(os.environ.get('STRAVA_CLIENT_ID', 156185))
 CLIENT_SECRET = os.environ.get('STRAVA_CLIENT_SECRET', '28ffaf520015a739e50db00b4607fd5fa5c970c3')
 REDIRECT_URI = os.environ.get('STRAVA_REDIRECT_URI', 'https://43.139.72.39/callback')
 
-# Strava API端点
+# Strava API端点（STRAVA_API_BASE_URL可指向本地替身服务，用于压测）
+STRAVA_API_BASE_URL = os.environ.get('STRAVA_API_BASE_URL', 'https://www.strava.com/api/v3')
 AUTH_URL = "https://www.strava.com/oauth/authorize"
-TOKEN_URL = "https://www.strava.com/api/v3/oauth/token"
-ATHLETE_URL = "https://www.strava.com/api/v3/athlete"
-ACTIVITIES_URL = "https://www.strava.com/api/v3/athlete/activities"
-ACTIVITY_URL = "https://www.strava.com/api/v3/activities/{id}"
+TOKEN_URL = f"{STRAVA_API_BASE_URL}/oauth/token"
+ATHLETE_URL = f"{STRAVA_API_BASE_URL}/athlete"
+ACTIVITIES_URL = f"{STRAVA_API_BASE_URL}/athlete/activities"
+ACTIVITY_URL = f"{STRAVA_API_BASE_URL}/activities/{{id}}"
+ACTIVITY_STREAMS_URL = f"{STRAVA_API_BASE_URL}/activities/{{id}}/streams"
 
 # 配置文件上传
-app.config['MAX_CONTENT_LENGTH'] = 20 * 1024 * 1024  # 20MB
+app.config['MAX_CONTENT_LENGTH'] = GPX_MAX_BYTES  # 默认20MB
 app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 
 # 确保上传目录存在
@@ -118,6 +276,27 @@ def add_cors_headers(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
     return response
 
+@app.before_request
+def protect_debug_routes():
+    # 调试路由会暴露运行状态和用户数据，统一要求调试令牌
+    if request.endpoint and request.endpoint.startswith('debug_'):
+        require_debug_token()
+
+@app.before_request
+def start_memory_profile():
+    g.memory_sample = memory_profiler.start(request.endpoint)
+
+@app.after_request
+def finish_memory_profile(response):
+    # 流式响应在此之后才生成内容，只记录生成响应之前的分配
+    memory_profiler.finish(g.pop('memory_sample', None), response.status_code)
+    return response
+
+@app.teardown_request
+def stop_memory_profile(error=None):
+    # 请求出错时after_request不会运行，在这里停止抽样
+    memory_profiler.finish(g.pop('memory_sample', None))
+
 @app.route('/')
 def index():
     # 展示欢迎页面，用户需要点击按钮才会跳转到Strava授权
@@ -128,6 +307,11 @@ def about():
     # 展示关于页面
     return render_template('about.html')
 
+@app.route('/healthz')
+def healthz():
+    # 滚动重启时的健康检查，返回处理请求的worker的pid，用于确认是新的worker在响应
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
 @app.route('/dashboard')
 def dashboard():
     # 检查令牌是否存在
@@ -141,41 +325,133 @@ def dashboard():
         if not refreshed:
             return redirect(url_for('authorize'))
     
-    # 获取年份参数
-    selected_year = request.args.get('year', datetime.now().year, type=int)
+    owner = session_token_key()
+    activities_key = f"activities:{owner}"
+    athlete_key = f"athlete:{owner}"
     
-    # 获取所有年份的活动数据
-    activities_by_year = get_activities_by_years()
-    
-    if not activities_by_year:
+    # 活动列表和用户信息缓存一段时间，重复访问不再请求Strava
+    activities_meta = response_cache.ensure(activities_key, ACTIVITIES_CACHE_TTL, lambda: get_activities(per_page=200) or None)
+    if not activities_meta:
         return "获取活动数据失败，请稍后再试"
+    athlete_meta = response_cache.ensure(athlete_key, DASHBOARD_CACHE_TTL, get_athlete_data)
+    sync_training_loads(owner)
     
-    # 获取用户信息
-    athlete_data = get_athlete_data()
-    
-    # 获取所有可用年份并排序
-    available_years = sorted(activities_by_year.keys(), reverse=True)
+    requested_year = request.args.get('year', type=int)
+    # 体能和疲劳每天都会衰减，ETag包含日期
+    load_version = training_loads.version(owner)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    etag = make_etag(activities_meta['etag'], athlete_meta and athlete_meta['etag'], requested_year, TEMPLATE_VERSION,
+                     load_version, today.strftime('%Y-%m-%d'))
+    # Last-Modified同样包含负荷的最近计算时间和当天零点，只发送If-Modified-Since的客户端也能拿到新的体能曲线
+    last_modified = max(activities_meta['updated_at'], athlete_meta['updated_at'] if athlete_meta else 0, TEMPLATE_MTIME,
+                        load_version[1] or 0, today.timestamp())
     
-    # 如果没有指定年份或指定的年份没有数据，使用最近的年份
-    if not selected_year or selected_year not in available_years:
-        selected_year = available_years[0] if available_years else datetime.now().year
+    def render():
+        # 获取年份参数
+        selected_year = requested_year or datetime.now().year
+        
+        # 获取所有年份的活动数据
+        activities_entry = response_cache.get_or_fetch(activities_key, ACTIVITIES_CACHE_TTL, lambda: get_activities(per_page=200) or None)
+        activities_by_year = get_activities_by_years(activities_entry['value'] if activities_entry else None)
+        
+        # 获取用户信息
+        athlete_entry = response_cache.get_or_fetch(athlete_key, DASHBOARD_CACHE_TTL, get_athlete_data)
+        athlete_data = athlete_entry['value'] if athlete_entry else None
+        
+        # 获取所有可用年份并排序
+        available_years = sorted(activities_by_year.keys(), reverse=True)
+        
+        # 如果没有指定年份或指定的年份没有数据，使用最近的年份
+        if not selected_year or selected_year not in available_years:
+            selected_year = available_years[0] if available_years else datetime.now().year
+        
+        # 获取选定年份的数据
+        selected_year_data = activities_by_year.get(selected_year, {
+            'activities': [],
+            'stats': {
+                'count': 0,
+                'total_distance_km': 0,
+                'formatted_total_time': '0小时0分钟'
+            }
+        })
+        
+        activity_rows, map_activities = activity_fragments(selected_year_data['activities'])
+        return render_template('activities.html', 
+                              activities=selected_year_data['activities'],
+                              activity_rows=activity_rows,
+                              map_activities=map_activities,
+                              stats=selected_year_data['stats'],
+                              athlete=athlete_data,
+                              years=available_years,
+                              selected_year=selected_year,
+                              training_load=summarize_load(load_series(training_loads.daily_loads(owner))))
     
-    # 获取选定年份的数据
-    selected_year_data = activities_by_year.get(selected_year, {
-        'activities': [],
-        'stats': {
-            'count': 0,
-            'total_distance_km': 0,
-            'formatted_total_time': '0小时0分钟'
-        }
-    })
+    return conditional_page(f"page:dashboard:{owner}:{requested_year}", etag, last_modified, DASHBOARD_CACHE_TTL, render)
+
+def activity_fragments(activities):
+    """
+    活动列表页面中每个活动的表格行HTML和地图数据JSON
+
+    片段按活动ID缓存，版本由片段用到的字段和模板版本计算，页面只需拼接缓存的片段。
+
+    Returns:
+        (表格行HTML, 地图数据JSON数组)，都已标记为安全的Markup
+    """
+    rows, map_items = [], []
+    for activity in activities:
+        summary_polyline = (activity.get('map') or {}).get('summary_polyline')
+        version = make_etag(TEMPLATE_VERSION, activity.get('name'), activity.get('type'), activity.get('formatted_date'),
+                            activity.get('distance'), activity.get('formatted_time'), activity.get('pace'), summary_polyline)
+        rows.append(fragment_cache.get_or_render(
+            'activity_row', activity['id'], version,
+            lambda: render_template('fragments/activity_row.html', activity=activity)
+        ))
+        if activity.get('decoded_polyline'):
+            map_items.append(fragment_cache.get_or_render(
+                'activity_map', activity['id'], version,
+                lambda: htmlsafe_dumps({
+                    'id': activity['id'],
+                    'name': activity.get('name'),
+                    'url': url_for('activity_detail', activity_id=activity['id']),
+                    'coordinates': activity['decoded_polyline']
+                })
+            ))
+    return Markup(''.join(rows)), Markup('[' + ','.join(map_items) + ']')
+
+def conditional_page(key, etag, last_modified, ttl, render):
+    """
+    返回带ETag和Last-Modified的页面
+
+    浏览器已有相同版本（If-None-Match或If-Modified-Since匹配）时直接返回304，
+    否则优先使用缓存中同一版本的渲染结果，都没有时才调用render渲染。
+
+    Args:
+        key: 渲染结果的缓存键
+        etag: 由页面依赖的数据版本计算出的ETag
+        last_modified: 页面依赖的数据的最后更新时间（时间戳）
+        ttl: 渲染结果的缓存时间（秒）
+        render: 渲染页面的函数，获取数据失败时返回None（不缓存，返回500）
+    """
+    last_modified = datetime.utcfromtimestamp(int(last_modified))
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response_cache.count('not_modified')
+        response = make_response('', 304)
+    else:
+        entry = response_cache.get(key)
+        if entry is not None and entry['etag'] == etag:
+            body = entry['value']
+        else:
+            body = render()
+            if body is None:
+                return "获取数据失败，请稍后再试", 500
+            response_cache.put(key, body, ttl, etag=etag)
+        response = make_response(body)
     
-    return render_template('activities.html', 
-                          activities=selected_year_data['activities'],
-                          stats=selected_year_data['stats'],
-                          athlete=athlete_data,
-                          years=available_years,
-                          selected_year=selected_year)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # 页面包含个人数据，只允许浏览器缓存，每次使用前都要验证
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/route')
 def route_planner():
@@ -222,8 +498,13 @@ def callback():
     if not token_data:
         return "获取令牌失败"
     
-    # 保存令牌信息到session
+    # 登录后换用新的session id，登录前的id（可能被他人设置）不再有效
+    if hasattr(session, 'regenerate'):
+        session.regenerate()
+    
+    # 保存令牌信息到session，并缓存到服务端供其他worker共享
     save_token_to_session(token_data)
+    token_manager.store(session_token_key(), token_data)
     
     # 重定向到仪表盘页面
     return redirect(url_for('dashboard'))
@@ -255,22 +536,37 @@ def save_token_to_session(token_data):
     session['access_token'] = token_data.get('access_token')
     session['refresh_token'] = token_data.get('refresh_token')
     session['expires_at'] = token_data.get('expires_at')
+    athlete = token_data.get('athlete')
+    if athlete and athlete.get('id'):
+        session['athlete_id'] = athlete['id']
+
+def session_token_key():
+    """当前session对应的服务端令牌标识"""
+    return token_key(session.get('athlete_id'), session.get('refresh_token'))
+
+def admission_key(data_id=None):
+    """训练建议并发限制使用的标识：已登录时按运动员，否则按session id，新session按路线数据ID"""
+    key = session_token_key() if 'access_token' in session else None
+    if not key:
+        sid = getattr(session, 'sid', None)
+        # 反向代理后所有请求的客户端地址相同，不能按地址区分
+        key = f"session:{sid}" if sid and not session.new else f"data:{data_id or request.args.get('data_id')}"
+    return key
+
+def admission_rejected_response(rejected):
+    """超过并发限制时的429响应，Retry-After给出建议的重试时间"""
+    response = jsonify({'error': str(rejected), 'reason': rejected.reason, 'retry_after': rejected.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(rejected.retry_after)
+    return response
 
 def is_token_expired():
     """检查访问令牌是否已过期"""
-    expires_at = session.get('expires_at')
-    if not expires_at:
-        return True
-    
-    # 如果令牌将在1小时内过期，提前刷新
-    return datetime.now().timestamp() > expires_at - 3600
+    # 在过期前几分钟刷新；Strava在令牌剩余超过1小时时刷新只会返回同一个令牌
+    return needs_refresh(session.get('expires_at'))
 
-def refresh_token():
-    """使用刷新令牌获取新的访问令牌"""
-    refresh_token_value = session.get('refresh_token')
-    if not refresh_token_value:
-        return False
-    
+def request_token_refresh(refresh_token_value):
+    """向Strava发送刷新令牌请求"""
     payload = {
         'client_id': CLIENT_ID,
         'client_secret': CLIENT_SECRET,
@@ -281,13 +577,40 @@ def refresh_token():
     try:
         response = requests.post(TOKEN_URL, data=payload)
         if response.status_code == 200:
-            token_data = response.json()
-            save_token_to_session(token_data)
-            return True
-        return False
+            return response.json()
+        return None
     except Exception as e:
         print(f"刷新令牌时出错: {e}")
+        return None
+
+def refresh_token():
+    """使用刷新令牌获取新的访问令牌，同一运动员的并发刷新在所有worker间合并为一次请求"""
+    key = session_token_key()
+    if not key:
         return False
+    
+    token_data = token_manager.get_fresh_token(key, {
+        'access_token': session.get('access_token'),
+        'refresh_token': session.get('refresh_token'),
+        'expires_at': session.get('expires_at')
+    }, request_token_refresh)
+    if not token_data:
+        return False
+    
+    save_token_to_session(token_data)
+    return True
+
+def strava_get(url, **kwargs):
+    """
+    请求Strava API
+
+    请求前向调度器取得配额（没有配额时排队，超时抛出StravaRateLimited），
+    收到响应后按响应头同步所有worker共享的用量。
+    """
+    strava_scheduler.acquire()
+    response = requests.get(url, **kwargs)
+    strava_scheduler.observe(response.headers, response.status_code)
+    return response
 
 def get_athlete_data():
     """获取用户信息"""
@@ -298,7 +621,7 @@ def get_athlete_data():
     headers = {'Authorization': f'Bearer {access_token}'}
     
     try:
-        response = requests.get(ATHLETE_URL, headers=headers)
+        response = strava_get(ATHLETE_URL, headers=headers)
         return response.json() if response.status_code == 200 else None
     except Exception as e:
         print(f"获取用户信息时出错: {e}")
@@ -333,37 +656,13 @@ def get_activities(page=1, per_page=20, year=None):
         }
     
     try:
-        response = requests.get(ACTIVITIES_URL, params=params)
+        response = strava_get(ACTIVITIES_URL, params=params)
         response.raise_for_status()
         activities = response.json()
         
         # 处理每个活动的数据
         for activity in activities:
-            # 解码路线数据
-            if 'map' in activity and 'summary_polyline' in activity['map']:
-                activity['decoded_polyline'] = decode_polyline(activity['map']['summary_polyline'])
-            else:
-                activity['decoded_polyline'] = []
-            
-            # 格式化时间
-            start_date = datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ")
-            activity['formatted_date'] = start_date.strftime("%Y-%m-%d %H:%M")
-            activity['year'] = start_date.year
-            
-            # 格式化时长
-            elapsed_time = timedelta(seconds=activity['elapsed_time'])
-            hours = elapsed_time.seconds // 3600
-            minutes = (elapsed_time.seconds % 3600) // 60
-            activity['formatted_time'] = f"{hours}小时{minutes}分钟" if hours > 0 else f"{minutes}分钟"
-            
-            # 计算配速（分钟/公里）
-            if activity['distance'] > 0 and activity['moving_time'] > 0:
-                pace = (activity['moving_time'] / 60) / (activity['distance'] / 1000)
-                pace_minutes = int(pace)
-                pace_seconds = int((pace - pace_minutes) * 60)
-                activity['pace'] = f"{pace_minutes}'{ pace_seconds:02d}\""
-            else:
-                activity['pace'] = "N/A"
+            format_activity_summary(activity)
         
         return activities
     
@@ -371,9 +670,43 @@ def get_activities(page=1, per_page=20, year=None):
         print(f"获取活动列表失败: {e}")
         return None
 
-def get_activities_by_years():
-    """获取所有年份的活动数据"""
-    all_activities = get_activities(per_page=200)  # 获取最近的200个活动
+def format_activity_summary(activity):
+    """为活动列表计算路线、日期、时长和配速等展示字段"""
+    # 解码路线数据
+    if 'map' in activity and 'summary_polyline' in activity['map']:
+        activity['decoded_polyline'] = decode_polyline(activity['map']['summary_polyline'])
+    else:
+        activity['decoded_polyline'] = []
+    
+    # 格式化时间
+    start_date = datetime.strptime(activity['start_date_local'], "%Y-%m-%dT%H:%M:%SZ")
+    activity['formatted_date'] = start_date.strftime("%Y-%m-%d %H:%M")
+    activity['year'] = start_date.year
+    
+    # 格式化时长
+    elapsed_time = timedelta(seconds=activity['elapsed_time'])
+    hours = elapsed_time.seconds // 3600
+    minutes = (elapsed_time.seconds % 3600) // 60
+    activity['formatted_time'] = f"{hours}小时{minutes}分钟" if hours > 0 else f"{minutes}分钟"
+    
+    # 计算配速（分钟/公里）
+    if activity['distance'] > 0 and activity['moving_time'] > 0:
+        pace = (activity['moving_time'] / 60) / (activity['distance'] / 1000)
+        pace_minutes = int(pace)
+        pace_seconds = int((pace - pace_minutes) * 60)
+        activity['pace'] = f"{pace_minutes}'{ pace_seconds:02d}\""
+    else:
+        activity['pace'] = "N/A"
+    return activity
+
+def get_activities_by_years(all_activities=None):
+    """获取所有年份的活动数据
+    
+    Args:
+        all_activities: 已获取的活动列表（可选），为空时从Strava获取
+    """
+    if all_activities is None:
+        all_activities = get_activities(per_page=200)  # 获取最近的200个活动
     if not all_activities:
         return {}
     
@@ -407,74 +740,88 @@ def get_activities_by_years():
     
     return activities_by_year
 
-def get_activity_detail(activity_id):
+def fetch_activity(activity_id, access_token=None):
+    """从Strava获取单个活动的原始数据，默认使用当前session的令牌"""
+    access_token = access_token or session.get('access_token')
+    if not access_token:
+        return None
+    
+    headers = {'Authorization': f'Bearer {access_token}'}
+    url = ACTIVITY_URL.format(id=activity_id)
+    
+    try:
+        response = strava_get(url, headers=headers)
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception as e:
+        print(f"获取活动详情时出错: {e}")
+        return None
+
+def get_activity_detail(activity_id, access_token=None):
     """获取单个活动的详细信息
     
     Args:
         activity_id: 活动ID
+        access_token: 访问令牌（可选），默认使用当前session的令牌
         
     Returns:
         活动详情或None（如果获取失败）
     """
-    access_token = session.get('access_token')
-    if not access_token:
+    activity = fetch_activity(activity_id, access_token)
+    if activity is None:
         return None
-    
-    headers = {'Authorization': f'Bearer {access_token}'}
-    url = ACTIVITY_URL.format(id=activity_id)
-    
     try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            activity = response.json()
-            
-            # 处理日期时间格式
-            if 'start_date' in activity:
-                start_date = datetime.strptime(activity['start_date'], '%Y-%m-%dT%H:%M:%SZ')
-                activity['formatted_date'] = start_date.strftime('%Y-%m-%d %H:%M')
-            
-            # 转换时间（秒）为可读格式
-            if 'moving_time' in activity:
-                minutes, seconds = divmod(activity['moving_time'], 60)
-                hours, minutes = divmod(minutes, 60)
-                if hours > 0:
-                    activity['formatted_time'] = f"{hours}时{minutes}分{seconds}秒"
-                else:
-                    activity['formatted_time'] = f"{minutes}分{seconds}秒"
-            
-            if 'elapsed_time' in activity:
-                minutes, seconds = divmod(activity['elapsed_time'], 60)
-                hours, minutes = divmod(minutes, 60)
-                if hours > 0:
-                    activity['formatted_elapsed_time'] = f"{hours}时{minutes}分{seconds}秒"
-                else:
-                    activity['formatted_elapsed_time'] = f"{minutes}分{seconds}秒"
-            
-            # 转换距离（米）为千米
-            if 'distance' in activity:
-                activity['distance_km'] = round(activity['distance'] / 1000, 2)
-            
-            # 处理配速和速度
-            if 'average_speed' in activity:
-                if activity.get('type') == 'Run':
-                    # 跑步显示配速（分钟/公里）
-                    activity['pace'] = f"{(1000 / activity['average_speed'] / 60):.2f} 分钟/公里"
-                else:
-                    # 其他运动显示速度（公里/小时）
-                    activity['speed'] = f"{(activity['average_speed'] * 3.6):.1f} 公里/小时"
-            
-            if 'max_speed' in activity:
-                if activity.get('type') == 'Run':
-                    activity['max_pace'] = f"{(1000 / activity['max_speed'] / 60):.2f} 分钟/公里"
-                else:
-                    activity['max_speed_kmh'] = f"{(activity['max_speed'] * 3.6):.1f} 公里/小时"
-            
-            return activity
-        return None
+        return format_activity_detail(activity)
     except Exception as e:
         print(f"获取活动详情时出错: {e}")
         return None
 
+def format_activity_detail(activity):
+    """为活动详情页计算日期、时长、距离、配速和速度等展示字段"""
+    # 处理日期时间格式
+    if 'start_date' in activity:
+        start_date = datetime.strptime(activity['start_date'], '%Y-%m-%dT%H:%M:%SZ')
+        activity['formatted_date'] = start_date.strftime('%Y-%m-%d %H:%M')
+    
+    # 转换时间（秒）为可读格式
+    if 'moving_time' in activity:
+        minutes, seconds = divmod(activity['moving_time'], 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours > 0:
+            activity['formatted_time'] = f"{hours}时{minutes}分{seconds}秒"
+        else:
+            activity['formatted_time'] = f"{minutes}分{seconds}秒"
+    
+    if 'elapsed_time' in activity:
+        minutes, seconds = divmod(activity['elapsed_time'], 60)
+        hours, minutes = divmod(minutes, 60)
+        if hours > 0:
+            activity['formatted_elapsed_time'] = f"{hours}时{minutes}分{seconds}秒"
+        else:
+            activity['formatted_elapsed_time'] = f"{minutes}分{seconds}秒"
+    
+    # 转换距离（米）为千米
+    if 'distance' in activity:
+        activity['distance_km'] = round(activity['distance'] / 1000, 2)
+    
+    # 处理配速和速度
+    if 'average_speed' in activity:
+        if activity.get('type') == 'Run':
+            # 跑步显示配速（分钟/公里）
+            activity['pace'] = f"{(1000 / activity['average_speed'] / 60):.2f} 分钟/公里"
+        else:
+            # 其他运动显示速度（公里/小时）
+            activity['speed'] = f"{(activity['average_speed'] * 3.6):.1f} 公里/小时"
+    
+    if 'max_speed' in activity:
+        if activity.get('type') == 'Run':
+            activity['max_pace'] = f"{(1000 / activity['max_speed'] / 60):.2f} 分钟/公里"
+        else:
+            activity['max_speed_kmh'] = f"{(activity['max_speed'] * 3.6):.1f} 公里/小时"
+    
+    return activity
+
 def get_min_max_values(data):
     """获取数据的最小值和最大值
     
@@ -517,86 +864,39 @@ def upload_gpx():
             log_file.write(f"文件名: {file.filename}\n")
             log_file.write(f"会话内容: {dict(session)}\n")
         
-        # 保存文件到临时目录
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(file.filename))
+        # 保存文件到临时目录，文件名加上ID避免并发上传同名文件时互相覆盖
+        data_id = str(uuid.uuid4())
+        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{data_id}_{secure_filename(file.filename)}")
         file.save(temp_path)
+        file_size = os.path.getsize(temp_path)
         
-        # 读取GPX文件
-        with open(temp_path, 'r') as f:
-            gpx = gpxpy.parse(f)
-        
-        # 删除临时文件
-        os.remove(temp_path)
-        
-        # 提取轨迹点
-        points = []
-        distances = []
-        elevations = []
-        total_distance = 0
-        elevation_gain = 0
-        elevation_loss = 0
-        last_elevation = None
-        
-        for track in gpx.tracks:
-            for segment in track.segments:
-                last_point = None
-                for point in segment.points:
-                    points.append([point.latitude, point.longitude])
-                    elevations.append(point.elevation)
-                    
-                    if last_point:
-                        # 计算距离
-                        distance = geodesic(
-                            (last_point.latitude, last_point.longitude),
-                            (point.latitude, point.longitude)
-                        ).kilometers
-                        total_distance += distance
-                        distances.append(round(total_distance, 2))
-                        
-                        # 计算爬升和下降
-                        if last_elevation is not None:
-                            elevation_diff = point.elevation - last_elevation
-                            if elevation_diff > 0:
-                                elevation_gain += elevation_diff
-                            else:
-                                elevation_loss += abs(elevation_diff)
-                    else:
-                        distances.append(0)
-                    
-                    last_point = point
-                    last_elevation = point.elevation
+        race_date = request.form.get('race_date')
         
-        result = {
-            'points': points,
-            'stats': {
-                'distance': total_distance,
-                'elevation_gain': elevation_gain,
-                'elevation_loss': elevation_loss
-            },
-            'elevation_data': {
-                'distances': distances,
-                'elevations': elevations
-            }
-        }
-        
-        # 生成唯一ID并存储数据
-        data_id = str(uuid.uuid4())
-        data = {
-            'gpx_data': result,
-            'weather_data': [],
-            'timestamp': datetime.now().timestamp()
-        }
+        # 大文件在后台解析，立即返回任务ID，前端轮询任务状态
+        if file_size > GPX_ASYNC_BYTES:
+            save_data_to_file(data_id, {'job_status': 'pending', 'timestamp': datetime.now().timestamp()})
+            try:
+                submit_gpx_file(temp_path, lambda result, error: finish_gpx_job(data_id, temp_path, result, error, race_date))
+            except GpxPoolBusy:
+                os.remove(temp_path)
+                raise
+            with open("logs/upload_gpx_debug.log", "a") as log_file:
+                log_file.write(f"文件大小 {file_size} 字节，后台解析，任务ID: {data_id}\n")
+            return jsonify({
+                'job_id': data_id,
+                'status': 'pending',
+                'status_url': url_for('upload_gpx_status', job_id=data_id, encoding=request.args.get('encoding'))
+            }), 202
         
-        # 同时存储到内存和文件系统
-        temp_data_store[data_id] = data
-        save_data_to_file(data_id, data)
+        # 在进程池中解析GPX文件并计算路线数据，请求线程等待结果时不占用GIL
+        try:
+            result = analyze_gpx_file(temp_path)
+        finally:
+            # 删除临时文件
+            os.remove(temp_path)
         
-        # 记录生成的数据ID和数据存储情况
-        with open("logs/upload_gpx_debug.log", "a") as log_file:
-            log_file.write(f"生成的数据ID: {data_id}\n")
-            log_file.write(f"数据存储情况: gpx_data已保存, 数据包含 {len(points)} 个轨迹点\n")
-            log_file.write(f"temp_data_store中的keys: {list(temp_data_store.keys())}\n")
-            log_file.write(f"文件存储路径: {os.path.join(DATA_STORE_DIR, f'{data_id}.pkl')}\n")
+        store_gpx_result(data_id, result)
+        start_precompute(data_id, race_date)
         
         # 仅在session中存储数据ID
         session['data_id'] = data_id
@@ -610,59 +910,172 @@ def upload_gpx():
         # 在返回数据中包含data_id，便于前端存储
         result['data_id'] = data_id
         
-        return jsonify(result)
+        return route_response(result)
+    except GpxPoolBusy as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         app.logger.error(f"处理GPX文件时出错: {str(e)}")
         return jsonify({'error': f'处理GPX文件时出错: {str(e)}'}), 400
 
-def get_historical_weather(lat, lon, target_date):
+def store_gpx_result(data_id, result):
+    """保存GPX解析结果，供后续获取天气和训练建议使用"""
+    data = {
+        'gpx_data': result,
+        'weather_data': [],
+        'timestamp': datetime.now().timestamp()
+    }
+    
+    # 同时存储到内存和文件系统
+    temp_data_store[data_id] = data
+    save_data_to_file(data_id, data)
+    
+    # 记录生成的数据ID和数据存储情况
+    with open("logs/upload_gpx_debug.log", "a") as log_file:
+        log_file.write(f"生成的数据ID: {data_id}\n")
+        log_file.write(f"数据存储情况: gpx_data已保存, 数据包含 {len(result['points'])} 个轨迹点\n")
+        log_file.write(f"temp_data_store中的keys: {list(temp_data_store.keys())}\n")
+        log_file.write(f"文件存储路径: {os.path.join(DATA_STORE_DIR, f'{data_id}.pkl')}\n")
+
+def finish_gpx_job(data_id, temp_path, result, error, race_date=None):
+    """后台解析完成后保存结果，任务状态保存在data_store中，任一worker都可以查询"""
+    try:
+        os.remove(temp_path)
+    except OSError:
+        pass
+    if error is not None:
+        app.logger.error(f"后台解析GPX文件时出错: {str(error)}")
+        save_data_to_file(data_id, {'job_status': 'failed', 'error': str(error), 'timestamp': datetime.now().timestamp()})
+        return
+    store_gpx_result(data_id, result)
+    start_precompute(data_id, race_date)
+
+@app.route('/upload_gpx/status/<job_id>')
+def upload_gpx_status(job_id):
+    """查询后台GPX解析任务的状态，完成后返回与 /upload_gpx 相同的数据"""
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return jsonify({'error': '无效的任务ID'}), 400
+    
+    data = temp_data_store.get(job_id) or load_data_from_file(job_id)
+    if data is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    if data.get('job_status') == 'pending':
+        return jsonify({'job_id': job_id, 'status': 'pending'}), 202
+    if data.get('job_status') == 'failed':
+        return jsonify({'error': f"处理GPX文件时出错: {data.get('error')}"}), 400
+    
+    session['data_id'] = job_id
+    session.modified = True
+    
+    result = dict(data['gpx_data'])
+    result['data_id'] = job_id
+    return route_response(result)
+
+@app.route('/upload_gpx/precompute/<data_id>')
+def upload_gpx_precompute(data_id):
+    """查询上传后预计算任务的状态，包括每个步骤的状态和耗时"""
+    try:
+        uuid.UUID(data_id)
+    except ValueError:
+        return jsonify({'error': '无效的数据ID'}), 400
+    
+    # 预计算可能在其他worker中运行，直接读取文件中的最新状态
+    data = load_data_from_file(data_id)
+    if data is None:
+        return jsonify({'error': '路线数据不存在或已过期'}), 404
+    if not data.get('precompute'):
+        return jsonify({'data_id': data_id, 'status': 'none'})
+    return jsonify(dict(data['precompute'], data_id=data_id))
+
+def route_response(result):
     """
-    获取指定位置过去10年同一天的历史天气数据
+    返回路线数据
+
+    请求参数encoding=compact时返回紧凑格式（polyline和差分编码的海拔剖面），
+    并按Accept-Encoding压缩响应体。
     """
-    base_url = "https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/timeline"
+    if request.args.get('encoding') == 'compact':
+        result = encode_route_compact(result)
+    body = json.dumps(result, separators=(',', ':')).encode('utf-8')
+    response = Response(body, mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
     
-    # 构建过去10年的日期列表
-    current_year = datetime.now().year
-    dates = []
-    weather_data = []
+    content_encoding = choose_content_encoding(request.headers.get('Accept-Encoding'))
+    if content_encoding and len(body) >= COMPRESS_MIN_BYTES:
+        response.set_data(compress_body(body, content_encoding))
+        response.headers['Content-Encoding'] = content_encoding
+    return response
+
+@app.errorhandler(413)
+def request_entity_too_large(error):
+    return jsonify({'error': f'文件过大，最大支持 {GPX_MAX_BYTES // 1024 // 1024}MB'}), 413
+
+def fetch_weather_range(lat, lon, start, end):
+    """
+    请求指定位置一段日期的天气，Visual Crossing的timeline接口一次返回范围内每天的数据
+
+    Returns:
+        每天的天气记录列表，请求失败时返回None
+    """
+    params = {
+        'key': WEATHER_API_KEY,
+        'unitGroup': 'metric',
+        'include': 'days',
+        'elements': 'datetime,temp,humidity,precip,windspeed,conditions',
+        'contentType': 'json',
+    }
     
-    for year in range(current_year - 10, current_year):
-        historical_date = target_date.replace(year=year)
-        if historical_date < datetime.now():  # 只获取过去的日期
-            dates.append(historical_date.strftime("%Y-%m-%d"))
+    url = f"{WEATHER_BASE_URL}/{lat},{lon}/{start}/{end}"
     
-    # 获取每一年的天气数据
-    for date in dates:
-        params = {
-            'key': WEATHER_API_KEY,
-            'unitGroup': 'metric',
-            'include': 'current',
-            'elements': 'datetime,temp,humidity,precip,windspeed,conditions',
-            'contentType': 'json',
-        }
-        
-        url = f"{base_url}/{lat},{lon}/{date}"
+    try:
+        response = requests.get(url, params=params, timeout=WEATHER_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
         
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            if 'days' in data and len(data['days']) > 0:
-                day_data = data['days'][0]
-                weather_data.append({
-                    'date': date,
-                    'temperature': day_data.get('temp'),
-                    'humidity': day_data.get('humidity'),
-                    'precipitation': day_data.get('precip'),
-                    'windspeed': day_data.get('windspeed'),
-                    'conditions': day_data.get('conditions')
-                })
-        except Exception as e:
-            print(f"Error fetching weather data for {date}: {str(e)}")
-            continue
-    
-    return weather_data
+        return [{
+            'date': day_data.get('datetime'),
+            'temperature': day_data.get('temp'),
+            'humidity': day_data.get('humidity'),
+            'precipitation': day_data.get('precip'),
+            'windspeed': day_data.get('windspeed'),
+            'conditions': day_data.get('conditions')
+        } for day_data in data.get('days') or []]
+    except Exception as e:
+        print(f"Error fetching weather data for {start}~{end}: {str(e)}")
+    return None
+
+weather_fetcher = WeatherFetcher(response_cache, fetch_weather_range)
+# 上传GPX后在后台预计算路线摘要、取样点、天气和提示词数据，后续请求直接使用结果
+precompute_pipeline = PrecomputePipeline(update_data_entry)
+
+def start_precompute(data_id, race_date=None):
+    """提交路线的预计算任务；没有比赛日期时只计算与日期无关的步骤"""
+    if not PRECOMPUTE_ENABLED:
+        return
+    stored_data = temp_data_store.get(data_id) or load_data_from_file(data_id)
+    if not stored_data or not stored_data.get('gpx_data'):
+        return
+    steps = [
+        ('profile', profile_step),
+        ('geometry', lambda data: geometry_step(data, route_index.grid))
+    ]
+    try:
+        datetime.strptime(race_date or '', '%Y-%m-%d')
+    except ValueError:
+        race_date = None
+    if race_date:
+        steps.append(('weather', lambda data: weather_step(data, race_date, weather_fetcher)))
+        steps.append(('prompt', lambda data: prompt_step(data, race_date, ai_service)))
+    precompute_pipeline.submit(data_id, stored_data, steps)
+
+def get_historical_weather(lat, lon, target_date):
+    """
+    获取指定位置过去10年同一天的历史天气数据
+
+    每年请求目标日期前后的一段日期（同时用于气候统计），各年份并发请求，按天气网格缓存。
+    """
+    return weather_fetcher.history(weather_cell(float(lat), float(lon)), target_date)
 
 @app.route('/get_weather_data', methods=['POST'])
 def get_weather_data():
@@ -672,30 +1085,35 @@ def get_weather_data():
         lon = data.get('longitude')
         target_date = datetime.strptime(data.get('date'), '%Y-%m-%d')
         
+        date = target_date.strftime('%Y-%m-%d')
+        cell = weather_cell(float(lat), float(lon))
+        
+        # 上传后的预计算已经获取了同一位置和日期的天气时直接使用
+        data_id = session.get('data_id')
+        stored_data = (temp_data_store.get(data_id) or load_data_from_file(data_id)) if data_id else None
+        if stored_data:
+            stored_data = wait_for_precompute(data_id, stored_data, 'weather')
+        prepared = stored_data and stored_data.get('weather_climate')
+        if prepared and prepared.get('date') == date and stored_data.get('weather_cell') == list(cell):
+            return jsonify({
+                'status': 'success',
+                'data': stored_data.get('weather_data', []),
+                'climate': prepared
+            })
+        
         historical_weather = get_historical_weather(lat, lon, target_date)
+        climate = weather_fetcher.climatology([cell], target_date).get(cell)
+        if climate is not None:
+            climate['date'] = date
         
         # 检查session中是否有数据ID
-        data_id = session.get('data_id')
         if data_id:
-            # 先检查内存数据
-            if data_id in temp_data_store:
-                # 更新内存中的天气数据
-                temp_data_store[data_id]['weather_data'] = historical_weather
-                # 同时更新文件系统
-                save_data_to_file(data_id, temp_data_store[data_id])
+            # 在锁内合并到最新的数据中，避免覆盖后台预计算的结果
+            if update_data_entry(data_id, {'weather_data': historical_weather, 'weather_climate': climate,
+                                           'weather_cell': list(cell)}) is not None:
                 print(f"已更新内存和文件系统中的天气数据: {data_id}")
             else:
-                # 尝试从文件系统加载
-                stored_data = load_data_from_file(data_id)
-                if stored_data:
-                    # 更新数据
-                    stored_data['weather_data'] = historical_weather
-                    # 保存到内存和文件系统
-                    temp_data_store[data_id] = stored_data
-                    save_data_to_file(data_id, stored_data)
-                    print(f"已从文件加载并更新天气数据: {data_id}")
-                else:
-                    print(f"未找到数据ID来更新天气: {data_id}")
+                print(f"未找到数据ID来更新天气: {data_id}")
             
             # 记录日志
             with open("logs/weather_data_debug.log", "a") as log_file:
@@ -708,7 +1126,8 @@ def get_weather_data():
         
         return jsonify({
             'status': 'success',
-            'data': historical_weather
+            'data': historical_weather,
+            'climate': climate
         })
     except Exception as e:
         print(f"获取天气数据出错: {str(e)}")
@@ -720,11 +1139,65 @@ def get_weather_data():
             'message': str(e)
         }), 500
 
+@app.route('/get_route_weather', methods=['POST'])
+def get_route_weather():
+    """
+    沿比赛路线多点取样的历史天气
+
+    在起点、终点、最高点和途中约每隔一个补给站距离取样，并发获取各点过去10年比赛日前后的天气
+    并计算气候统计，气温按海拔修正，结果保存到路线数据中供训练建议使用。
+    """
+    try:
+        data = request.get_json() or {}
+        data_id = data.get('data_id') or session.get('data_id')
+        target_date = datetime.strptime(data.get('date'), '%Y-%m-%d')
+        
+        stored_data = (temp_data_store.get(data_id) or load_data_from_file(data_id)) if data_id else None
+        if not stored_data or not stored_data.get('gpx_data'):
+            return jsonify({'status': 'error', 'message': '未找到GPX数据，请先上传路线'}), 404
+        
+        # 之前已经计算了同一日期的天气表时直接返回（预计算不获取天气表，只在这里按需计算）
+        prepared = stored_data.get('route_weather')
+        if prepared and prepared.get('date') == target_date.strftime('%Y-%m-%d'):
+            return jsonify({
+                'status': 'success',
+                'data': prepared
+            })
+        
+        start = time.time()
+        route_weather = build_route_weather(stored_data['gpx_data'], target_date, weather_fetcher)
+        
+        update_data_entry(data_id, {'route_weather': route_weather})
+        
+        with open("logs/weather_data_debug.log", "a") as log_file:
+            log_file.write(f"\n====== 沿路线天气 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======\n")
+            log_file.write(f"数据ID: {data_id}, 取样点: {len(route_weather['sections'])}, 天气网格: {route_weather['cells']}, "
+                           f"耗时: {time.time() - start:.2f}秒\n")
+            log_file.write(f"请求统计: {weather_fetcher.stats()}\n")
+        
+        return jsonify({
+            'status': 'success',
+            'data': route_weather
+        })
+    except Exception as e:
+        print(f"获取沿路线天气出错: {str(e)}")
+        with open("logs/weather_data_debug.log", "a") as log_file:
+            log_file.write(f"\n====== 沿路线天气错误 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======\n")
+            log_file.write(f"错误: {str(e)}\n")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
 @app.route('/get_training_advice')
 def get_training_advice():
     """
     获取训练建议的流式响应
+
+    请求先经过准入控制：同一session已有请求或队列已满时直接返回429；
+    否则在SSE中返回排队位置（queue_position），取得生成名额后开始生成。
     """
+    ticket = None
     try:
         # 添加调试日志
         print("\n====== 训练建议请求 ======")
@@ -738,7 +1211,8 @@ def get_training_advice():
             log_file.write(f"时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             log_file.write(f"会话内容: {dict(session)}\n")
             log_file.write(f"临时数据存储Keys: {list(temp_data_store.keys())}\n")
-            log_file.write(f"数据存储目录文件数: {len(os.listdir(DATA_STORE_DIR))}\n")
+            last_sweep = read_last_sweep(DATA_STORE_DIR) or {}
+            log_file.write(f"数据存储目录文件数(上次清理后): {last_sweep.get('files_after')}\n")
             log_file.write(f"请求参数: {request.args}\n")
         
         # 首先尝试从URL参数获取data_id，如果没有再从session获取
@@ -757,6 +1231,7 @@ def get_training_advice():
         if data_id in temp_data_store:
             stored_data = temp_data_store[data_id]
             data_source = "内存"
+            touch_data_file(DATA_STORE_DIR, data_id)
         else:
             # 如果内存中没有，尝试从文件加载
             file_data = load_data_from_file(data_id)
@@ -787,9 +1262,27 @@ def get_training_advice():
                 log_file.write("错误: 未提供比赛日期\n")
             return jsonify({'error': '请提供比赛日期'}), 400
         
+        # 准入控制：在等待预计算和准备提示词数据之前判断，超限的请求不占用worker
+        try:
+            ticket = llm_admission.enqueue(admission_key(data_id))
+        except AdmissionRejected as rejected:
+            with open("logs/training_advice_debug.log", "a") as log_file:
+                log_file.write(f"拒绝请求({rejected.reason}): {rejected}，{rejected.retry_after}秒后重试\n")
+            return admission_rejected_response(rejected)
+        
+        # 上传后的预计算还在准备提示词数据时等待其结果
+        stored_data = wait_for_precompute(data_id, stored_data, 'prompt')
+        
         # 从存储中获取数据
         gpx_data = stored_data.get('gpx_data')
         weather_data = stored_data.get('weather_data', [])
+        # 优先使用沿路线的天气表，其次是起点的气候统计，都只在日期与本次比赛日期一致时使用
+        weather_text = weather_text_for_date(stored_data, match_date)
+        # 预先准备的路线和天气数据，日期或天气已变化时只复用路线摘要
+        prompt_data = stored_prompt_data(stored_data, match_date, weather_text)
+        if prompt_data is None:
+            prompt_data = ai_service.prepare_prompt_data(gpx_data, weather_data, weather_text=weather_text,
+                                                         route_summary=stored_route_summary(stored_data))
         
         # 检查是否使用自定义提示词
         use_custom_prompts = request.args.get('custom_prompts', 'false').lower() == 'true'
@@ -812,13 +1305,38 @@ def get_training_advice():
             print("GPX数据结构不完整:", gpx_data)
             with open("logs/training_advice_debug.log", "a") as log_file:
                 log_file.write(f"错误: GPX数据结构不完整: {gpx_data}\n")
+            llm_admission.release(ticket)
             return jsonify({'error': 'GPX数据不完整，请重新上传'}), 400
         
+        # 已登录时加入训练地形对比，只汇总已保存的直方图，不请求Strava
+        terrain_text = None
+        load_text = None
+        if 'access_token' in session:
+            owner = session_token_key()
+            try:
+                terrain_text = render_terrain_comparison(
+                    build_terrain_comparison(owner, gpx_data, race=stored_grade_histogram(stored_data)))
+            except Exception as e:
+                print(f"计算训练地形对比出错: {e}")
+            try:
+                sync_training_loads(owner)
+                load_text = render_training_load(summarize_load(load_series(training_loads.daily_loads(owner))))
+            except Exception as e:
+                print(f"计算训练负荷出错: {e}")
+        
         # 创建一个标准生成器函数，包装异步生成器的结果
         def generate():
             # 发送一个注释作为保活消息
             yield "data: {\"text\": \"正在准备训练建议...\"}\n\n"
             
+            # 排队等待生成名额，位置变化时通知客户端
+            try:
+                for position in llm_admission.wait(ticket):
+                    yield sse_event({'queue_position': position})
+            except AdmissionRejected as rejected:
+                yield sse_event({'error': str(rejected), 'retry_after': rejected.retry_after})
+                return
+            
             # 创建事件循环
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
@@ -833,67 +1351,47 @@ def get_training_advice():
                     last_ping_time = start_time
                     ping_interval = 10  # 10秒发送一次保活消息
                     
-                    # 构建请求超时设置
-                    timeout = aiohttp.ClientTimeout(total=300)  # 5分钟总超时
-                    
-                    # 初始化缓冲区和计数器
-                    buffer = ""
-                    buffer_size = 1  # 调整为较小的值使更快响应
+                    # 请求超时使用AIService的默认设置（5分钟总超时）
+                    timeout = None
                     
                     # 根据是否使用自定义提示词来调用不同的方法
                     if use_custom_prompts and custom_system_prompt and custom_user_prompt:
-                        async for text_chunk in ai_service.generate_training_advice_stream_with_custom_prompts(
+                        text_stream = ai_service.generate_training_advice_stream_with_custom_prompts(
                             gpx_data, 
                             weather_data, 
                             match_date, 
                             custom_system_prompt, 
                             custom_user_prompt,
-                            timeout=timeout
-                        ):
-                            # 确保文本是字符串
-                            if isinstance(text_chunk, str):
-                                # 添加到缓冲区
-                                buffer += text_chunk
-                                
-                                # 发送保活消息
-                                current_time = time.time()
-                                if current_time - last_ping_time > ping_interval:
-                                    yield f"data: {json.dumps({'ping': True})}\n\n"
-                                    last_ping_time = current_time
-                                
-                                # 当缓冲区达到一定大小或包含完整句子时发送
-                                if len(buffer) >= buffer_size or any(end in buffer for end in ['.', '!', '?', '\n']):
-                                    yield f"data: {json.dumps({'text': buffer})}\n\n"
-                                    buffer = ""
+                            timeout=timeout,
+                            terrain_text=terrain_text,
+                            load_text=load_text,
+                            weather_text=weather_text,
+                            prompt_data=prompt_data
+                        )
                     else:
-                        async for text_chunk in ai_service.generate_training_advice_stream(
+                        text_stream = ai_service.generate_training_advice_stream(
                             gpx_data, 
                             weather_data, 
                             match_date,
-                            timeout=timeout
-                        ):
-                            # 确保文本是字符串
-                            if isinstance(text_chunk, str):
-                                # 添加到缓冲区
-                                buffer += text_chunk
-                                
-                                # 发送保活消息
-                                current_time = time.time()
-                                if current_time - last_ping_time > ping_interval:
-                                    yield f"data: {json.dumps({'ping': True})}\n\n"
-                                    last_ping_time = current_time
-                                
-                                # 当缓冲区达到一定大小或包含完整句子时发送
-                                if len(buffer) >= buffer_size or any(end in buffer for end in ['.', '!', '?', '\n']):
-                                    yield f"data: {json.dumps({'text': buffer})}\n\n"
-                                    buffer = ""
+                            timeout=timeout,
+                            terrain_text=terrain_text,
+                            load_text=load_text,
+                            weather_text=weather_text,
+                            prompt_data=prompt_data
+                        )
                     
-                    # 发送剩余的缓冲区内容
-                    if buffer:
-                        yield f"data: {json.dumps({'text': buffer})}\n\n"
+                    # 按时间预算或字节阈值合并上游文本块，减少SSE帧数量
+                    async for text in coalesce_stream(text_stream):
+                        # 发送保活消息
+                        current_time = time.time()
+                        if current_time - last_ping_time > ping_interval:
+                            yield sse_event({'ping': True})
+                            last_ping_time = current_time
+                        
+                        yield sse_event({'text': text})
                     
                     # 发送完成消息
-                    yield f"data: {json.dumps({'complete': True})}\n\n"
+                    yield sse_event({'complete': True})
                     
                 except Exception as e:
                     error_msg = str(e)
@@ -905,7 +1403,7 @@ def get_training_advice():
                         log_file.write(f"\n====== 训练建议错误 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======\n")
                         log_file.write(f"错误信息: {error_msg}\n")
                         log_file.write(f"堆栈信息: {trace}\n")
-                    yield f"data: {json.dumps({'error': error_msg})}\n\n"
+                    yield sse_event({'error': error_msg})
             
             # 创建一个任务用于获取所有chunks
             async def get_all_chunks():
@@ -925,6 +1423,7 @@ def get_training_advice():
                         break
             finally:
                 loop.close()
+                llm_admission.release(ticket)
         
         # 设置响应头，禁用缓存
         headers = {
@@ -932,12 +1431,17 @@ def get_training_advice():
             'X-Accel-Buffering': 'no'  # 禁用Nginx缓冲
         }
         
-        return Response(
+        response = Response(
             generate(), 
             mimetype='text/event-stream', 
             headers=headers
         )
+        # 客户端在生成器开始之前断开时，生成器中的finally不会执行
+        response.call_on_close(lambda: llm_admission.release(ticket))
+        return response
     except Exception as e:
+        if ticket:
+            llm_admission.release(ticket)
         print(f"训练建议路由出错: {str(e)}")
         import traceback
         trace = traceback.format_exc()
@@ -957,7 +1461,7 @@ def cleanup_temp_data():
         log_file.write(f"\n====== 清理临时数据 {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======\n")
         log_file.write(f"当前数据ID列表: {list(temp_data_store.keys())}\n")
     
-    for data_id, data in temp_data_store.items():
+    for data_id, data in list(temp_data_store.items()):
         # 数据存储超过24小时则清理（原先是2小时）
         if current_time - data.get('timestamp', 0) > 24 * 60 * 60:
             expired_ids.append(data_id)
@@ -971,61 +1475,133 @@ def cleanup_temp_data():
     with open("logs/cleanup_temp_data.log", "a") as log_file:
         log_file.write(f"清理后的数据ID列表: {list(temp_data_store.keys())}\n")
 
+@app.before_first_request
+def start_background_tasks():
+    """启动后台任务：定期清理内存和data_store目录中的过期数据，处理Strava推送事件"""
+    start_sweeper(DATA_STORE_DIR, on_tick=cleanup_temp_data)
+    if STRAVA_WEBHOOK_ENABLED:
+        start_webhook_worker(webhook_queue, handle_strava_event)
+
 @app.route('/activity/<int:activity_id>')
 def activity_detail(activity_id):
     """活动详情页面
     
+    页面只依赖活动详情，流数据由页面加载后通过activity_streams_data获取，
+    不必等待两次Strava请求都完成才显示页面。
+    
     Args:
         activity_id: 活动ID
     """
-    # 获取活动详情
-    activity = get_activity_detail(activity_id)
-    if not activity:
+    owner = session_token_key()
+    activity_key = f"activity:{owner}:{activity_id}"
+    
+    # 已完成的活动基本不变，详情长期缓存，重复访问不再请求Strava
+    activity_meta = response_cache.ensure(activity_key, ACTIVITY_CACHE_TTL, lambda: get_activity_detail(activity_id))
+    if not activity_meta:
         return "获取活动详情失败", 500
     
-    # 获取活动的GPS点数据
-    points = []
-    start_lat = None
-    start_lng = None
+    etag = make_etag(activity_meta['etag'], TEMPLATE_VERSION)
+    last_modified = max(activity_meta['updated_at'], TEMPLATE_MTIME)
     
-    if activity.get('map') and activity['map'].get('polyline'):
-        points = decode_polyline(activity['map']['polyline'])
-        if points:
-            start_lat = points[0][0]
-            start_lng = points[0][1]
+    def render():
+        # 获取活动详情
+        activity_entry = response_cache.get_or_fetch(activity_key, ACTIVITY_CACHE_TTL, lambda: get_activity_detail(activity_id))
+        if not activity_entry:
+            return None
+        activity = activity_entry['value']
+        
+        # 获取活动的GPS点数据
+        points = []
+        start_lat = None
+        start_lng = None
+        
+        if activity.get('map') and activity['map'].get('polyline'):
+            points = decode_polyline(activity['map']['polyline'])
+            if points:
+                start_lat = points[0][0]
+                start_lng = points[0][1]
+        
+        # 获取分段数据
+        segments = get_activity_segments(activity)
+        
+        # 详情和路线序列化为JSON后按活动和数据版本缓存
+        activity_version = activity_entry['etag']
+        return render_template('activity_detail.html',
+                             activity=activity,
+                             activity_json=Markup(fragment_cache.get_or_render(
+                                 'activity_json', activity_id, activity_version, lambda: htmlsafe_dumps(activity))),
+                             points_json=Markup(fragment_cache.get_or_render(
+                                 'points_json', activity_id, activity_version, lambda: htmlsafe_dumps(points))),
+                             points=points,
+                             start_lat=start_lat,
+                             start_lng=start_lng,
+                             segments=segments)
     
-    # 获取活动的流数据（心率、配速等）
-    streams = get_activity_streams(activity_id)
+    return conditional_page(f"page:activity:{owner}:{activity_id}", etag, last_modified, ACTIVITY_CACHE_TTL, render)
+
+@app.route('/activity/<int:activity_id>/streams')
+def activity_streams_data(activity_id):
+    """活动的流数据，供详情页的图表在页面加载后获取
     
-    # 获取分段数据
-    segments = get_activity_segments(activity)
+    keys参数为逗号分隔的字段（默认distance,pace,heartrate,altitude），points参数为最多返回的点数。
+    每个字段降采样后按字段保留小数位，以紧凑的数组返回，并支持ETag条件请求和压缩。
     
-    return render_template('activity_detail.html',
-                         activity=activity,
-                         points=points,
-                         start_lat=start_lat,
-                         start_lng=start_lng,
-                         streams=streams,
-                         segments=segments)
+    Args:
+        activity_id: 活动ID
+    """
+    keys = [key for key in request.args.get('keys', 'distance,pace,heartrate,altitude').split(',') if key]
+    unknown = [key for key in keys if key not in STREAM_DECIMALS]
+    if not keys or unknown:
+        return jsonify({'error': '不支持的流数据字段', 'keys': list(STREAM_DECIMALS)}), 400
+    points = min(max(request.args.get('points', STREAM_POINTS, type=int), 10), 5000)
+    
+    owner = session_token_key()
+    streams_key = f"streams:{owner}:{activity_id}"
+    streams_meta = response_cache.ensure(streams_key, ACTIVITY_CACHE_TTL, lambda: get_activity_streams(activity_id))
+    if not streams_meta:
+        return jsonify({'error': '获取活动流数据失败'}), 502
+    
+    etag = make_etag(streams_meta['etag'], keys, points)
+    if not is_resource_modified(request.environ, etag=etag):
+        response_cache.count('not_modified')
+        response = make_response('', 304)
+    else:
+        def render():
+            streams_entry = response_cache.get(streams_key)
+            result = compact_streams(streams_entry['value'] if streams_entry else {}, keys, points)
+            result['activity_id'] = activity_id
+            return json.dumps(result, separators=(',', ':'))
+        body = fragment_cache.get_or_render('streams_data', (activity_id, tuple(keys), points), etag, render).encode('utf-8')
+        response = Response(body, mimetype='application/json')
+        response.headers['Vary'] = 'Accept-Encoding'
+        content_encoding = choose_content_encoding(request.headers.get('Accept-Encoding'))
+        if content_encoding and len(body) >= COMPRESS_MIN_BYTES:
+            response.set_data(compress_body(body, content_encoding))
+            response.headers['Content-Encoding'] = content_encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-def get_activity_streams(activity_id):
+def get_activity_streams(activity_id, access_token=None):
     """获取活动的流数据
     
     Args:
         activity_id: 活动ID
+        access_token: 访问令牌（可选），默认使用当前session的令牌
     """
-    if 'access_token' not in session:
+    access_token = access_token or session.get('access_token')
+    if not access_token:
         return None
     
-    headers = {'Authorization': f'Bearer {session["access_token"]}'}
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}/streams"
+    headers = {'Authorization': f'Bearer {access_token}'}
+    url = ACTIVITY_STREAMS_URL.format(id=activity_id)
     params = {
         'keys': 'time,distance,heartrate,cadence,watts,altitude,velocity_smooth,grade_smooth',
         'key_by_type': True
     }
     
     try:
-        response = requests.get(url, headers=headers, params=params)
+        response = strava_get(url, headers=headers, params=params)
         if response.status_code == 200:
             data = response.json()
             streams = {
@@ -1097,15 +1673,587 @@ def format_duration(seconds):
         return f"{hours}:{minutes:02d}:{seconds:02d}"
     return f"{minutes}:{seconds:02d}"
 
+@app.route('/webhook/strava', methods=['GET'])
+def strava_webhook_validate():
+    """Strava创建推送订阅时的验证请求，原样返回hub.challenge"""
+    if (not STRAVA_WEBHOOK_VERIFY_TOKEN
+            or request.args.get('hub.mode') != 'subscribe'
+            or request.args.get('hub.verify_token') != STRAVA_WEBHOOK_VERIFY_TOKEN):
+        return jsonify({'error': '验证失败'}), 403
+    return jsonify({'hub.challenge': request.args.get('hub.challenge')})
+
+@app.route('/webhook/strava', methods=['POST'])
+def strava_webhook_event():
+    """接收Strava推送事件，入队后立即返回，由后台线程处理"""
+    if not STRAVA_WEBHOOK_ENABLED:
+        return jsonify({'error': '未启用Strava推送'}), 404
+    
+    event = request.get_json(silent=True) or {}
+    if str(event.get('subscription_id')) != STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+        return jsonify({'error': '订阅ID不匹配'}), 403
+    if (event.get('object_type') not in ('activity', 'athlete')
+            or event.get('aspect_type') not in ('create', 'update', 'delete')
+            or not isinstance(event.get('object_id'), int)
+            or not isinstance(event.get('owner_id'), int)):
+        return jsonify({'error': '无效的事件'}), 400
+    
+    webhook_queue.enqueue(event)
+    return jsonify({'status': 'ok'})
+
+def strava_authorization_revoked(owner):
+    """
+    向Strava确认运动员已取消授权，避免伪造的推送事件删除数据
+
+    用保存的刷新令牌换取新令牌：Strava拒绝（400/401）说明授权已撤销；换取成功说明仍有授权，
+    保存新令牌。网络错误或Strava暂时不可用时抛出异常，事件稍后重试。
+
+    Returns:
+        True表示确认已取消授权，仍有授权或没有保存令牌时返回False
+    """
+    token = token_manager.get(owner)
+    if not token or not token.get('refresh_token'):
+        return False
+    response = requests.post(TOKEN_URL, data={
+        'client_id': CLIENT_ID,
+        'client_secret': CLIENT_SECRET,
+        'refresh_token': token['refresh_token'],
+        'grant_type': 'refresh_token'
+    }, timeout=WEBHOOK_STRAVA_WAIT)
+    if response.status_code in (400, 401):
+        return True
+    if response.status_code != 200:
+        raise RuntimeError(f"确认取消授权失败: HTTP {response.status_code}")
+    token_manager.store(owner, response.json())
+    return False
+
+def handle_strava_event(event):
+    """
+    处理一个Strava推送事件
+
+    - 活动创建/修改：用运动员的令牌获取活动详情和流数据存入缓存，并更新缓存的活动列表，
+      用户访问时不需要再请求Strava
+    - 活动删除：从缓存中删除该活动，并从缓存的活动列表中移除
+    - 运动员取消授权：向Strava确认后删除令牌和该运动员的所有缓存数据
+    """
+    owner = token_key(event['owner_id'])
+    
+    if event['object_type'] == 'athlete':
+        if str((event.get('updates') or {}).get('authorized')).lower() == 'false':
+            if not strava_authorization_revoked(owner):
+                print(f"运动员 {event['owner_id']} 的授权仍然有效，忽略取消授权事件")
+                return
+            token_manager.delete(owner)
+            route_index.remove_owner(owner)
+            terrain_store.remove_owner(owner)
+            grade_pace_store.remove_owner(owner)
+            training_loads.remove_owner(owner)
+            for prefix in (f"activities:{owner}", f"athlete:{owner}", f"activity:{owner}:", f"streams:{owner}:",
+                           f"page:dashboard:{owner}:", f"page:activity:{owner}:"):
+                response_cache.delete_prefix(prefix)
+        else:
+            response_cache.delete(f"athlete:{owner}")
+        return
+    
+    activity_id = event['object_id']
+    if event['aspect_type'] == 'delete':
+        for key in (f"activity:{owner}:{activity_id}", f"streams:{owner}:{activity_id}", f"page:activity:{owner}:{activity_id}"):
+            response_cache.delete(key)
+        update_cached_activity_list(owner, activity_id, None)
+        route_index.remove(owner, activity_id)
+        terrain_store.remove(owner, activity_id)
+        grade_pace_store.remove(owner, activity_id)
+        training_loads.remove(owner, activity_id)
+        return
+    
+    # 没有保存令牌的运动员（从未在本应用登录过）不需要预取
+    token = token_manager.get_fresh_token(owner, None, request_token_refresh)
+    if not token:
+        return
+    
+    # 预取是后台任务，接近限额时让出配额给用户访问，事件延后处理
+    with strava_priority(BACKGROUND, timeout=WEBHOOK_STRAVA_WAIT) as strava:
+        activity = fetch_activity(activity_id, token['access_token'])
+        if activity is None:
+            raise strava.limited or RuntimeError(f"获取活动 {activity_id} 失败")
+        streams = get_activity_streams(activity_id, token['access_token'])
+        if streams is None and strava.limited:
+            # 流数据因接近限额被拒绝时不保存不完整的结果，整个事件延后处理
+            raise strava.limited
+    
+    response_cache.put(f"activity:{owner}:{activity_id}", format_activity_detail(copy.deepcopy(activity)), ACTIVITY_CACHE_TTL)
+    if streams is not None:
+        response_cache.put(f"streams:{owner}:{activity_id}", streams, ACTIVITY_CACHE_TTL)
+    summary = format_activity_summary(activity_summary(activity))
+    update_cached_activity_list(owner, activity_id, summary)
+    route_index.add_activities(owner, [summary])
+    training_loads.add_many(owner, [(summary, streams)])
+    if streams is not None and (summary.get('sport_type') or summary.get('type')) in TERRAIN_SPORT_TYPES:
+        terrain_store.add_many(owner, [(summary, streams)])
+        grade_pace_store.add_many(owner, [(summary, streams)])
+
+# 活动列表中保存的字段，与Strava活动列表接口返回的字段对应
+ACTIVITY_SUMMARY_FIELDS = (
+    'id', 'name', 'type', 'sport_type', 'distance', 'moving_time', 'elapsed_time', 'total_elevation_gain',
+    'start_date', 'start_date_local', 'average_speed', 'max_speed', 'average_heartrate', 'max_heartrate'
+)
+
+def activity_summary(activity):
+    """从活动详情中取出活动列表需要的字段"""
+    summary = {key: activity[key] for key in ACTIVITY_SUMMARY_FIELDS if key in activity}
+    if activity.get('map'):
+        summary['map'] = {'summary_polyline': activity['map'].get('summary_polyline') or ''}
+    return summary
+
+def update_cached_activity_list(owner, activity_id, summary):
+    """
+    在缓存的活动列表中替换、插入或删除一个活动（summary为None时删除）
+
+    列表未缓存时不做处理，用户下次访问时会完整拉取。
+    """
+    def apply(activities):
+        activities = [a for a in activities if a.get('id') != activity_id]
+        if summary is not None:
+            activities.append(summary)
+            # 与Strava接口一致，按开始时间倒序，只保留最近的200个
+            activities.sort(key=lambda a: a.get('start_date_local', ''), reverse=True)
+            activities = activities[:200]
+        return activities
+    
+    response_cache.update(f"activities:{owner}", ACTIVITIES_CACHE_TTL, apply)
+
+@app.route('/route/overlapping_activities')
+def overlapping_activities():
+    """
+    查找与上传的比赛路线重合或在其附近的历史活动
+
+    路线通过data_id参数指定（默认使用session中最近上传的路线）。
+    """
+    if 'access_token' not in session:
+        return jsonify({'error': '请先登录Strava'}), 401
+    if is_token_expired() and not refresh_token():
+        return jsonify({'error': '请重新登录Strava'}), 401
+    
+    data_id = request.args.get('data_id') or session.get('data_id')
+    stored_data = (temp_data_store.get(data_id) or load_data_from_file(data_id)) if data_id else None
+    if not stored_data or 'gpx_data' not in stored_data:
+        return jsonify({'error': '路线数据不存在或已过期，请重新上传GPX文件'}), 404
+    
+    start = time.perf_counter()
+    owner = session_token_key()
+    sync_route_index(owner)
+    result = route_index.query(owner, stored_data['gpx_data']['points'],
+                               limit=request.args.get('limit', 20, type=int),
+                               samples=stored_route_samples(stored_data, route_index.grid))
+    result['query_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return jsonify(result)
+
+def sync_route_index(owner):
+    """
+    把缓存的活动列表中新增或路线有变化的活动加入空间索引
+
+    按活动列表缓存的ETag判断，列表没有变化时只需一次查询。
+    推送事件更新的活动已由handle_strava_event直接写入索引。
+    """
+    activities_key = f"activities:{owner}"
+    meta = response_cache.ensure(activities_key, ACTIVITIES_CACHE_TTL, lambda: get_activities(per_page=200) or None)
+    if meta is None or meta['etag'] == route_index.source_etag(owner):
+        return
+    entry = response_cache.get(activities_key)
+    if entry is None:
+        return
+    indexed = route_index.add_activities(owner, entry['value'])
+    route_index.set_source_etag(owner, entry['etag'])
+    if indexed:
+        print(f"空间索引新增 {indexed} 个活动: {owner}")
+
+@app.route('/route/terrain_comparison')
+def terrain_comparison():
+    """
+    对比上传的比赛路线与运动员训练中的坡度分布和各坡度配速
+
+    路线通过data_id参数指定（默认使用session中最近上传的路线），days参数限制训练历史的天数。
+    """
+    if 'access_token' not in session:
+        return jsonify({'error': '请先登录Strava'}), 401
+    if is_token_expired() and not refresh_token():
+        return jsonify({'error': '请重新登录Strava'}), 401
+    
+    data_id = request.args.get('data_id') or session.get('data_id')
+    stored_data = (temp_data_store.get(data_id) or load_data_from_file(data_id)) if data_id else None
+    if not stored_data or 'gpx_data' not in stored_data:
+        return jsonify({'error': '路线数据不存在或已过期，请重新上传GPX文件'}), 404
+    
+    owner = session_token_key()
+    pending = sync_terrain_histograms(owner)
+    result = build_terrain_comparison(owner, stored_data['gpx_data'], request.args.get('days', type=int),
+                                      race=stored_grade_histogram(stored_data))
+    result['pending_activities'] = pending
+    return jsonify(result)
+
+def sync_terrain_histograms(owner, fetch_limit=None):
+    """
+    为缓存的活动列表中还没有直方图的跑步活动计算直方图
+
+    优先使用缓存的流数据，缓存中没有时最多向Strava请求fetch_limit个活动的流数据。
+
+    Returns:
+        仍未计算直方图的活动数量
+    """
+    if fetch_limit is None:
+        fetch_limit = TERRAIN_SYNC_FETCH_LIMIT
+    activities_entry = response_cache.get_or_fetch(f"activities:{owner}", ACTIVITIES_CACHE_TTL,
+                                                   lambda: get_activities(per_page=200) or None)
+    if not activities_entry:
+        return 0
+    # 手动录入的活动没有路线和流数据
+    runs = {a['id']: a for a in activities_entry['value']
+            if (a.get('sport_type') or a.get('type')) in TERRAIN_SPORT_TYPES
+            and (a.get('map') or {}).get('summary_polyline')}
+    
+    items = []
+    pending = 0
+    for activity_id in terrain_store.missing(owner, list(runs)):
+        streams_key = f"streams:{owner}:{activity_id}"
+        entry = response_cache.get(streams_key)
+        if entry is None and fetch_limit > 0:
+            fetch_limit -= 1
+            # 补齐历史数据是后台任务，没有配额时不等待，留到之后的请求
+            with strava_priority(BACKGROUND) as strava:
+                entry = response_cache.get_or_fetch(streams_key, ACTIVITY_CACHE_TTL, lambda: get_activity_streams(activity_id))
+            if strava.limited:
+                fetch_limit = 0
+        if entry is None:
+            pending += 1
+            continue
+        items.append((runs[activity_id], entry['value']))
+    
+    if items:
+        terrain_store.add_many(owner, items)
+        grade_pace_store.add_many(owner, items)
+        # 有了流数据后按心率流数据重新计算这些活动的负荷
+        training_loads.add_many(owner, items)
+        print(f"地形直方图新增 {len(items)} 个活动: {owner}，待计算 {pending} 个")
+    return pending
+
+def build_terrain_comparison(owner, gpx_data, days=None, race=None):
+    """比赛路线的坡度分布与已保存的训练直方图汇总的对比，race为预先计算的路线坡度直方图（可选）"""
+    if race is None:
+        elevation_data = gpx_data.get('elevation_data') or {}
+        race = route_grade_histogram(elevation_data.get('distances', []), elevation_data.get('elevations', []))
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d') if days else None
+    training, count = terrain_store.aggregate(owner, since)
+    return compare_terrain(race, training, count)
+
+@app.route('/route/prediction')
+def route_prediction():
+    """
+    按运动员的坡度-配速模型预测比赛路线每公里、每个爬升/下降段和各检查点的累计用时
+
+    路线通过data_id参数指定（默认使用session中最近上传的路线），days参数限制拟合使用的训练天数，
+    checkpoints参数为逗号分隔的检查点距离（公里）。
+    """
+    if 'access_token' not in session:
+        return jsonify({'error': '请先登录Strava'}), 401
+    if is_token_expired() and not refresh_token():
+        return jsonify({'error': '请重新登录Strava'}), 401
+    
+    data_id = request.args.get('data_id') or session.get('data_id')
+    stored_data = (temp_data_store.get(data_id) or load_data_from_file(data_id)) if data_id else None
+    if not stored_data or 'gpx_data' not in stored_data:
+        return jsonify({'error': '路线数据不存在或已过期，请重新上传GPX文件'}), 404
+    try:
+        checkpoints = [float(x) for x in request.args.get('checkpoints', '').split(',') if x.strip()]
+    except ValueError:
+        return jsonify({'error': '检查点距离格式不正确'}), 400
+    
+    start = time.perf_counter()
+    owner = session_token_key()
+    pending = sync_terrain_histograms(owner)
+    sync_grade_pace(owner)
+    days = request.args.get('days', type=int)
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d') if days else None
+    result = predict_route(grade_pace_store.model(owner, since), stored_data['gpx_data'], checkpoints)
+    if result is None:
+        return jsonify({'error': '路线没有海拔数据，无法预测用时'}), 400
+    result['pending_activities'] = pending
+    result['query_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return jsonify(result)
+
+def sync_grade_pace(owner):
+    """
+    为缓存中已有流数据、但还没有坡度统计的跑步活动补齐统计
+
+    新取得的流数据已由sync_terrain_histograms和推送事件同时写入，这里只处理之前已缓存的活动，不请求Strava。
+    """
+    entry = response_cache.get(f"activities:{owner}")
+    if not entry:
+        return
+    runs = {a['id']: a for a in entry['value'] if (a.get('sport_type') or a.get('type')) in TERRAIN_SPORT_TYPES}
+    items = []
+    for activity_id in grade_pace_store.missing(owner, list(runs)):
+        streams_entry = response_cache.get(f"streams:{owner}:{activity_id}")
+        if streams_entry:
+            items.append((runs[activity_id], streams_entry['value']))
+    if items:
+        grade_pace_store.add_many(owner, items)
+
+@app.route('/training_load')
+def training_load():
+    """
+    训练负荷曲线：每日负荷、体能（CTL）、疲劳（ATL）和状态（TSB）
+
+    days参数控制返回最近多少天的曲线（默认180天），曲线本身始终由全部历史计算。
+    """
+    if 'access_token' not in session:
+        return jsonify({'error': '请先登录Strava'}), 401
+    if is_token_expired() and not refresh_token():
+        return jsonify({'error': '请重新登录Strava'}), 401
+    
+    owner = session_token_key()
+    sync_training_loads(owner)
+    series = load_series(training_loads.daily_loads(owner))
+    summary = summarize_load(series)
+    days = max(request.args.get('days', 180, type=int), 1)
+    if series:
+        series = {key: values[-days:] for key, values in series.items()}
+    return jsonify({'summary': summary, 'series': series})
+
+# 导出活动时每页的活动数（Strava允许的最大值）和最多请求的页数，超出部分（更早的活动）不导出
+EXPORT_PAGE_SIZE = 200
+EXPORT_MAX_PAGES = int(os.environ.get('EXPORT_MAX_PAGES', 25))
+# 导出时每页请求没有配额时最多排队等待的时间（秒）
+EXPORT_STRAVA_WAIT = float(os.environ.get('EXPORT_STRAVA_WAIT', 10))
+
+def fetch_activity_page(access_token, page):
+    """
+    以后台优先级获取一页活动列表，导出不应占用用户访问所需的配额
+
+    Returns:
+        (活动列表, 限额异常)，获取失败时活动列表为None，因接近限额被拒绝时同时返回异常
+    """
+    with strava_priority(BACKGROUND, timeout=EXPORT_STRAVA_WAIT) as strava:
+        try:
+            response = strava_get(ACTIVITIES_URL, params={
+                'access_token': access_token,
+                'page': page,
+                'per_page': EXPORT_PAGE_SIZE
+            })
+            response.raise_for_status()
+            return response.json(), None
+        except requests.exceptions.RequestException as e:
+            print(f"导出时获取第{page}页活动失败: {e}")
+            return None, strava.limited
+
+def iter_export_activities(access_token, first_page):
+    """
+    逐页产生运动员的全部活动（最多EXPORT_MAX_PAGES页），每次只保留一页在内存中
+
+    之后的页获取失败时抛出异常中断响应，客户端收到的是下载失败而不是缺少部分活动的文件。
+    """
+    page, activities = 1, first_page
+    while True:
+        yield from activities
+        if len(activities) < EXPORT_PAGE_SIZE:
+            return
+        if page >= EXPORT_MAX_PAGES:
+            print(f"导出活动达到 {EXPORT_MAX_PAGES} 页上限，更早的活动未导出")
+            return
+        page += 1
+        activities, limited = fetch_activity_page(access_token, page)
+        if activities is None:
+            raise limited or RuntimeError(f"获取第{page}页活动失败，导出中断")
+
+@app.route('/export/<kind>')
+def export_data(kind):
+    """
+    导出运动员的活动（kind=activities）或已缓存的流数据（kind=streams，每个采样点一行）
+
+    format参数可选parquet、arrow或csv，默认使用可用的列式格式，没有安装pyarrow时回退为CSV。
+    数据逐批读取、转换后以分块响应发送，导出多年的数据时内存占用也只有一个批次。
+    活动从Strava逐页获取，最多导出最近的 EXPORT_MAX_PAGES * 200 个活动（X-Export-Max-Activities响应头）。
+    流数据只导出已缓存的活动（X-Export-Coverage: cached），没有缓存的活动可通过活动详情页或地形同步取得。
+    """
+    if kind not in ('activities', 'streams'):
+        return jsonify({'error': '不支持的导出类型'}), 404
+    if 'access_token' not in session:
+        return jsonify({'error': '请先登录Strava'}), 401
+    if is_token_expired() and not refresh_token():
+        return jsonify({'error': '请重新登录Strava'}), 401
+    
+    formats = available_formats()
+    file_format = request.args.get('format', formats[0])
+    if file_format not in MIME_TYPES:
+        return jsonify({'error': '不支持的导出格式', 'formats': formats}), 400
+    if file_format not in formats:
+        file_format = CSV
+    
+    owner = session_token_key()
+    headers = {}
+    if kind == 'activities':
+        # 第一页在开始响应前获取，失败时还能返回错误状态码
+        first_page, limited = fetch_activity_page(session['access_token'], 1)
+        if first_page is None:
+            if limited:
+                return jsonify({'error': 'Strava请求接近限额，请稍后再试'}), 429, {'Retry-After': str(int(limited.retry_after) + 1)}
+            return jsonify({'error': '获取活动列表失败'}), 502
+        columns, batches = ACTIVITY_COLUMNS, activity_batches(iter_export_activities(session['access_token'], first_page))
+        headers['X-Export-Max-Activities'] = str(EXPORT_MAX_PAGES * EXPORT_PAGE_SIZE)
+    else:
+        prefix = f"streams:{owner}:"
+        # 每个活动的流数据可能有几万个点，每次只从缓存读取少量活动
+        items = ((int(key[len(prefix):]), streams) for key, streams in response_cache.iter_prefix(prefix, batch_size=10))
+        columns, batches = STREAM_COLUMNS, stream_batches(items)
+        headers['X-Export-Coverage'] = 'cached'
+    
+    def generate():
+        started = time.time()
+        total = 0
+        for chunk in export_rows(columns, batches, file_format):
+            total += len(chunk)
+            yield chunk
+        print(f"导出{kind} ({file_format}) {total} 字节，用时 {time.time() - started:.1f}秒: {owner}")
+    
+    filename = f"openrun_{kind}_{datetime.now().strftime('%Y%m%d')}.{file_format}"
+    response = Response(generate(), mimetype=MIME_TYPES[file_format])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Export-Format'] = file_format
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers.update(headers)
+    return response
+
+def sync_training_loads(owner):
+    """
+    为缓存的活动列表中新增的活动计算训练负荷
+
+    按活动列表缓存的ETag判断，列表没有变化时只需一次查询。缓存中有流数据的活动按心率流数据计算，
+    其余按活动摘要估算，之后取得流数据时（地形同步、推送事件）再重新计算。
+    """
+    activities_key = f"activities:{owner}"
+    meta = response_cache.get_meta(activities_key)
+    if meta is None or meta['etag'] == training_loads.source_etag(owner):
+        return
+    entry = response_cache.get(activities_key)
+    if entry is None:
+        return
+    activities = {a['id']: a for a in entry['value']}
+    items = []
+    for activity_id in training_loads.missing(owner, list(activities)):
+        streams_entry = response_cache.get(f"streams:{owner}:{activity_id}")
+        items.append((activities[activity_id], streams_entry['value'] if streams_entry else None))
+    training_loads.add_many(owner, items)
+    training_loads.set_source_etag(owner, entry['etag'])
+
+@app.route('/debug/strava_webhook')
+def debug_strava_webhook():
+    """调试路由，返回Strava推送事件队列的统计"""
+    return webhook_queue.stats()
+
 @app.route('/debug/temp_data_store')
 def debug_temp_data_store():
     """调试路由，返回temp_data_store的内容"""
     return {
         'keys': list(temp_data_store.keys()),
         'count': len(temp_data_store),
-        'session_data_id': session.get('data_id')
+        'session_data_id': session.get('data_id'),
+        'last_sweep': read_last_sweep(DATA_STORE_DIR)
+    }
+
+@app.route('/debug/gpx_pool')
+def debug_gpx_pool():
+    """调试路由，返回当前worker的GPX解析任务统计"""
+    return pool_stats()
+
+@app.route('/debug/response_cache')
+def debug_response_cache():
+    """调试路由，返回页面缓存的条目数量、大小和当前worker的命中统计"""
+    return response_cache.stats()
+
+@app.route('/debug/route_index')
+def debug_route_index():
+    """调试路由，返回历史活动空间索引的统计"""
+    return route_index.stats()
+
+@app.route('/debug/terrain_histograms')
+def debug_terrain_histograms():
+    """调试路由，返回已保存的地形直方图统计"""
+    return terrain_store.stats()
+
+@app.route('/debug/grade_pace')
+def debug_grade_pace():
+    """调试路由，返回已保存的坡度统计和当前worker的模型缓存统计"""
+    return grade_pace_store.stats()
+
+@app.route('/debug/training_load')
+def debug_training_load():
+    """调试路由，返回已保存的训练负荷统计"""
+    return training_loads.stats()
+
+@app.route('/debug/weather')
+def debug_weather():
+    """调试路由，返回当前worker的天气请求统计"""
+    return weather_fetcher.stats()
+
+@app.route('/debug/strava_rate_limit')
+def debug_strava_rate_limit():
+    """调试路由，返回Strava限额的共享用量和当前worker的调度统计"""
+    return strava_scheduler.stats()
+
+@app.route('/get_training_advice/status')
+def get_training_advice_status():
+    """训练建议的排队情况和当前session建议的重试时间，EventSource无法读取429响应，由前端在连接失败后查询"""
+    return llm_admission.status(admission_key())
+
+@app.route('/debug/llm_admission')
+def debug_llm_admission():
+    """调试路由，返回训练建议的生成和排队数量以及当前worker的准入统计"""
+    return llm_admission.stats()
+
+@app.route('/debug/precompute')
+def debug_precompute():
+    """调试路由，返回当前worker的上传后预计算统计"""
+    return precompute_pipeline.stats()
+
+@app.route('/debug/fragment_cache')
+def debug_fragment_cache():
+    """调试路由，返回当前worker的页面片段缓存统计"""
+    return fragment_cache.stats()
+
+def require_debug_token():
+    """调试令牌不正确时返回404，令牌通过X-Debug-Token请求头或token参数传入"""
+    token = request.headers.get('X-Debug-Token') or request.args.get('token') or ''
+    # 按字节比较，compare_digest不接受含非ASCII字符的str
+    if not DEBUG_TOKEN or not secrets.compare_digest(token.encode('utf-8'), DEBUG_TOKEN.encode('utf-8')):
+        abort(404)
+
+def worker_cache_bytes():
+    """当前worker内存中各缓存的大小（字节），路线数据按保存的文件大小估计"""
+    store_bytes = 0
+    for data_id in list(temp_data_store):
+        try:
+            store_bytes += os.path.getsize(os.path.join(DATA_STORE_DIR, f"{data_id}.pkl"))
+        except OSError:
+            pass
+    return {
+        'temp_data_store': store_bytes,
+        'fragment_cache': fragment_cache.stats()['bytes']
     }
 
+@app.route('/debug/memory')
+def debug_memory():
+    """调试路由，返回当前worker的内存、缓存大小和各路由抽样的分配峰值及分配位置"""
+    return memory_profiler.stats(worker_cache_bytes())
+
+@app.route('/debug/memory/metrics')
+def debug_memory_metrics():
+    """/debug/memory的Prometheus文本格式，供监控系统抓取"""
+    body = render_metrics(memory_profiler.stats(worker_cache_bytes()))
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/token_refresh_stats')
+def debug_token_refresh_stats():
+    """调试路由，返回Strava令牌刷新次数统计"""
+    return token_manager.stats()
+
 @app.route('/get_default_prompts')
 def get_default_prompts():
     """获取默认的系统提示词和用户提示词"""
@@ -1135,6 +2283,12 @@ def get_default_prompts():
 - 平均坡度: {avg_grade:.1f}%;
 - 分段数据：{km_data_text};
 
+## 训练地形与比赛地形对比:
+{terrain_text}
+
+## 当前训练负荷:
+{load_text}
+
 ## 比赛日当天的天气预报数据:
 {weather_summary}
 
@@ -1247,6 +2401,22 @@ def options_submit_prompts():
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,OPTIONS')
     return response
 
+def warm_up():
+    """
+    预加载重型模块并编译模板
+
+    gunicorn开启preload_app时由master在fork之前调用，之后各worker以写时复制的方式
+    共享这些内存页，不必各自重复导入。单独运行或作为脚本导入时这些模块仍按需加载。
+    """
+    import polyline  # noqa: F401
+    import gpxpy  # noqa: F401
+    import geopy.distance  # noqa: F401
+    import aiohttp  # noqa: F401
+    import numpy  # noqa: F401
+    
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
 if __name__ == '__main__':
     # 确保templates目录存在
     if not os.path.exists('templates'):
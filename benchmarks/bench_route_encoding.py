@@ -0,0 +1,98 @@
+"""
+/upload_gpx响应格式基准测试
+
+对比原有JSON格式与紧凑格式（encoded polyline + 差分编码的海拔剖面）的响应体积和序列化耗时，
+以及gzip和brotli（已安装时）压缩后的体积和压缩耗时。
+
+用法:
+    python benchmarks/bench_route_encoding.py
+    python benchmarks/bench_route_encoding.py --sizes 1000,10000,100000 --output bench_encoding.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import make_gpx
+from route_analysis import analyze_gpx
+from route_encoding import encode_route_compact, compress_body, brotli
+
+
+def timed(func, repeat):
+    """返回最后一次的结果和最短耗时（毫秒）"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def bench_size(points, repeat):
+    route = analyze_gpx(make_gpx(points))
+    route['data_id'] = 'bench'
+
+    formats = {
+        # 与原来的jsonify一致：默认分隔符
+        'json': lambda: json.dumps(route).encode('utf-8'),
+        'compact': lambda: json.dumps(encode_route_compact(route), separators=(',', ':')).encode('utf-8'),
+    }
+    encodings = ['gzip'] + (['br'] if brotli is not None else [])
+
+    rows = []
+    for name, serialize in formats.items():
+        body, serialize_ms = timed(serialize, repeat)
+        row = {
+            'points': points,
+            'format': name,
+            'bytes': len(body),
+            'serialize_ms': round(serialize_ms, 2)
+        }
+        for encoding in encodings:
+            compressed, compress_ms = timed(lambda: compress_body(body, encoding), repeat)
+            row[f'{encoding}_bytes'] = len(compressed)
+            row[f'{encoding}_ms'] = round(compress_ms, 2)
+        rows.append(row)
+    return rows
+
+
+def print_report(rows):
+    extra = [key for key in rows[0] if key.endswith('_bytes') and key != 'bytes'] if rows else []
+    header = f"{'points':>8}  {'format':<8}{'bytes':>12}{'序列化 ms':>12}"
+    for key in extra:
+        header += f"{key:>14}{key.replace('_bytes', '_ms'):>10}"
+    print(header)
+    for row in rows:
+        line = f"{row['points']:>8}  {row['format']:<8}{row['bytes']:>12}{row['serialize_ms']:>12}"
+        for key in extra:
+            line += f"{row[key]:>14}{row[key.replace('_bytes', '_ms')]:>10}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='/upload_gpx响应格式基准测试')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='GPX轨迹点数，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    rows = []
+    for size in [int(s) for s in args.sizes.split(',')]:
+        rows.extend(bench_size(size, args.repeat))
+    print_report(rows)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+历史活动空间索引基准测试
+
+生成N个合成的历史活动（部分活动沿比赛路线的一段跑，其余在附近随机游走），
+对比逐个解码所有活动polyline并比较的全量扫描与网格倒排索引的查询耗时，
+并检查索引找到的重合活动与全量扫描一致。
+
+用法:
+    python benchmarks/bench_route_index.py
+    python benchmarks/bench_route_index.py --activities 1000,5000 --route-points 42000 --output bench_index.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import make_profile, START_LAT, START_LON
+from route_index import RouteIndex, RouteGrid
+
+OWNER = 'athlete:bench'
+
+
+def make_activities(count, route, seed=0, overlap_fraction=0.1):
+    """
+    生成Strava活动列表格式的合成活动
+
+    overlap_fraction比例的活动沿比赛路线的一段（加20米左右的偏移），
+    其余活动在起点周围30公里内随机游走。summary_polyline约每100米一个点。
+    """
+    import polyline
+    rng = random.Random(seed)
+    activities = []
+    for i in range(count):
+        if rng.random() < overlap_fraction:
+            start = rng.randrange(0, len(route) - 500)
+            length = rng.randrange(300, min(2000, len(route) - start))
+            points = [(lat + rng.uniform(-0.0002, 0.0002), lon + rng.uniform(-0.0002, 0.0002))
+                      for lat, lon, _ in route[start:start + length:10]]
+        else:
+            lat = START_LAT + rng.uniform(-0.25, 0.25)
+            lon = START_LON + rng.uniform(-0.3, 0.3)
+            heading = rng.uniform(0, 2 * math.pi)
+            points = []
+            for _ in range(rng.randrange(50, 250)):
+                heading += rng.uniform(-0.5, 0.5)
+                lat += 100 * math.cos(heading) / 111320
+                lon += 100 * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+                points.append((lat, lon))
+        activities.append({
+            'id': i + 1,
+            'name': f"Run {i + 1}",
+            'sport_type': 'Run',
+            'start_date_local': f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}T07:00:00Z",
+            'distance': len(points) * 100,
+            'map': {'summary_polyline': polyline.encode(points)},
+        })
+    return activities
+
+
+def full_scan(activities, route_points, grid):
+    """优化前的做法：每次查询都解码所有活动的polyline并与路线比较"""
+    import polyline
+    expanded = set()
+    for lat, lon in grid.sample(route_points):
+        expanded |= grid.neighbors(lat, lon)
+    found = set()
+    for activity in activities:
+        points = polyline.decode(activity['map']['summary_polyline'])
+        if grid.cells(points) & expanded:
+            found.add(activity['id'])
+    return found
+
+
+def bench(count, route_points_count, repeat):
+    import polyline
+    route = make_profile(route_points_count)
+    route_points = [(lat, lon) for lat, lon, _ in route]
+    activities = make_activities(count, route)
+    for activity in activities:
+        activity['decoded_polyline'] = polyline.decode(activity['map']['summary_polyline'])
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        index = RouteIndex(os.path.join(work_dir, 'cache.db'))
+        start = time.perf_counter()
+        index.add_activities(OWNER, activities)
+        build_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        unchanged = index.add_activities(OWNER, activities)
+        resync_ms = (time.perf_counter() - start) * 1000
+
+        query_times = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = index.query(OWNER, route_points, limit=count, min_overlap=0)
+            query_times.append((time.perf_counter() - start) * 1000)
+
+        scan_start = time.perf_counter()
+        expected = full_scan(activities, route_points, RouteGrid())
+        scan_ms = (time.perf_counter() - scan_start) * 1000
+        stats = index.stats()
+
+    found = {a['id'] for a in result['overlapping']}
+    return {
+        'activities': count,
+        'route_points': route_points_count,
+        'cells': stats['cells'],
+        'build_s': round(build_s, 2),
+        'resync_ms': round(resync_ms, 1),
+        'resync_indexed': unchanged,
+        'query_ms': round(min(query_times), 1),
+        'full_scan_ms': round(scan_ms, 1),
+        'overlapping': len(found),
+        'matches_full_scan': found == expected,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='历史活动空间索引基准测试')
+    parser.add_argument('--activities', default='200,1000,5000', help='活动数量，逗号分隔')
+    parser.add_argument('--route-points', type=int, default=4200, help='比赛路线的轨迹点数（每10米一个点）')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    rows = [bench(int(n), args.route_points, args.repeat) for n in args.activities.split(',')]
+    print(f"{'活动数':>8}{'网格条目':>10}{'建索引 s':>10}{'重新同步 ms':>12}{'索引查询 ms':>12}{'全量扫描 ms':>12}"
+          f"{'重合活动':>9}{'结果一致':>9}")
+    for row in rows:
+        print(f"{row['activities']:>8}{row['cells']:>10}{row['build_s']:>10}{row['resync_ms']:>12}"
+              f"{row['query_ms']:>12}{row['full_scan_ms']:>12}{row['overlapping']:>9}{str(row['matches_full_scan']):>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
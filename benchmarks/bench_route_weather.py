@@ -0,0 +1,122 @@
+"""
+沿路线天气基准测试
+
+启动带延迟的天气替身服务，对比逐日逐个请求（每个取样点每年前后若干天，每天一个请求）与
+WeatherFetcher按年份的日期范围请求、并发、按网格去重获取一条路线所有取样点气候统计的耗时，
+以及统计结果缓存命中后的耗时。
+
+用法:
+    python benchmarks/bench_route_weather.py
+    python benchmarks/bench_route_weather.py --points 20000 --latency 150 --output bench_weather.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(ROOT_DIR))
+sys.path.insert(0, ROOT_DIR)
+
+from stub_servers import start_stub_server, StubWeatherHandler
+from fixtures import make_profile
+from page_cache import ResponseCache
+from route_weather import (WeatherFetcher, build_route_weather, select_sample_points, climate_windows,
+                           WEATHER_CONCURRENCY, CLIMATE_WINDOW_DAYS)
+
+
+def make_route(n_points):
+    """生成与analyze_gpx格式一致的路线数据"""
+    from geopy.distance import geodesic
+
+    points, distances, elevations = [], [], []
+    total = 0.0
+    for lat, lon, ele in make_profile(n_points):
+        if points:
+            total += geodesic(points[-1], (lat, lon)).kilometers
+        points.append([lat, lon])
+        distances.append(round(total, 2))
+        elevations.append(ele)
+    return {'points': points, 'stats': {'distance': total},
+            'elevation_data': {'distances': distances, 'elevations': elevations}}
+
+
+def make_fetch_range(base_url):
+    def fetch_range(lat, lon, start, end):
+        response = requests.get(f"{base_url}/{lat},{lon}/{start}/{end}", timeout=15)
+        response.raise_for_status()
+        return [{'date': day.get('datetime'), 'temperature': day.get('temp'), 'humidity': day.get('humidity'),
+                 'precipitation': day.get('precip'), 'windspeed': day.get('windspeed'),
+                 'conditions': day.get('conditions')} for day in response.json()['days']]
+    return fetch_range
+
+
+def main():
+    parser = argparse.ArgumentParser(description='沿路线天气基准测试')
+    parser.add_argument('--points', type=int, default=20000, help='路线轨迹点数')
+    parser.add_argument('--latency', type=int, default=150, help='天气服务每个请求的延迟（毫秒）')
+    parser.add_argument('--workers', type=int, default=WEATHER_CONCURRENCY, help='并发请求数')
+    parser.add_argument('--window', type=int, default=CLIMATE_WINDOW_DAYS, help='每年取比赛日前后的天数')
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(StubWeatherHandler, latency_ms=args.latency)
+    fetch_range = make_fetch_range(base_url)
+    route = make_route(args.points)
+    target_date = datetime(datetime.now().year, 6, 15)
+    samples = select_sample_points(route)
+    windows = climate_windows(target_date, args.window)
+    dates = [(datetime.strptime(start, '%Y-%m-%d') + timedelta(days=i)).strftime('%Y-%m-%d')
+             for _, start, end in windows
+             for i in range((datetime.strptime(end, '%Y-%m-%d') - datetime.strptime(start, '%Y-%m-%d')).days + 1)]
+
+    # 优化前：每个取样点每天一个请求，依次请求
+    start = time.perf_counter()
+    for sample in samples:
+        for date in dates:
+            fetch_range(sample['lat'], sample['lon'], date, date)
+    sequential_s = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        fetcher = WeatherFetcher(ResponseCache(os.path.join(work_dir, 'cache.db')), fetch_range, max_workers=args.workers)
+        start = time.perf_counter()
+        result = build_route_weather(route, target_date, fetcher, window_days=args.window)
+        concurrent_s = time.perf_counter() - start
+        start = time.perf_counter()
+        build_route_weather(route, target_date, fetcher, window_days=args.window)
+        cached_s = time.perf_counter() - start
+        stats = fetcher.stats()
+    server.shutdown()
+
+    row = {
+        'distance_km': round(route['stats']['distance'], 1),
+        'sample_points': len(samples),
+        'weather_cells': result['cells'],
+        'years': len(windows),
+        'days_per_point': len(dates),
+        'sequential_requests': len(samples) * len(dates),
+        'concurrent_requests': stats['requests'],
+        'sequential_s': round(sequential_s, 2),
+        'concurrent_s': round(concurrent_s, 2),
+        'cached_ms': round(cached_s * 1000, 1)
+    }
+    print(f"路线 {row['distance_km']}公里，取样点 {row['sample_points']}，天气网格 {row['weather_cells']}，"
+          f"{row['years']}年共{row['days_per_point']}天，请求延迟 {args.latency}ms")
+    print(f"{'方式':>8}{'请求数':>8}{'耗时':>10}")
+    print(f"{'逐日请求':>8}{row['sequential_requests']:>8}{row['sequential_s']:>9}s")
+    print(f"{'范围并发':>8}{row['concurrent_requests']:>8}{row['concurrent_s']:>9}s")
+    print(f"{'缓存命中':>8}{0:>8}{row['cached_ms']:>8}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': row}, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
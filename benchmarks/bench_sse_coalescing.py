@@ -0,0 +1,100 @@
+"""
+SSE合并发送基准测试
+
+模拟DeepSeek逐token流式输出，对比逐块发送（原有行为）与按时间预算/字节阈值
+合并发送的帧数、每秒帧数、每个流的CPU耗时以及token的额外发送延迟。
+
+用法:
+    python benchmarks/bench_sse_coalescing.py --tokens 4096 --token-interval-ms 2
+    python benchmarks/bench_sse_coalescing.py --output bench_sse.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_utils import coalesce_stream, sse_event
+
+
+async def fake_token_stream(tokens, token_interval, arrivals):
+    """模拟上游的逐token输出，记录每个token的到达时间"""
+    for i in range(tokens):
+        await asyncio.sleep(token_interval)
+        arrivals.append(time.perf_counter())
+        yield "训练" if i % 3 else "建议。"
+
+
+async def run_stream(tokens, token_interval, flush_interval_ms, flush_bytes):
+    """跑完一个完整的流，统计帧数、字节数和延迟"""
+    arrivals = []
+    frames = 0
+    total_bytes = 0
+    delays = []
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    source = fake_token_stream(tokens, token_interval, arrivals)
+    sent_tokens = 0
+    async for text in coalesce_stream(source, flush_interval_ms, flush_bytes):
+        frame = sse_event({'text': text})
+        frames += 1
+        total_bytes += len(frame.encode('utf-8'))
+        now = time.perf_counter()
+        # 这一帧包含了到目前为止到达的全部token
+        for arrived in arrivals[sent_tokens:]:
+            delays.append((now - arrived) * 1000)
+        sent_tokens = len(arrivals)
+
+    cpu_time = time.process_time() - cpu_start
+    wall_time = time.perf_counter() - wall_start
+    delays.sort()
+
+    return {
+        'flush_interval_ms': flush_interval_ms,
+        'flush_bytes': flush_bytes,
+        'frames': frames,
+        'bytes': total_bytes,
+        'wall_s': round(wall_time, 3),
+        'frames_per_s': round(frames / wall_time, 1) if wall_time else 0,
+        'cpu_ms_per_stream': round(cpu_time * 1000, 1),
+        'added_latency_p50_ms': round(delays[len(delays) // 2], 2) if delays else 0,
+        'added_latency_max_ms': round(delays[-1], 2) if delays else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SSE合并发送基准测试')
+    parser.add_argument('--tokens', type=int, default=4096, help='每个流的token数量')
+    parser.add_argument('--token-interval-ms', type=float, default=2, help='上游token间隔（毫秒）')
+    parser.add_argument('--flush-interval-ms', type=int, default=40, help='合并发送的时间预算')
+    parser.add_argument('--flush-bytes', type=int, default=512, help='合并发送的字节阈值')
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    token_interval = args.token_interval_ms / 1000
+    results = {
+        'tokens': args.tokens,
+        'token_interval_ms': args.token_interval_ms,
+        'before': asyncio.run(run_stream(args.tokens, token_interval, 0, 1)),
+        'after': asyncio.run(run_stream(args.tokens, token_interval, args.flush_interval_ms, args.flush_bytes)),
+    }
+
+    for name in ('before', 'after'):
+        r = results[name]
+        print(f"{name:>6}: 帧数={r['frames']:>5} 字节={r['bytes']:>7} 帧/秒={r['frames_per_s']:>7} "
+              f"CPU={r['cpu_ms_per_stream']:>7}ms 额外延迟p50={r['added_latency_p50_ms']}ms "
+              f"max={r['added_latency_max_ms']}ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
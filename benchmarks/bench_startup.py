@@ -0,0 +1,198 @@
+"""
+启动耗时和worker内存基准测试
+
+1. 导入耗时：在全新的解释器中用 -X importtime 导入 app，统计总耗时和最慢的模块
+2. gunicorn启动：分别在 GUNICORN_PRELOAD=1/0 下启动，统计从启动到首个200响应的时间，
+   以及每个worker的共享内存和私有内存（读取 /proc/<pid>/smaps_rollup，仅Linux）
+
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --workers 4 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest import worker_pids
+
+
+def measure_import(top):
+    """在子进程中导入app，解析 -X importtime 的输出"""
+    env = dict(os.environ)
+    env.setdefault('DEEPSEEK_API_KEY', 'bench')
+    work_dir = tempfile.mkdtemp(prefix='openrun_startup_')
+    os.makedirs(os.path.join(work_dir, 'logs'))
+    env['DATA_STORE_DIR'] = work_dir
+    env['SESSION_DB_PATH'] = os.path.join(work_dir, 'sessions.db')
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import sys; sys.path.insert(0, {ROOT_DIR!r}); import app"],
+        cwd=work_dir, env=env, capture_output=True, text=True
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"导入app失败: {result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        # 格式: "import time:   self |   cumulative |   <缩进表示嵌套层级>module"
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))
+
+    app_cumulative = next((m[2] for m in modules if m[0] == 'app'), None)
+    # app直接导入的模块（嵌套一层，缩进两个空格）
+    direct = [(m[0].strip(), m[1], m[2]) for m in modules if m[0].startswith('  ') and not m[0].startswith('   ')]
+    direct.sort(key=lambda m: m[2], reverse=True)
+    return {
+        'wall_ms': round(wall * 1000, 1),
+        'import_app_ms': round(app_cumulative / 1000, 1) if app_cumulative else None,
+        'slowest': [{'module': m[0], 'cumulative_ms': round(m[2] / 1000, 1)} for m in direct[:top]]
+    }
+
+
+def smaps_rollup(pid):
+    """读取进程的内存统计（kB），不支持时返回None"""
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        'rss_kb': fields.get('Rss', 0),
+        'pss_kb': fields.get('Pss', 0),
+        'shared_kb': fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0),
+        'private_kb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    }
+
+
+def measure_gunicorn(preload, workers, port, warm_requests):
+    """启动gunicorn，统计到首个200响应的时间和worker内存"""
+    work_dir = tempfile.mkdtemp(prefix='openrun_startup_')
+    os.makedirs(os.path.join(work_dir, 'logs'))
+    bind = f"127.0.0.1:{port}"
+    env = dict(os.environ)
+    env.setdefault('DEEPSEEK_API_KEY', 'bench')
+    env.setdefault('SECRET_KEY', 'bench-secret')
+    env.update({
+        'GUNICORN_BIND': bind,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_PRELOAD': '1' if preload else '0',
+        'GUNICORN_PIDFILE': os.path.join(work_dir, 'gunicorn.pid'),
+        'DATA_STORE_DIR': work_dir,
+        'SESSION_DB_PATH': os.path.join(work_dir, 'sessions.db'),
+    })
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT_DIR, 'gunicorn_config.py'),
+         '--pythonpath', ROOT_DIR,
+         '--error-logfile', os.path.join(work_dir, 'error.log'),
+         'app:app'],
+        cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://{bind}"
+    first_ok = None
+    try:
+        for _ in range(600):
+            try:
+                if requests.get(base_url + '/about', timeout=1).status_code == 200:
+                    first_ok = time.perf_counter() - start
+                    break
+            except requests.RequestException:
+                pass
+            if proc.poll() is not None:
+                break
+            time.sleep(0.02)
+        if first_ok is None:
+            raise RuntimeError(f"gunicorn启动失败，请查看 {os.path.join(work_dir, 'error.log')}")
+
+        # 等所有worker启动完成，再发一些请求让每个worker都渲染过模板
+        for _ in range(100):
+            if len(worker_pids(proc.pid)) >= workers:
+                break
+            time.sleep(0.1)
+        session = requests.Session()
+        for _ in range(warm_requests):
+            session.get(base_url + '/about', timeout=10)
+        time.sleep(0.5)
+
+        memory = [m for m in (smaps_rollup(pid) for pid in worker_pids(proc.pid)) if m]
+        result = {
+            'preload': preload,
+            'workers': workers,
+            'first_200_ms': round(first_ok * 1000, 1),
+            'master': smaps_rollup(proc.pid)
+        }
+        if memory:
+            result['worker_mean'] = {key: round(sum(m[key] for m in memory) / len(memory)) for key in memory[0]}
+            result['workers_pss_total_kb'] = sum(m['pss_kb'] for m in memory)
+        return result
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_report(import_result, gunicorn_results):
+    print(f"\n=== 导入耗时 ===")
+    print(f"import app: {import_result['import_app_ms']} ms (进程总耗时 {import_result['wall_ms']} ms)")
+    for m in import_result['slowest']:
+        print(f"  {m['module']:<30}{m['cumulative_ms']:>10} ms")
+
+    print(f"\n=== gunicorn启动和worker内存 ===")
+    print(f"{'preload':<10}{'workers':>8}{'首个200 ms':>12}{'RSS kB':>10}{'PSS kB':>10}{'共享 kB':>10}{'私有 kB':>10}{'PSS合计 kB':>12}")
+    for r in gunicorn_results:
+        mem = r.get('worker_mean', {})
+        print(f"{str(r['preload']):<10}{r['workers']:>8}{r['first_200_ms']:>12}"
+              f"{mem.get('rss_kb', '-'):>10}{mem.get('pss_kb', '-'):>10}{mem.get('shared_kb', '-'):>10}"
+              f"{mem.get('private_kb', '-'):>10}{r.get('workers_pss_total_kb', '-'):>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenRunTraining启动耗时和worker内存基准测试')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--warm-requests', type=int, default=20, help='测量内存前发送的请求数')
+    parser.add_argument('--top', type=int, default=10, help='显示最慢的前N个模块')
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    import_result = measure_import(args.top)
+    gunicorn_results = [measure_gunicorn(preload, args.workers, args.port, args.warm_requests)
+                        for preload in (False, True)]
+    print_report(import_result, gunicorn_results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'timestamp': datetime.now().isoformat(timespec='seconds'),
+                    'args': vars(args)
+                },
+                'import': import_result,
+                'gunicorn': gunicorn_results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+训练地形直方图基准测试
+
+对比逐点循环的纯Python分箱与批量numpy分箱（terrain_histograms.activity_histograms）计算
+N个活动直方图的耗时，以及从已保存的直方图汇总运动员整体分布的耗时。
+
+用法:
+    python benchmarks/bench_terrain_histograms.py
+    python benchmarks/bench_terrain_histograms.py --activities 100,500 --samples 3600 --output bench_terrain.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import bisect
+import random
+import argparse
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from terrain_histograms import (TerrainHistogramStore, activity_histograms, GRADE_EDGES, PACE_EDGES,
+                                GRADE_BINS, PACE_BINS, HISTOGRAM_SIZE, MOVING_SPEED)
+
+OWNER = 'athlete:bench'
+
+
+def make_streams(samples, seed):
+    """生成与get_activity_streams格式一致的合成流数据（每秒一个点）"""
+    rng = random.Random(seed)
+    distance, grade, velocity = [], [], []
+    total = 0.0
+    for i in range(samples):
+        g = 12 * math.sin(i / 300 + seed) + rng.uniform(-2, 2)
+        v = max(0.0, 3.2 - g * 0.08 + rng.uniform(-0.3, 0.3)) if rng.random() > 0.02 else 0.0
+        total += v
+        distance.append(total)
+        grade.append(g)
+        velocity.append(v)
+    return {'time': list(range(samples)), 'distance': distance, 'grade': grade, 'velocity': velocity}
+
+
+def python_histogram(streams):
+    """优化前的做法：逐点循环分箱"""
+    histogram = [0.0] * HISTOGRAM_SIZE
+    d, t, g, v = streams['distance'], streams['time'], streams['grade'], streams['velocity']
+    for i in range(1, min(len(d), len(t), len(g), len(v))):
+        if v[i] <= MOVING_SPEED:
+            continue
+        grade_bin = bisect.bisect_right(GRADE_EDGES, g[i])
+        pace_bin = bisect.bisect_right(PACE_EDGES, 1000 / 60 / v[i])
+        dist = max(d[i] - d[i - 1], 0)
+        histogram[grade_bin] += dist
+        histogram[GRADE_BINS + grade_bin] += max(t[i] - t[i - 1], 0)
+        histogram[GRADE_BINS * 2 + grade_bin * PACE_BINS + pace_bin] += dist
+    return histogram
+
+
+def bench(count, samples):
+    streams_list = [make_streams(samples, seed) for seed in range(count)]
+
+    start = time.perf_counter()
+    expected = [python_histogram(streams) for streams in streams_list]
+    python_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    histograms = activity_histograms(streams_list)
+    numpy_ms = (time.perf_counter() - start) * 1000
+    max_error = max(abs(a - b) for row, exp in zip(histograms, expected) for a, b in zip(row, exp))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        store = TerrainHistogramStore(os.path.join(work_dir, 'cache.db'))
+        items = [({'id': i + 1, 'start_date_local': '2025-01-01T07:00:00Z'}, streams)
+                 for i, streams in enumerate(streams_list)]
+        start = time.perf_counter()
+        store.add_many(OWNER, items)
+        store_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        store.aggregate(OWNER)
+        aggregate_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'activities': count,
+        'samples': samples,
+        'python_ms': round(python_ms, 1),
+        'numpy_ms': round(numpy_ms, 1),
+        'store_ms': round(store_ms, 1),
+        'aggregate_ms': round(aggregate_ms, 2),
+        'max_error': max_error
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='训练地形直方图基准测试')
+    parser.add_argument('--activities', default='50,200,500', help='活动数量，逗号分隔')
+    parser.add_argument('--samples', type=int, default=3600, help='每个活动的流数据点数')
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    # 预先导入numpy，不计入第一组的耗时
+    activity_histograms([])
+    rows = [bench(int(n), args.samples) for n in args.activities.split(',')]
+    print(f"{'活动数':>8}{'每活动点数':>10}{'Python ms':>12}{'numpy ms':>12}{'保存 ms':>10}{'汇总 ms':>10}{'最大误差':>12}")
+    for row in rows:
+        print(f"{row['activities']:>8}{row['samples']:>10}{row['python_ms']:>12}{row['numpy_ms']:>12}"
+              f"{row['store_ms']:>10}{row['aggregate_ms']:>10}{row['max_error']:>12.2e}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
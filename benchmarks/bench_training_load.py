@@ -0,0 +1,162 @@
+"""
+训练负荷基准测试
+
+生成多年的合成训练历史（每个活动带心率流数据），测量：
+- 批量numpy计算所有活动TRIMP的耗时（与逐点Python循环对比）
+- 由已保存的每个活动负荷重新计算全部历史的CTL/ATL/TSB曲线的耗时（与逐日递推对比）
+
+用法:
+    python benchmarks/bench_training_load.py
+    python benchmarks/bench_training_load.py --years 5 --samples 1800 --output bench_load.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from training_load import (TrainingLoadStore, hr_stream_loads, load_series, summarize_load,
+                           HR_REST, HR_MAX, MAX_SAMPLE_GAP, CTL_DAYS, ATL_DAYS)
+
+OWNER = 'athlete:bench'
+
+
+def make_history(years, samples, seed=0):
+    """每周5到6次训练，约20%的活动没有心率（只有摘要）"""
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=int(365 * years))
+    items = []
+    day = start
+    activity_id = 0
+    while day <= date.today():
+        if rng.random() < 0.78:
+            activity_id += 1
+            n = rng.randrange(samples // 2, samples)
+            base = rng.uniform(120, 165)
+            activity = {
+                'id': activity_id,
+                'sport_type': rng.choice(['Run', 'Run', 'TrailRun', 'Ride']),
+                'start_date_local': f"{day.isoformat()}T07:00:00Z",
+                'moving_time': n,
+                'average_heartrate': base
+            }
+            streams = None
+            if rng.random() > 0.2:
+                streams = {
+                    'time': list(range(n)),
+                    'heartrate': [base + 15 * math.sin(i / 240) + rng.uniform(-3, 3) for i in range(n)]
+                }
+            items.append((activity, streams))
+        day += timedelta(days=1)
+    return items
+
+
+def python_trimp(streams):
+    """优化前的做法：逐点循环"""
+    total = 0.0
+    t, hr = streams['time'], streams['heartrate']
+    for i in range(1, min(len(t), len(hr))):
+        minutes = min(max(t[i] - t[i - 1], 0), MAX_SAMPLE_GAP) / 60
+        hrr = min(max((hr[i] - HR_REST) / (HR_MAX - HR_REST), 0), 1)
+        total += minutes * hrr * 0.64 * math.exp(1.92 * hrr)
+    return total
+
+
+def python_series(daily_loads):
+    """逐日递推计算CTL/ATL"""
+    days = {date.fromisoformat(d): load for d, load in daily_loads}
+    day, end = min(days), max(max(days), date.today())
+    ctl = atl = 0.0
+    while day <= end:
+        load = days.get(day, 0.0)
+        ctl += (load - ctl) / CTL_DAYS
+        atl += (load - atl) / ATL_DAYS
+        day += timedelta(days=1)
+    return ctl, atl
+
+
+def bench(years, samples):
+    items = make_history(years, samples)
+    streams_list = [streams for _, streams in items if streams]
+
+    start = time.perf_counter()
+    expected = [python_trimp(streams) for streams in streams_list]
+    python_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    loads = hr_stream_loads(streams_list)
+    numpy_ms = (time.perf_counter() - start) * 1000
+    trimp_error = max(abs(a - b) for a, b in zip(loads, expected))
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        store = TrainingLoadStore(os.path.join(work_dir, 'cache.db'))
+        start = time.perf_counter()
+        store.add_many(OWNER, items)
+        store_ms = (time.perf_counter() - start) * 1000
+
+        # 新同步一个活动：只计算这一个活动，曲线由已保存的负荷重新计算
+        start = time.perf_counter()
+        store.add_many(OWNER, items[-1:])
+        incremental_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        daily = store.daily_loads(OWNER)
+        query_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        series = load_series(daily)
+        summary = summarize_load(series)
+        series_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        ctl, atl = python_series(daily)
+        python_series_ms = (time.perf_counter() - start) * 1000
+
+    return {
+        'years': years,
+        'activities': len(items),
+        'with_hr_streams': len(streams_list),
+        'days': len(series['dates']),
+        'trimp_python_ms': round(python_ms, 1),
+        'trimp_numpy_ms': round(numpy_ms, 1),
+        'trimp_max_error': trimp_error,
+        'store_all_ms': round(store_ms, 1),
+        'incremental_ms': round(incremental_ms, 2),
+        'query_ms': round(query_ms, 2),
+        'series_ms': round(series_ms, 2),
+        'series_python_ms': round(python_series_ms, 2),
+        'ctl_error': abs(summary['ctl'] - round(ctl, 1)),
+        'atl_error': abs(summary['atl'] - round(atl, 1)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='训练负荷基准测试')
+    parser.add_argument('--years', default='1,3,5', help='训练历史的年数，逗号分隔')
+    parser.add_argument('--samples', type=int, default=1800, help='每个活动心率流数据的最大点数')
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    # 预先导入numpy，不计入第一组的耗时
+    hr_stream_loads([])
+    rows = [bench(float(y), args.samples) for y in args.years.split(',')]
+    print(f"{'年数':>6}{'活动数':>8}{'TRIMP Python ms':>17}{'TRIMP numpy ms':>16}{'增量同步 ms':>12}"
+          f"{'查询 ms':>10}{'曲线 ms':>10}{'逐日递推 ms':>12}{'CTL误差':>9}")
+    for row in rows:
+        print(f"{row['years']:>6}{row['activities']:>8}{row['trimp_python_ms']:>17}{row['trimp_numpy_ms']:>16}"
+              f"{row['incremental_ms']:>12}{row['query_ms']:>10}{row['series_ms']:>10}{row['series_python_ms']:>12}{row['ctl_error']:>9.1f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
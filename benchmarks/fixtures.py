@@ -0,0 +1,46 @@
+"""
+基准测试用的合成GPX数据
+
+生成确定性的山地越野路线：经纬度沿一条缓慢弯曲的路径前进，海拔由几组正弦波
+叠加随机噪声组成，相同的点数和种子总是生成相同的文件。
+"""
+import math
+import random
+
+# 路线起点（杭州附近）
+START_LAT = 30.25
+START_LON = 120.10
+
+# 路线最长约170公里，点数较少时按每10米一个点生成
+MAX_ROUTE_KM = 170
+MAX_STEP_M = 10
+
+
+def make_profile(n_points, seed=0):
+    """生成轨迹点列表 [(lat, lon, ele), ...]"""
+    rng = random.Random(seed)
+    step_m = min(MAX_STEP_M, MAX_ROUTE_KM * 1000 / max(n_points, 1))
+    lat, lon = START_LAT, START_LON
+    heading = 0.0
+    points = []
+    for i in range(n_points):
+        km = i * step_m / 1000
+        heading += 0.002 * math.sin(km / 3)
+        lat += step_m * math.cos(heading) / 111320
+        lon += step_m * math.sin(heading) / (111320 * math.cos(math.radians(lat)))
+        ele = 800 + 700 * math.sin(km / 11) + 150 * math.sin(km / 2.3) + rng.uniform(-2, 2)
+        points.append((lat, lon, ele))
+    return points
+
+
+def make_gpx(n_points, seed=0):
+    """生成包含n_points个轨迹点的GPX文本"""
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<gpx version="1.1" creator="OpenRunTraining benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n'
+        '<trk><name>bench</name><trkseg>\n'
+    ]
+    for lat, lon, ele in make_profile(n_points, seed):
+        parts.append(f'<trkpt lat="{lat:.7f}" lon="{lon:.7f}"><ele>{ele:.1f}</ele></trkpt>\n')
+    parts.append('</trkseg></trk>\n</gpx>\n')
+    return "".join(parts)
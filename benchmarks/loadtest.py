@@ -0,0 +1,410 @@
+"""
+离线压测工具：用本地替身服务代替Strava、Visual Crossing和DeepSeek，
+在gunicorn下启动真实应用，并用并发虚拟用户回放真实的流量组合。
+
+用于确定 gunicorn_config.py 中 workers 和 threads 的取值。可以一次测试多组配置：
+
+    python benchmarks/loadtest.py --workers 2,4 --threads 2,4 --users 20 --duration 60
+    python benchmarks/loadtest.py --strava-latency-ms 300 --strava-rate-limit 100 --output loadtest.json
+
+流量组合通过 --mix 指定，例如 dashboard=35,activity=30,upload=10,weather=10,advice=15。
+报告包括每种请求的吞吐量和延迟分位数，以及worker饱和度：
+- 在途请求数相对 workers*threads 的占比和打满时间比例
+- 探测请求（/about）的延迟，worker排队时会明显升高
+- 每个worker进程的CPU占用（仅Linux）
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import make_gpx
+from stub_servers import start_stub_server, StubLLMHandler, StubWeatherHandler, StubStravaHandler
+from run_benchmarks import percentile
+
+DEFAULT_MIX = 'dashboard=35,activity=30,upload=10,weather=10,advice=15'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+class Recorder:
+    """线程安全地记录请求结果和在途请求数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = []
+        self.in_flight = 0
+
+    def start(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def finish(self, scenario, status, latency, ttfb=None):
+        with self.lock:
+            self.in_flight -= 1
+            self.samples.append((scenario, status, latency, ttfb))
+
+
+class VirtualUser(threading.Thread):
+    """按流量组合循环发送请求的虚拟用户"""
+
+    def __init__(self, index, base_url, args, mix, gpx_bytes, recorder, deadline):
+        super().__init__(daemon=True)
+        self.index = index
+        self.base_url = base_url
+        self.args = args
+        self.mix = mix
+        self.gpx_bytes = gpx_bytes
+        self.recorder = recorder
+        self.deadline = deadline
+        self.rng = random.Random(args.seed + index)
+        self.session = requests.Session()
+        self.data_id = None
+
+    def request(self, scenario, method, path, stream=False, **kwargs):
+        self.recorder.start()
+        start = time.perf_counter()
+        status = 0
+        ttfb = None
+        try:
+            response = self.session.request(method, self.base_url + path, stream=stream,
+                                            timeout=self.args.request_timeout, allow_redirects=False, **kwargs)
+            status = response.status_code
+            if stream:
+                for line in response.iter_lines():
+                    if ttfb is None and line.startswith(b'data:'):
+                        ttfb = time.perf_counter() - start
+                    if b'"complete"' in line or b'"error"' in line:
+                        break
+                response.close()
+            else:
+                response.content
+            return response
+        except requests.RequestException:
+            return None
+        finally:
+            self.recorder.finish(scenario, status, time.perf_counter() - start, ttfb)
+
+    def upload(self):
+        response = self.request('upload', 'POST', '/upload_gpx',
+                                files={'gpx_file': ('race.gpx', self.gpx_bytes, 'application/gpx+xml')})
+        if response is not None and response.status_code == 200:
+            self.data_id = response.json().get('data_id')
+
+    def run(self):
+        # 通过OAuth回调登录，替身Strava会为任意授权码签发令牌
+        self.request('login', 'GET', f"/callback?code=vu-{self.index}")
+
+        scenarios, weights = zip(*self.mix.items())
+        while time.time() < self.deadline:
+            scenario = self.rng.choices(scenarios, weights)[0]
+            if scenario == 'dashboard':
+                self.request('dashboard', 'GET', '/dashboard')
+            elif scenario == 'activity':
+                activity_id = self.rng.randint(1, self.args.activities)
+                self.request('activity', 'GET', f"/activity/{activity_id}")
+            elif scenario == 'upload':
+                self.upload()
+            elif scenario == 'weather':
+                self.request('weather', 'POST', '/get_weather_data',
+                             json={'latitude': 30.25, 'longitude': 120.10, 'date': '2026-06-01'})
+            elif scenario == 'advice':
+                if not self.data_id:
+                    self.upload()
+                if self.data_id:
+                    self.request('advice', 'GET',
+                                 f"/get_training_advice?data_id={self.data_id}&match_date=2026-10-01", stream=True)
+
+            if self.args.think_time_ms:
+                time.sleep(self.rng.uniform(0.5, 1.5) * self.args.think_time_ms / 1000)
+
+
+def worker_pids(master_pid):
+    """通过/proc找到gunicorn master的子进程"""
+    pids = []
+    if not os.path.isdir('/proc'):
+        return pids
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[1]) == master_pid:
+                pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+def cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class SaturationSampler(threading.Thread):
+    """定期采样在途请求数、探测请求延迟和worker CPU占用"""
+
+    def __init__(self, base_url, master_pid, recorder, capacity, interval, deadline):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.master_pid = master_pid
+        self.recorder = recorder
+        self.capacity = capacity
+        self.interval = interval
+        self.deadline = deadline
+        self.in_flight = []
+        self.probe_latencies = []
+        self.worker_cpu = {}
+
+    def run(self):
+        session = requests.Session()
+        last_cpu = {}
+        last_time = time.time()
+        while time.time() < self.deadline:
+            self.in_flight.append(self.recorder.in_flight)
+
+            start = time.perf_counter()
+            try:
+                session.get(self.base_url + '/about', timeout=30).content
+                self.probe_latencies.append(time.perf_counter() - start)
+            except requests.RequestException:
+                pass
+
+            now = time.time()
+            for pid in worker_pids(self.master_pid):
+                seconds = cpu_seconds(pid)
+                if seconds is None:
+                    continue
+                if pid in last_cpu:
+                    usage = (seconds - last_cpu[pid]) / max(now - last_time, 1e-6)
+                    self.worker_cpu.setdefault(pid, []).append(usage)
+                last_cpu[pid] = seconds
+            last_time = now
+
+            time.sleep(self.interval)
+
+    def report(self):
+        samples = self.in_flight or [0]
+        cpu_means = [sum(v) / len(v) for v in self.worker_cpu.values() if v]
+        return {
+            'capacity': self.capacity,
+            'in_flight_mean': round(sum(samples) / len(samples), 2),
+            'in_flight_max': max(samples),
+            'utilization': round(sum(samples) / len(samples) / self.capacity, 3),
+            'saturated_fraction': round(sum(1 for s in samples if s >= self.capacity) / len(samples), 3),
+            'probe_p50_ms': round(percentile(self.probe_latencies, 50) * 1000, 1),
+            'probe_p99_ms': round(percentile(self.probe_latencies, 99) * 1000, 1),
+            'worker_cpu_mean': round(sum(cpu_means) / len(cpu_means), 3) if cpu_means else None,
+            'worker_cpu_max': round(max(cpu_means), 3) if cpu_means else None
+        }
+
+
+def start_app(args, workers, threads, env):
+    """在临时工作目录中用gunicorn启动应用，返回进程和地址"""
+    work_dir = tempfile.mkdtemp(prefix='openrun_loadtest_')
+    os.makedirs(os.path.join(work_dir, 'logs'))
+    os.makedirs(os.path.join(work_dir, 'data_store'))
+
+    bind = f"127.0.0.1:{args.port}"
+    app_env = dict(env)
+    app_env.update({
+        'GUNICORN_BIND': bind,
+        'GUNICORN_WORKERS': str(workers),
+        'GUNICORN_THREADS': str(threads),
+        'DATA_STORE_DIR': os.path.join(work_dir, 'data_store'),
+        'GUNICORN_PIDFILE': os.path.join(work_dir, 'gunicorn.pid'),
+    })
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT_DIR, 'gunicorn_config.py'),
+         '--pythonpath', ROOT_DIR,
+         '--access-logfile', os.path.join(work_dir, 'access.log'),
+         '--error-logfile', os.path.join(work_dir, 'error.log'),
+         'app:app'],
+        cwd=work_dir, env=app_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+    base_url = f"http://{bind}"
+    for _ in range(200):
+        try:
+            if requests.get(base_url + '/about', timeout=1).status_code == 200:
+                return proc, base_url, work_dir
+        except requests.RequestException:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"gunicorn启动失败，请查看 {os.path.join(work_dir, 'error.log')}")
+
+
+def summarize_samples(samples, duration):
+    """按请求类型统计吞吐量、错误数和延迟分位数"""
+    report = {}
+    for scenario in sorted({s[0] for s in samples}):
+        rows = [s for s in samples if s[0] == scenario]
+        latencies = [s[2] for s in rows]
+        ttfbs = [s[3] for s in rows if s[3] is not None]
+        entry = {
+            'count': len(rows),
+            'errors': sum(1 for s in rows if s[1] == 0 or s[1] >= 500),
+            'status_429': sum(1 for s in rows if s[1] == 429),
+            'rps': round(len(rows) / duration, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+            'max_ms': round(max(latencies) * 1000, 1)
+        }
+        if ttfbs:
+            entry['ttfb_p50_ms'] = round(percentile(ttfbs, 50) * 1000, 1)
+            entry['ttfb_p99_ms'] = round(percentile(ttfbs, 99) * 1000, 1)
+        report[scenario] = entry
+    return report
+
+
+def run_config(args, workers, threads, env, mix, gpx_bytes):
+    proc, base_url, work_dir = start_app(args, workers, threads, env)
+    try:
+        recorder = Recorder()
+        start = time.time()
+        deadline = start + args.duration
+        sampler = SaturationSampler(base_url, proc.pid, recorder, workers * threads,
+                                    args.sample_interval, deadline)
+        users = [VirtualUser(i, base_url, args, mix, gpx_bytes, recorder, deadline) for i in range(args.users)]
+        sampler.start()
+        for user in users:
+            user.start()
+            if args.ramp_up:
+                time.sleep(args.ramp_up / args.users)
+        for user in users:
+            user.join(args.request_timeout + args.duration)
+        sampler.join()
+        elapsed = time.time() - start
+
+        samples = [s for s in recorder.samples if s[0] != 'login']
+        return {
+            'workers': workers,
+            'threads': threads,
+            'users': args.users,
+            'duration_s': round(elapsed, 1),
+            'total_requests': len(samples),
+            'throughput_rps': round(len(samples) / elapsed, 2),
+            'scenarios': summarize_samples(samples, elapsed),
+            'saturation': sampler.report()
+        }
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def print_report(result):
+    sat = result['saturation']
+    print(f"\n=== workers={result['workers']} threads={result['threads']} users={result['users']} "
+          f"吞吐量={result['throughput_rps']} req/s ===")
+    print(f"{'scenario':<12}{'count':>7}{'err':>6}{'429':>6}{'rps':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, s in result['scenarios'].items():
+        print(f"{name:<12}{s['count']:>7}{s['errors']:>6}{s['status_429']:>6}{s['rps']:>8}"
+              f"{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}{s['max_ms']:>10}")
+    print(f"饱和度: 在途均值={sat['in_flight_mean']}/{sat['capacity']} 利用率={sat['utilization']} "
+          f"打满时间比例={sat['saturated_fraction']} 探测p50={sat['probe_p50_ms']}ms p99={sat['probe_p99_ms']}ms "
+          f"worker CPU均值={sat['worker_cpu_mean']} 最大={sat['worker_cpu_max']}")
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, weight = item.split('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenRunTraining离线压测工具')
+    parser.add_argument('--workers', default='2', help='gunicorn worker数量，逗号分隔可测试多组')
+    parser.add_argument('--threads', default='2', help='每个worker的线程数，逗号分隔可测试多组')
+    parser.add_argument('--users', type=int, default=10, help='并发虚拟用户数')
+    parser.add_argument('--duration', type=float, default=30, help='每组配置的压测时长（秒）')
+    parser.add_argument('--ramp-up', type=float, default=0, help='虚拟用户逐步启动的时长（秒）')
+    parser.add_argument('--think-time-ms', type=float, default=500, help='虚拟用户两次请求之间的平均间隔')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='流量组合权重')
+    parser.add_argument('--port', type=int, default=8765, help='应用监听端口')
+    parser.add_argument('--gpx-points', type=int, default=5000, help='上传GPX的轨迹点数')
+    parser.add_argument('--activities', type=int, default=200, help='替身Strava的活动数量')
+    parser.add_argument('--stream-points', type=int, default=3000, help='替身Strava每个活动的流数据点数')
+    parser.add_argument('--strava-latency-ms', type=float, default=150)
+    parser.add_argument('--strava-rate-limit', type=int, default=0, help='替身Strava每个窗口的请求限额，0为不限')
+    parser.add_argument('--strava-rate-window-s', type=float, default=900)
+    parser.add_argument('--weather-latency-ms', type=float, default=200)
+    parser.add_argument('--llm-latency-ms', type=float, default=500, help='替身LLM的首包延迟')
+    parser.add_argument('--llm-tokens', type=int, default=1024)
+    parser.add_argument('--llm-token-interval-ms', type=float, default=10, help='替身LLM的token间隔（流式速度）')
+    parser.add_argument('--llm-rate-limit', type=int, default=0)
+    parser.add_argument('--request-timeout', type=float, default=330)
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='饱和度采样间隔（秒）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='结果保存为JSON文件')
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    strava, strava_url = start_stub_server(
+        StubStravaHandler, latency_ms=args.strava_latency_ms, rate_limit=args.strava_rate_limit,
+        rate_window_s=args.strava_rate_window_s, activities=args.activities, stream_points=args.stream_points)
+    weather, weather_url = start_stub_server(StubWeatherHandler, latency_ms=args.weather_latency_ms)
+    llm, llm_url = start_stub_server(
+        StubLLMHandler, latency_ms=args.llm_latency_ms, tokens=args.llm_tokens,
+        token_interval_ms=args.llm_token_interval_ms, rate_limit=args.llm_rate_limit, rate_window_s=60)
+
+    env = dict(os.environ)
+    env.setdefault('DEEPSEEK_API_KEY', 'loadtest')
+    env.setdefault('SECRET_KEY', 'loadtest-secret')  # 所有worker必须使用相同的密钥才能共享session
+    env.update({
+        'STRAVA_API_BASE_URL': strava_url + '/api/v3',
+        'VISUAL_CROSSING_BASE_URL': weather_url + '/timeline',
+        'VISUAL_CROSSING_API_KEY': 'loadtest',
+        'DEEPSEEK_BASE_URL': llm_url + '/v1',
+    })
+
+    gpx_bytes = make_gpx(args.gpx_points).encode('utf-8')
+    results = []
+    for workers in [int(w) for w in args.workers.split(',')]:
+        for threads in [int(t) for t in args.threads.split(',')]:
+            result = run_config(args, workers, threads, env, mix, gpx_bytes)
+            result['upstream_429'] = {'strava': strava.rejected, 'llm': llm.rejected}
+            print_report(result)
+            results.append(result)
+
+    for server in (strava, weather, llm):
+        server.shutdown()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'meta': {
+                    'timestamp': datetime.now().isoformat(timespec='seconds'),
+                    'args': vars(args)
+                },
+                'results': results
+            }, f, indent=2, ensure_ascii=False)
+        print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
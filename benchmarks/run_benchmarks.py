@@ -0,0 +1,274 @@
+"""
+GPX、天气和训练建议热点路径的基准测试
+
+每个阶段在独立的子进程中运行，以便分别统计峰值内存（RSS）。
+上游的DeepSeek和Visual Crossing由本地替身服务代替，整个测试可以离线运行。
+
+用法:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 1000,10000 --repeat 3 --output before.json
+    python benchmarks/run_benchmarks.py --output after.json --compare before.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fixtures import make_gpx
+from stub_servers import start_stub_server, StubLLMHandler, StubWeatherHandler
+
+STAGES = ['gpx_parse', 'upload_gpx', 'route_summary', 'pickle_roundtrip', 'weather', 'advice_sse']
+# 与路线大小无关的阶段只运行一次
+SIZE_INDEPENDENT_STAGES = {'weather'}
+DEFAULT_SIZES = '1000,10000,100000,500000'
+RESULT_MARKER = 'BENCH_RESULT '
+# 大文件异步上传时轮询解析状态的间隔（秒）
+UPLOAD_POLL_INTERVAL = 0.05
+
+
+def percentile(values, pct):
+    """最近秩法计算百分位数"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """当前进程的峰值RSS（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS返回字节，Linux返回KB
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def load_app(work_dir):
+    """在临时工作目录中导入应用，数据和日志都写到临时目录"""
+    os.makedirs(os.path.join(work_dir, 'logs'), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'data_store'), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, 'uploads'), exist_ok=True)
+    os.chdir(work_dir)
+
+    import app as app_module
+    app_module.DATA_STORE_DIR = os.path.join(work_dir, 'data_store')
+    app_module.app.config['UPLOAD_FOLDER'] = os.path.join(work_dir, 'uploads')
+    # 允许上传超过20MB限制的大文件，测量的是处理开销而不是限制本身
+    app_module.app.config['MAX_CONTENT_LENGTH'] = None
+    return app_module
+
+
+def run_stage(stage, n_points, repeat):
+    """在子进程中运行单个阶段，返回每次迭代的耗时和附加指标"""
+    work_dir = tempfile.mkdtemp(prefix='openrun_bench_')
+    app_module = load_app(work_dir)
+    from route_analysis import analyze_gpx
+
+    gpx_text = make_gpx(n_points) if n_points else make_gpx(1000)
+    gpx_bytes = gpx_text.encode('utf-8')
+    client = app_module.app.test_client()
+    extra = {}
+    timings = []
+
+    def upload():
+        """上传GPX，超过GPX_ASYNC_BYTES的文件返回202，轮询status_url直到解析完成，耗时包含整个往返"""
+        response = client.post('/upload_gpx', data={'gpx_file': (io.BytesIO(gpx_bytes), 'bench.gpx')},
+                               content_type='multipart/form-data')
+        if response.status_code == 202:
+            extra['async'] = True
+            status_url = response.get_json()['status_url']
+            while response.status_code == 202:
+                time.sleep(UPLOAD_POLL_INTERVAL)
+                response = client.get(status_url)
+        assert response.status_code == 200, response.get_data(as_text=True)[:200]
+        return response
+
+    if stage in ('route_summary', 'pickle_roundtrip', 'advice_sse'):
+        route = analyze_gpx(gpx_text)
+    if stage == 'weather':
+        upload()
+
+    baseline_rss = peak_rss_mb()
+
+    for _ in range(repeat):
+        if stage == 'gpx_parse':
+            start = time.perf_counter()
+            analyze_gpx(gpx_text)
+            timings.append(time.perf_counter() - start)
+
+        elif stage == 'upload_gpx':
+            start = time.perf_counter()
+            response = upload()
+            timings.append(time.perf_counter() - start)
+            extra['response_bytes'] = len(response.get_data())
+
+        elif stage == 'route_summary':
+            start = time.perf_counter()
+            prompt_data = app_module.ai_service.prepare_prompt_data(route, [])
+            timings.append(time.perf_counter() - start)
+            extra['summary_tokens'] = prompt_data['route_summary']['estimated_tokens']
+
+        elif stage == 'pickle_roundtrip':
+            data = {'gpx_data': route, 'weather_data': [], 'timestamp': time.time()}
+            start = time.perf_counter()
+            app_module.save_data_to_file('bench', data)
+            app_module.load_data_from_file('bench')
+            timings.append(time.perf_counter() - start)
+            extra['file_bytes'] = os.path.getsize(os.path.join(app_module.DATA_STORE_DIR, 'bench.pkl'))
+
+        elif stage == 'weather':
+            start = time.perf_counter()
+            response = client.post('/get_weather_data', json={
+                'latitude': 30.25, 'longitude': 120.10, 'date': '2026-06-01'
+            })
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200
+
+        elif stage == 'advice_sse':
+            app_module.temp_data_store['bench'] = {'gpx_data': route, 'weather_data': [], 'timestamp': time.time()}
+            start = time.perf_counter()
+            response = client.get('/get_training_advice?data_id=bench&match_date=2026-10-01')
+            frames = 0
+            first_text = None
+            for chunk in response.response:
+                if isinstance(chunk, bytes):
+                    chunk = chunk.decode('utf-8')
+                frames += chunk.count('\n\n')
+                if first_text is None and frames > 1:
+                    first_text = time.perf_counter() - start
+            timings.append(time.perf_counter() - start)
+            response.close()
+            extra['frames'] = frames
+            extra['first_text_ms'] = round((first_text or 0) * 1000, 2)
+
+    return {
+        'stage': stage,
+        'points': n_points,
+        'iterations': repeat,
+        'timings': timings,
+        'baseline_rss_mb': round(baseline_rss, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'extra': extra
+    }
+
+
+def summarize(raw):
+    """把子进程的原始耗时整理为吞吐量和延迟百分位"""
+    timings = raw.pop('timings')
+    p50 = percentile(timings, 50)
+    raw.update({
+        'p50_ms': round(p50 * 1000, 2),
+        'p99_ms': round(percentile(timings, 99) * 1000, 2),
+        'throughput_per_s': round(len(timings) / sum(timings), 2) if sum(timings) else 0,
+        'points_per_s': round(raw['points'] / p50) if raw['points'] and p50 else None,
+        'rss_delta_mb': round(raw['peak_rss_mb'] - raw['baseline_rss_mb'], 1)
+    })
+    return raw
+
+
+def print_table(results, baseline=None):
+    header = f"{'stage':<18}{'points':>8}{'p50 ms':>11}{'p99 ms':>11}{'ops/s':>9}{'pts/s':>11}{'peak MB':>9}{'ΔMB':>8}"
+    if baseline:
+        header += f"{'p50 vs base':>13}"
+    print(header)
+    for r in results:
+        line = (f"{r['stage']:<18}{r['points'] or '-':>8}{r['p50_ms']:>11}{r['p99_ms']:>11}"
+                f"{r['throughput_per_s']:>9}{r['points_per_s'] or '-':>11}{r['peak_rss_mb']:>9}{r['rss_delta_mb']:>8}")
+        if baseline:
+            base = baseline.get((r['stage'], r['points']))
+            if base and base['p50_ms']:
+                line += f"{r['p50_ms'] / base['p50_ms']:>12.2f}x"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenRunTraining热点路径基准测试')
+    parser.add_argument('--stages', default=','.join(STAGES), help='要运行的阶段，逗号分隔')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES, help='GPX轨迹点数量，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=5, help='每个阶段的迭代次数')
+    parser.add_argument('--llm-tokens', type=int, default=4096, help='替身LLM每次输出的token数')
+    parser.add_argument('--llm-token-interval-ms', type=float, default=0, help='替身LLM的token间隔')
+    parser.add_argument('--upstream-latency-ms', type=float, default=0, help='替身服务的响应延迟')
+    parser.add_argument('--output', default='bench_results.json', help='结果JSON文件')
+    parser.add_argument('--compare', help='与之前保存的结果JSON对比')
+    parser.add_argument('--child', nargs=3, metavar=('STAGE', 'POINTS', 'REPEAT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        stage, n_points, repeat = args.child[0], int(args.child[1]), int(args.child[2])
+        result = run_stage(stage, n_points, repeat)
+        sys.stdout.write(RESULT_MARKER + json.dumps(result) + "\n")
+        return
+
+    llm_server, llm_url = start_stub_server(StubLLMHandler, tokens=args.llm_tokens,
+                                            token_interval_ms=args.llm_token_interval_ms,
+                                            latency_ms=args.upstream_latency_ms)
+    weather_server, weather_url = start_stub_server(StubWeatherHandler, latency_ms=args.upstream_latency_ms)
+
+    env = dict(os.environ)
+    env.setdefault('DEEPSEEK_API_KEY', 'bench')
+    env['DEEPSEEK_BASE_URL'] = llm_url + '/v1'
+    env['VISUAL_CROSSING_BASE_URL'] = weather_url + '/timeline'
+    env['VISUAL_CROSSING_API_KEY'] = 'bench'
+    env['PYTHONPATH'] = ROOT_DIR + os.pathsep + env.get('PYTHONPATH', '')
+
+    stages = [s for s in args.stages.split(',') if s]
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    results = []
+
+    for stage in stages:
+        for n_points in ([0] if stage in SIZE_INDEPENDENT_STAGES else sizes):
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--child', stage, str(n_points), str(args.repeat)],
+                env=env, capture_output=True, text=True
+            )
+            lines = [l for l in proc.stdout.splitlines() if l.startswith(RESULT_MARKER)]
+            if proc.returncode != 0 or not lines:
+                print(f"阶段 {stage} ({n_points}点) 运行失败:\n{proc.stderr[-2000:]}")
+                continue
+            result = summarize(json.loads(lines[-1][len(RESULT_MARKER):]))
+            results.append(result)
+            print(f"完成 {stage} ({n_points or '-'}点): p50={result['p50_ms']}ms")
+
+    llm_server.shutdown()
+    weather_server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(r['stage'], r['points']): r for r in json.load(f)['results']}
+
+    print()
+    print_table(results, baseline)
+
+    output = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'llm_tokens': args.llm_tokens,
+            'llm_token_interval_ms': args.llm_token_interval_ms,
+            'upstream_latency_ms': args.upstream_latency_ms
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2, ensure_ascii=False)
+    print(f"\n结果已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
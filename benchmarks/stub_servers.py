@@ -0,0 +1,275 @@
+"""
+离线基准测试用的上游替身服务
+
+- StubLLMHandler: 模拟DeepSeek的 /chat/completions 流式接口
+- StubWeatherHandler: 模拟Visual Crossing的 timeline 接口
+- StubStravaHandler: 模拟Strava的OAuth、运动员、活动列表、活动详情和流数据接口
+
+通过环境变量 DEEPSEEK_BASE_URL、VISUAL_CROSSING_BASE_URL 和 STRAVA_API_BASE_URL
+把应用指向这些服务。
+
+所有替身服务都支持以下配置:
+- latency_ms: 每个请求的固定延迟
+- rate_limit / rate_window_s: 每个时间窗口允许的请求数，超出返回429
+"""
+import re
+import json
+import time
+import zlib
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import polyline
+
+from fixtures import make_profile
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """替身服务的公共基类，配置保存在server对象上"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def simulate_latency(self):
+        latency = self.server.config.get('latency_ms', 0)
+        if latency:
+            time.sleep(latency / 1000)
+
+    def record(self, kind):
+        """按接口类型统计请求数"""
+        with self.server.lock:
+            self.server.requests[kind] = self.server.requests.get(kind, 0) + 1
+
+    def check_rate_limit(self):
+        """按固定窗口计数，超出限额时返回429并返回False"""
+        config = self.server.config
+        limit = config.get('rate_limit')
+        if not limit:
+            return True
+
+        window = config.get('rate_window_s', 900)
+        with self.server.lock:
+            now = time.time()
+            if now - self.server.window_start >= window:
+                self.server.window_start = now
+                self.server.window_count = 0
+            self.server.window_count += 1
+            allowed = self.server.window_count <= limit
+            if not allowed:
+                self.server.rejected += 1
+
+        if not allowed:
+            self.send_json({'message': 'Rate Limit Exceeded'}, status=429)
+        return allowed
+
+    def send_rate_limit_headers(self):
+        limit = self.server.config.get('rate_limit')
+        if limit:
+            self.send_header('X-RateLimit-Limit', f"{limit},{limit * 96}")
+            self.send_header('X-RateLimit-Usage', f"{self.server.window_count},{self.server.window_count}")
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_rate_limit_headers()
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubLLMHandler(StubHandler):
+    """按固定速度逐token输出思考内容和正文的流式接口"""
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.simulate_latency()
+        if not self.check_rate_limit():
+            return
+
+        config = self.server.config
+        tokens = config.get('tokens', 4096)
+        token_interval = config.get('token_interval_ms', 0) / 1000
+        reasoning_tokens = tokens // 4
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+
+        try:
+            for i in range(tokens):
+                key = 'reasoning_content' if i < reasoning_tokens else 'content'
+                delta = {key: '训练' if i % 8 else '建议。\n'}
+                chunk = {'choices': [{'delta': delta}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                if token_interval:
+                    time.sleep(token_interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class StubWeatherHandler(StubHandler):
+    """返回确定性合成天气的timeline接口，支持单日和日期范围"""
+
+    def do_GET(self):
+        self.simulate_latency()
+        if not self.check_rate_limit():
+            return
+
+        path = self.path.split('?', 1)[0].rstrip('/')
+        parts = path.split('/')
+        dates = [p for p in parts if len(p) == 10 and p[4] == '-' and p[7] == '-']
+        if not dates:
+            self.send_json({'error': 'missing date'}, status=400)
+            return
+
+        start = datetime.strptime(dates[0], '%Y-%m-%d')
+        end = datetime.strptime(dates[-1], '%Y-%m-%d')
+        days = []
+        day = start
+        while day <= end:
+            seed = zlib.crc32(day.strftime('%Y-%m-%d').encode()) % 1000
+            days.append({
+                'datetime': day.strftime('%Y-%m-%d'),
+                'temp': round(10 + seed % 20 + seed / 1000, 1),
+                'humidity': 40 + seed % 50,
+                'precip': round((seed % 7) * 0.8, 1) if seed % 3 == 0 else 0.0,
+                'windspeed': round(5 + seed % 25, 1),
+                'conditions': 'Rain' if seed % 3 == 0 else 'Clear'
+            })
+            day += timedelta(days=1)
+
+        self.send_json({'days': days})
+
+
+class StubStravaHandler(StubHandler):
+    """
+    Strava API v3的替身服务
+
+    配置:
+        activities: 活动数量
+        polyline_points: 每个活动路线的点数
+        stream_points: 每个活动流数据的点数
+        revoked: 为True时刷新令牌返回401，模拟运动员已取消授权
+    """
+
+    ACTIVITY_RE = re.compile(r'/activities/(\d+)(/streams)?$')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.simulate_latency()
+        if not self.check_rate_limit():
+            return
+
+        if self.path.split('?', 1)[0].endswith('/oauth/token'):
+            if self.server.config.get('revoked'):
+                self.send_json({'message': 'Authorization Error'}, status=401)
+                return
+            self.send_json({
+                'access_token': f"stub-access-{time.time_ns()}",
+                'refresh_token': 'stub-refresh',
+                'expires_at': int(time.time()) + 6 * 3600,
+                'athlete': {'id': 1}
+            })
+        else:
+            self.send_json({'message': 'Not Found'}, status=404)
+
+    def do_GET(self):
+        self.simulate_latency()
+        if not self.check_rate_limit():
+            return
+
+        path = self.path.split('?', 1)[0].rstrip('/')
+        match = self.ACTIVITY_RE.search(path)
+        if path.endswith('/athlete'):
+            self.record('athlete')
+            self.send_json({'id': 1, 'firstname': 'Stub', 'lastname': 'Runner',
+                            'profile': '', 'profile_medium': ''})
+        elif path.endswith('/athlete/activities'):
+            self.record('activities')
+            # 与Strava一致按page/per_page分页
+            query = parse_qs(urlparse(self.path).query)
+            per_page = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            count = self.server.config.get('activities', 200)
+            start = (page - 1) * per_page + 1
+            self.send_json([self.make_activity(i) for i in range(start, min(start + per_page, count + 1))])
+        elif match and match.group(2):
+            self.record('streams')
+            self.send_json(self.make_streams(int(match.group(1))))
+        elif match:
+            self.record('activity')
+            self.send_json(self.make_activity(int(match.group(1)), detailed=True))
+        else:
+            self.send_json({'message': 'Not Found'}, status=404)
+
+    def make_activity(self, activity_id, detailed=False):
+        cache = self.server.__dict__.setdefault('polyline_cache', {})
+        n_points = self.server.config.get('polyline_points', 200)
+        if n_points not in cache:
+            cache[n_points] = polyline.encode([(p[0], p[1]) for p in make_profile(n_points)])
+
+        start = datetime(2025, 1, 1) + timedelta(days=activity_id * 2)
+        distance = 5000 + (activity_id * 137) % 20000
+        moving_time = int(distance * 0.36)
+        activity = {
+            'id': activity_id,
+            'name': f"Stub Run {activity_id}",
+            'type': 'Run',
+            'distance': distance,
+            'moving_time': moving_time,
+            'elapsed_time': moving_time + 120,
+            'total_elevation_gain': (activity_id * 37) % 900,
+            'start_date': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'start_date_local': start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'average_speed': distance / moving_time,
+            'max_speed': distance / moving_time * 1.6,
+            'average_heartrate': 145,
+            'max_heartrate': 176,
+            'map': {'summary_polyline': cache[n_points]}
+        }
+        if detailed:
+            activity['map']['polyline'] = cache[n_points]
+            activity['splits_metric'] = [
+                {'distance': 1000, 'elevation_difference': (k * 7) % 40 - 20, 'moving_time': 330 + k % 60}
+                for k in range(int(distance // 1000))
+            ]
+        return activity
+
+    def make_streams(self, activity_id):
+        n = self.server.config.get('stream_points', 3000)
+        return {
+            'time': {'data': list(range(n))},
+            'distance': {'data': [i * 2.8 for i in range(n)]},
+            'heartrate': {'data': [130 + (i * 7) % 40 for i in range(n)]},
+            'cadence': {'data': [85 + i % 6 for i in range(n)]},
+            'altitude': {'data': [500 + 80 * ((i % 600) / 600) for i in range(n)]},
+            'velocity_smooth': {'data': [2.5 + (i % 50) / 50 for i in range(n)]},
+            'grade_smooth': {'data': [((i % 200) - 100) / 10 for i in range(n)]}
+        }
+
+
+def start_stub_server(handler_class, host='127.0.0.1', port=0, **config):
+    """
+    在后台线程中启动替身服务
+
+    Returns:
+        (server, base_url)
+    """
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    server.config = config
+    server.lock = threading.Lock()
+    server.window_start = time.time()
+    server.window_count = 0
+    server.rejected = 0
+    server.requests = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
@@ -0,0 +1,242 @@
+"""
+Strava推送事件模拟器
+
+向应用的 /webhook/strava 发送与Strava格式一致的订阅验证请求和推送事件，用于离线测试。
+
+    # 向运行中的应用发送订阅验证和一个新活动事件
+    python benchmarks/webhook_simulator.py --url http://127.0.0.1:8000 --verify-token secret --handshake
+    python benchmarks/webhook_simulator.py --url http://127.0.0.1:8000 --event create --owner-id 1 --activity-id 300
+
+    # 连续发送100个随机事件
+    python benchmarks/webhook_simulator.py --url http://127.0.0.1:8000 --burst 100 --owner-id 1
+
+    # 完整的离线自测：启动替身Strava，在进程内加载应用，登录后发送推送事件，
+    # 检查缓存的活动列表和活动详情是否被更新，以及访问页面时是否还需要请求Strava
+    python benchmarks/webhook_simulator.py --self-test
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBHOOK_PATH = '/webhook/strava'
+
+
+def make_event(aspect_type, owner_id, object_id=None, object_type='activity', updates=None, subscription_id=1):
+    """构造Strava格式的推送事件"""
+    return {
+        'aspect_type': aspect_type,
+        'event_time': int(time.time()),
+        'object_id': object_id if object_id is not None else owner_id,
+        'object_type': object_type,
+        'owner_id': owner_id,
+        'subscription_id': subscription_id,
+        'updates': updates or {}
+    }
+
+
+def deauthorize_event(owner_id, subscription_id=1):
+    return make_event('update', owner_id, object_type='athlete', updates={'authorized': 'false'},
+                      subscription_id=subscription_id)
+
+
+def random_event(rng, owner_id, activity_ids, subscription_id=1):
+    aspect_type = rng.choice(['create', 'create', 'update', 'delete'])
+    updates = {'title': f"Renamed {rng.randrange(1000)}"} if aspect_type == 'update' else {}
+    return make_event(aspect_type, owner_id, rng.choice(activity_ids), updates=updates, subscription_id=subscription_id)
+
+
+class HttpTarget:
+    """向运行中的应用发送请求"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def handshake(self, verify_token, challenge):
+        response = requests.get(self.base_url + WEBHOOK_PATH, params={
+            'hub.mode': 'subscribe', 'hub.verify_token': verify_token, 'hub.challenge': challenge
+        }, timeout=10)
+        return response.status_code, response.json()
+
+    def send(self, event):
+        start = time.perf_counter()
+        response = requests.post(self.base_url + WEBHOOK_PATH, json=event, timeout=10)
+        return response.status_code, time.perf_counter() - start
+
+
+class ClientTarget:
+    """通过Flask测试客户端发送请求（自测模式）"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def handshake(self, verify_token, challenge):
+        response = self.client.get(WEBHOOK_PATH, query_string={
+            'hub.mode': 'subscribe', 'hub.verify_token': verify_token, 'hub.challenge': challenge
+        })
+        return response.status_code, response.get_json()
+
+    def send(self, event):
+        start = time.perf_counter()
+        response = self.client.post(WEBHOOK_PATH, json=event)
+        return response.status_code, time.perf_counter() - start
+
+
+def check_handshake(target, verify_token):
+    challenge = f"challenge-{random.randrange(10 ** 9)}"
+    status, body = target.handshake(verify_token, challenge)
+    ok = status == 200 and body.get('hub.challenge') == challenge
+    print(f"订阅验证: {'通过' if ok else '失败'} (status={status}, body={body})")
+    status, _ = target.handshake(verify_token + '-wrong', challenge)
+    print(f"错误的验证令牌: status={status}（应为403）")
+    return ok
+
+
+def send_events(target, events):
+    """发送事件，返回每个请求的响应时间"""
+    latencies = []
+    for event in events:
+        status, latency = target.send(event)
+        latencies.append(latency)
+        if status != 200:
+            print(f"事件被拒绝: status={status} event={event}")
+    if latencies:
+        latencies.sort()
+        print(f"发送 {len(events)} 个事件，响应时间 p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"max={latencies[-1] * 1000:.1f}ms（Strava要求2秒内响应）")
+    return latencies
+
+
+def wait_for_queue(app_module, timeout=30):
+    """等待推送事件全部处理完成"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if app_module.webhook_queue.stats()['pending'] == 0:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def self_test(args):
+    from stub_servers import start_stub_server, StubStravaHandler
+
+    strava, strava_url = start_stub_server(StubStravaHandler, latency_ms=50, activities=args.activities)
+    work_dir = tempfile.mkdtemp(prefix='openrun_webhook_')
+    os.makedirs(os.path.join(work_dir, 'logs'))
+    os.chdir(work_dir)
+    os.environ.update({
+        'DEEPSEEK_API_KEY': os.environ.get('DEEPSEEK_API_KEY', 'webhook-test'),
+        'STRAVA_API_BASE_URL': strava_url + '/api/v3',
+        'STRAVA_WEBHOOK_VERIFY_TOKEN': args.verify_token,
+        'STRAVA_WEBHOOK_SUBSCRIPTION_ID': str(args.subscription_id),
+        'STRAVA_WEBHOOK_POLL_INTERVAL': '0.2',
+        'SESSION_DB_PATH': os.path.join(work_dir, 'sessions.db'),
+        'CACHE_DB_PATH': os.path.join(work_dir, 'cache.db'),
+        'DATA_STORE_DIR': os.path.join(work_dir, 'data_store'),
+    })
+    sys.path.insert(0, ROOT_DIR)
+    import app as app_module
+
+    client = app_module.app.test_client()
+    target = ClientTarget(client)
+    owner_id = 1  # 替身Strava的运动员ID
+    new_id = args.activity_id
+
+    client.get('/callback?code=stub')
+    client.get('/dashboard')
+    print(f"登录并首次访问仪表盘后的Strava请求: {dict(strava.requests)}")
+
+    results = {'handshake': check_handshake(target, args.verify_token)}
+
+    # 新活动：推送后访问仪表盘和活动详情都不应再请求Strava
+    send_events(target, [make_event('create', owner_id, new_id)])
+    results['queue_drained'] = wait_for_queue(app_module)
+    before = dict(strava.requests)
+    dashboard = client.get('/dashboard').get_data(as_text=True)
+    detail = client.get(f'/activity/{new_id}')
+    after = dict(strava.requests)
+    results['create_in_dashboard'] = f"Stub Run {new_id}" in dashboard
+    results['create_no_upstream'] = before == after and detail.status_code == 200
+    print(f"新活动出现在仪表盘: {results['create_in_dashboard']}，访问时无Strava请求: {results['create_no_upstream']}")
+
+    # 删除活动
+    send_events(target, [make_event('delete', owner_id, new_id)])
+    wait_for_queue(app_module)
+    dashboard = client.get('/dashboard').get_data(as_text=True)
+    results['delete_removed'] = f"Stub Run {new_id}" not in dashboard
+    print(f"删除后从仪表盘移除: {results['delete_removed']}")
+
+    # 重复事件在入队时合并
+    rng = random.Random(args.seed)
+    burst = [random_event(rng, owner_id, [new_id, new_id + 1, new_id + 2]) for _ in range(args.burst)]
+    send_events(target, burst)
+    results['burst_drained'] = wait_for_queue(app_module)
+
+    # 伪造的取消授权：Strava确认授权仍然有效，不删除任何数据
+    entries = app_module.response_cache.stats()['entries']
+    send_events(target, [deauthorize_event(owner_id, args.subscription_id)])
+    wait_for_queue(app_module)
+    results['forged_deauth_ignored'] = (app_module.token_manager.get(app_module.token_key(owner_id)) is not None
+                                        and app_module.response_cache.stats()['entries'] == entries)
+    print(f"伪造的取消授权被忽略: {results['forged_deauth_ignored']}")
+
+    # 取消授权：Strava拒绝刷新令牌后删除令牌和所有缓存
+    strava.config['revoked'] = True
+    send_events(target, [deauthorize_event(owner_id, args.subscription_id)])
+    wait_for_queue(app_module)
+    results['deauthorized'] = (app_module.token_manager.get(app_module.token_key(owner_id)) is None
+                               and app_module.response_cache.stats()['entries'] == 0)
+    print(f"取消授权后令牌和缓存已删除: {results['deauthorized']}")
+
+    print(f"队列统计: {app_module.webhook_queue.stats()}")
+    print(f"Strava请求合计: {dict(strava.requests)}")
+    strava.shutdown()
+    failed = [name for name, ok in results.items() if not ok]
+    print('自测通过' if not failed else f"自测失败: {failed}")
+    return 0 if not failed else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Strava推送事件模拟器')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='应用地址')
+    parser.add_argument('--verify-token', default='simulator-token', help='STRAVA_WEBHOOK_VERIFY_TOKEN')
+    parser.add_argument('--subscription-id', type=int, default=1)
+    parser.add_argument('--handshake', action='store_true', help='发送订阅验证请求')
+    parser.add_argument('--event', choices=['create', 'update', 'delete', 'deauthorize'], help='发送单个事件')
+    parser.add_argument('--owner-id', type=int, default=1)
+    parser.add_argument('--activity-id', type=int, default=300)
+    parser.add_argument('--burst', type=int, default=0, help='连续发送的随机事件数量')
+    parser.add_argument('--activities', type=int, default=150, help='自测时替身Strava的活动数量')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--self-test', action='store_true', help='离线自测')
+    args = parser.parse_args()
+
+    if args.self_test:
+        args.burst = args.burst or 20
+        return self_test(args)
+
+    target = HttpTarget(args.url)
+    if args.handshake:
+        check_handshake(target, args.verify_token)
+    if args.event == 'deauthorize':
+        send_events(target, [deauthorize_event(args.owner_id, args.subscription_id)])
+    elif args.event:
+        updates = {'title': 'Updated by simulator'} if args.event == 'update' else None
+        send_events(target, [make_event(args.event, args.owner_id, args.activity_id, updates=updates,
+                                        subscription_id=args.subscription_id)])
+    if args.burst:
+        rng = random.Random(args.seed)
+        ids = [args.activity_id + i for i in range(10)]
+        send_events(target, [random_event(rng, args.owner_id, ids, args.subscription_id) for _ in range(args.burst)])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+import os
+import sqlite3
+import threading
+
+
+class LocalSqlite:
+    """
+    按线程和进程分别创建的SQLite连接
+
+    sqlite连接不能跨线程或跨fork使用，多个gunicorn worker通过WAL模式共享同一个数据库文件。
+    """
+
+    def __init__(self, db_path, timeout=10):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def execute(self, sql, params=()):
+        return self.conn().execute(sql, params)
@@ -0,0 +1,86 @@
+import os
+import threading
+from collections import OrderedDict
+
+# 每个worker缓存的片段数量上限（活动列表的每个活动有表格行和地图数据两个片段）
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 5000))
+# Jinja模板字节码缓存目录，设为空字符串时不使用
+JINJA_BYTECODE_CACHE_DIR = os.getenv('JINJA_BYTECODE_CACHE_DIR',
+                                     os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jinja_cache'))
+
+
+class FragmentCache:
+    """
+    页面片段缓存：按 (类型, ID) 保存渲染好的HTML片段或序列化好的JSON
+
+    每个条目带有内容版本，版本不一致时重新生成。片段体积小、重新生成的代价低，保存在每个worker的内存中，
+    整页渲染时不必对每个片段查询一次共享缓存；超过容量时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get_or_render(self, kind, key, version, render):
+        """
+        返回缓存的片段，不存在或版本不一致时调用render生成并保存
+
+        Args:
+            kind: 片段类型，如 'activity_row'
+            key: 片段所属对象的ID
+            version: 内容版本，由片段依赖的数据计算
+            render: 生成片段的函数，返回字符串
+        """
+        cache_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(cache_key)
+                self._stats['hits'] += 1
+                return entry[1]
+            self._stats['misses'] += 1
+
+        # 在锁外渲染，同一片段并发生成时以后完成的为准
+        value = render()
+        with self._lock:
+            self._entries[cache_key] = (version, value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, kind, key):
+        with self._lock:
+            self._entries.pop((kind, key), None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = sum(len(value) for _, value in self._entries.values())
+        stats['max_entries'] = self.max_entries
+        stats['pid'] = os.getpid()
+        return stats
+
+
+def enable_bytecode_cache(jinja_env, directory=JINJA_BYTECODE_CACHE_DIR):
+    """
+    开启Jinja模板的字节码缓存，worker重启后直接加载编译好的模板
+
+    Returns:
+        是否已开启
+    """
+    if not directory:
+        return False
+    from jinja2 import FileSystemBytecodeCache
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as e:
+        print(f"无法创建模板字节码缓存目录 {directory}: {e}")
+        return False
+    jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+    return True
@@ -0,0 +1,217 @@
+import os
+import sys
+import time
+import threading
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, CancelledError, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+# 每个gunicorn worker中GPX解析进程池的大小，0表示在请求线程中直接解析
+GPX_POOL_SIZE = int(os.getenv('GPX_POOL_SIZE', 2))
+# 单个解析任务的超时时间（秒）
+GPX_JOB_TIMEOUT = float(os.getenv('GPX_JOB_TIMEOUT', 60))
+# 允许上传的GPX文件大小上限
+GPX_MAX_BYTES = int(os.getenv('GPX_MAX_BYTES', 20 * 1024 * 1024))
+# 超过这个大小的文件在后台解析，请求立即返回任务ID
+GPX_ASYNC_BYTES = int(os.getenv('GPX_ASYNC_BYTES', 5 * 1024 * 1024))
+# 每个worker同时排队和执行的解析任务上限，超出时拒绝新任务
+GPX_MAX_PENDING = int(os.getenv('GPX_MAX_PENDING', max(GPX_POOL_SIZE, 1) * 4))
+# 子进程处理多少个任务后重启，释放解析大文件后占用的内存
+MAX_TASKS_PER_CHILD = 50
+# ProcessPoolExecutor的max_tasks_per_child从Python 3.11开始支持，更早的版本按提交的任务数整体替换进程池
+NATIVE_MAX_TASKS = sys.version_info >= (3, 11)
+# 进程池因其他任务超时被结束时，受影响的任务最多重新提交的次数
+MAX_RESUBMITS = 2
+
+
+class GpxJobError(Exception):
+    """GPX解析失败"""
+
+
+class GpxJobTimeout(GpxJobError):
+    """GPX解析超时"""
+
+
+class GpxPoolBusy(Exception):
+    """排队的解析任务过多"""
+
+
+_pool = None
+_pool_pid = None
+_pool_tasks = 0
+# 因任务超时被主动结束的进程池，其中其他任务的失败不是任务本身的问题，需要重新提交
+_killed_pools = weakref.WeakSet()
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(GPX_MAX_PENDING)
+_stats = {'completed': 0, 'failed': 0, 'timeouts': 0, 'rejected': 0, 'running': 0, 'resubmitted': 0, 'recycled': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(name, delta=1):
+    with _stats_lock:
+        _stats[name] += delta
+
+
+def _analyze_file(path):
+    """在子进程中解析GPX文件"""
+    from route_analysis import analyze_gpx
+    try:
+        with open(path, 'r') as f:
+            return analyze_gpx(f)
+    except Exception as e:
+        # gpxpy的部分异常无法在进程间传递，统一转换为简单的异常
+        raise GpxJobError(str(e)) from None
+
+
+def _create_pool():
+    # 多线程的worker中直接fork不安全，使用forkserver（不支持时用spawn）启动子进程
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    options = {'max_tasks_per_child': MAX_TASKS_PER_CHILD} if NATIVE_MAX_TASKS else {}
+    return ProcessPoolExecutor(max_workers=GPX_POOL_SIZE, mp_context=multiprocessing.get_context(method), **options)
+
+
+def _get_pool():
+    """
+    按进程懒创建进程池，gunicorn preload时master中不会创建，fork出的worker各自创建
+
+    Python 3.10及更早版本不支持max_tasks_per_child，提交的任务数达到上限后换用新的进程池，
+    旧进程池中的任务执行完后子进程退出。
+    """
+    global _pool, _pool_pid, _pool_tasks
+    retired = None
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid() and not NATIVE_MAX_TASKS \
+                and _pool_tasks >= MAX_TASKS_PER_CHILD * max(GPX_POOL_SIZE, 1):
+            retired, _pool = _pool, None
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = _create_pool()
+            _pool_pid = os.getpid()
+            _pool_tasks = 0
+        _pool_tasks += 1
+        pool = _pool
+    if retired is not None:
+        _count('recycled')
+        retired.shutdown(wait=False)
+    return pool
+
+
+def _reset_pool(pool):
+    """
+    结束卡住或损坏的进程池，下次提交任务时重新创建
+
+    ProcessPoolExecutor无法只结束某个任务所在的子进程，这里结束整个进程池，
+    同一进程池中其他请求的任务由_run重新提交到新的进程池，不会因此失败。
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+        _killed_pools.add(pool)
+    for process in list((getattr(pool, '_processes', None) or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(path, timeout):
+    if GPX_POOL_SIZE <= 0:
+        return _analyze_file(path)
+
+    deadline = time.time() + timeout
+    resubmits = 0
+    while True:
+        pool = _get_pool()
+        future = pool.submit(_analyze_file, path)
+        try:
+            return future.result(timeout=max(deadline - time.time(), 0))
+        except FutureTimeoutError:
+            _count('timeouts')
+            _reset_pool(pool)
+            raise GpxJobTimeout(f"GPX解析超过 {timeout:.0f} 秒") from None
+        except (BrokenProcessPool, CancelledError):
+            with _pool_lock:
+                killed = pool in _killed_pools
+            if killed and resubmits < MAX_RESUBMITS and time.time() < deadline:
+                # 进程池因其他任务超时被结束，本任务重新提交
+                resubmits += 1
+                _count('resubmitted')
+                continue
+            if not killed:
+                _reset_pool(pool)
+            raise GpxJobError("GPX解析进程异常退出") from None
+
+
+def _acquire_slot():
+    if not _slots.acquire(blocking=False):
+        _count('rejected')
+        raise GpxPoolBusy("GPX解析任务过多，请稍后再试")
+
+
+def _run_in_slot(path, timeout):
+    _count('running')
+    try:
+        result = _run(path, timeout if timeout is not None else GPX_JOB_TIMEOUT)
+        _count('completed')
+        return result
+    except Exception:
+        _count('failed')
+        raise
+    finally:
+        _count('running', -1)
+        _slots.release()
+
+
+def analyze_gpx_file(path, timeout=None):
+    """
+    在进程池中解析GPX文件并等待结果
+
+    请求线程在等待期间不持有GIL，同一worker的其他线程（例如SSE流）不受影响。
+
+    Args:
+        path: GPX文件路径
+        timeout: 超时时间（秒），默认 GPX_JOB_TIMEOUT
+
+    Returns:
+        analyze_gpx的结果
+
+    Raises:
+        GpxPoolBusy: 排队任务过多
+        GpxJobTimeout: 解析超时
+        GpxJobError: 解析失败
+    """
+    _acquire_slot()
+    return _run_in_slot(path, timeout)
+
+
+def submit_gpx_file(path, on_done, timeout=None):
+    """
+    在后台解析GPX文件，完成后在后台线程中调用 on_done(result, error)
+
+    Raises:
+        GpxPoolBusy: 排队任务过多
+    """
+    _acquire_slot()
+
+    def run():
+        try:
+            result = _run_in_slot(path, timeout)
+        except Exception as e:
+            on_done(None, e)
+        else:
+            on_done(result, None)
+
+    threading.Thread(target=run, name='gpx-job', daemon=True).start()
+
+
+def pool_stats():
+    """当前worker的解析任务统计"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({
+        'pid': os.getpid(),
+        'pool_size': GPX_POOL_SIZE,
+        'max_pending': GPX_MAX_PENDING,
+        'pool_started': _pool is not None and _pool_pid == os.getpid(),
+        'timestamp': time.time()
+    })
+    return stats
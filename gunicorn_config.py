@@ -1,3 +1,4 @@
+import gc
 import multiprocessing
 import os
 
@@ -6,10 +7,26 @@ log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
 if not os.path.exists(log_dir):
     os.makedirs(log_dir)
 
-bind = "127.0.0.1:8000"  # 绑定到本地8000端口
-workers = multiprocessing.cpu_count() * 2 + 1  # 推荐的worker数量
-threads = 2
+# 可通过环境变量覆盖，便于压测时调整worker和线程数量
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8000")  # 绑定到本地8000端口
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))  # 推荐的worker数量
+threads = int(os.getenv("GUNICORN_THREADS", 2))
 accesslog = os.path.join(log_dir, "access.log")
 errorlog = os.path.join(log_dir, "error.log")
 loglevel = "info"
-timeout = 120 
\ No newline at end of file
+timeout = 120
+
+# 在master中预加载应用，worker通过fork以写时复制方式共享已导入的模块和模板
+# 注意：preload后SIGHUP不会重新加载代码，更新代码请用restart_server.sh（USR2滚动重启）
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+pidfile = os.getenv("GUNICORN_PIDFILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.pid"))
+
+
+def when_ready(server):
+    """master就绪后、fork worker之前预热共享状态"""
+    if not preload_app:
+        return
+    import app
+    app.warm_up()
+    # 把已有对象移出GC跟踪，避免worker中的垃圾回收触碰共享页导致复制
+    gc.freeze()
@@ -0,0 +1,241 @@
+import os
+import time
+import uuid
+import threading
+from collections import deque
+
+from db_utils import LocalSqlite
+
+# 所有worker合计同时生成训练建议的数量，超过后排队
+LLM_MAX_CONCURRENT = int(os.getenv('LLM_MAX_CONCURRENT', 4))
+# 同一个session同时生成和排队的请求数量，超过后直接返回429
+LLM_MAX_PER_SESSION = int(os.getenv('LLM_MAX_PER_SESSION', 1))
+# 排队请求的最大数量，排队的请求同样占用worker线程，队列满后直接返回429
+LLM_QUEUE_MAX = int(os.getenv('LLM_QUEUE_MAX', 8))
+# 排队的最长时间（秒），超时后通过SSE返回错误和重试时间
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', 120))
+# 生成中的请求的租约（秒），应长于AIService的总超时；worker异常退出时租约到期后释放名额
+ACTIVE_LEASE = float(os.getenv('LLM_ACTIVE_LEASE', 360))
+# 排队请求的租约（秒），每次轮询时续期，客户端断开后很快释放
+QUEUED_LEASE = 15
+# 排队时的轮询间隔（秒）
+POLL_INTERVAL = 0.5
+# 没有历史数据时估计的单次生成时长（秒），用于计算重试时间
+DEFAULT_GENERATION_SECONDS = 60
+# 返回给客户端的重试时间范围（秒）
+MIN_RETRY_AFTER = 3
+MAX_RETRY_AFTER = 120
+
+QUEUED = 'queued'
+ACTIVE = 'active'
+
+
+class AdmissionRejected(Exception):
+    """训练建议请求超过并发限制，没有进入队列"""
+
+    def __init__(self, reason, retry_after):
+        messages = {
+            'session': '已有训练建议正在生成，请等待完成后再试',
+            'queue': '当前生成训练建议的请求较多，请稍后再试',
+            'timeout': '排队等待超时，请稍后再试',
+            'expired': '排队已失效，请重新请求'
+        }
+        super().__init__(messages.get(reason, reason))
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LLMAdmission:
+    """
+    训练建议生成的准入控制，所有worker共享
+
+    每个请求是SQLite中的一张票据：生成中（active）的票据数量不超过全局上限，其余按进入时间排队（queued）。
+    同一session的票据数量和排队长度超过上限时直接拒绝并返回建议的重试时间，不占用worker线程。
+    票据带有租约，worker异常退出或客户端断开后到期自动释放。
+    """
+
+    def __init__(self, db_path, max_concurrent=LLM_MAX_CONCURRENT, max_per_session=LLM_MAX_PER_SESSION,
+                 queue_max=LLM_QUEUE_MAX):
+        self.db = LocalSqlite(db_path)
+        self.max_concurrent = max_concurrent
+        self.max_per_session = max_per_session
+        self.queue_max = queue_max
+        self._stats = {}
+        self._durations = deque(maxlen=50)
+        self._stats_lock = threading.Lock()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS llm_tickets ('
+            'ticket TEXT PRIMARY KEY, owner TEXT NOT NULL, state TEXT NOT NULL, enqueued_at REAL NOT NULL, '
+            'started_at REAL, lease_until REAL NOT NULL, pid INTEGER NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS llm_tickets_owner ON llm_tickets (owner)')
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self._stats[key] = self._stats.get(key, 0) + value
+
+    def _transact(self, func):
+        conn = self.db.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM llm_tickets WHERE lease_until < ?', (time.time(),))
+            result = func(conn)
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _typical_duration(self):
+        with self._stats_lock:
+            durations = list(self._durations)
+        return sum(durations) / len(durations) if durations else DEFAULT_GENERATION_SECONDS
+
+    def _retry_after(self, ahead):
+        """按前面的请求数量和单次生成时长估计重试时间"""
+        estimate = self._typical_duration() * (ahead // max(self.max_concurrent, 1) + 1)
+        return int(min(max(estimate, MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+    def enqueue(self, owner):
+        """
+        为一个训练建议请求创建票据
+
+        Args:
+            owner: session标识，同一标识的并发请求受LLM_MAX_PER_SESSION限制
+
+        Returns:
+            票据ID，需要通过wait取得生成名额，结束后调用release
+
+        Raises:
+            AdmissionRejected: 同一session的请求过多或队列已满
+        """
+        def add(conn):
+            now = time.time()
+            own = conn.execute(
+                'SELECT MIN(COALESCE(started_at, enqueued_at)), COUNT(*) FROM llm_tickets WHERE owner = ?', (owner,)
+            ).fetchone()
+            if own[1] >= self.max_per_session:
+                elapsed = now - own[0]
+                return None, AdmissionRejected('session', int(min(max(self._typical_duration() - elapsed,
+                                                                         MIN_RETRY_AFTER), MAX_RETRY_AFTER)))
+            active, queued = conn.execute(
+                'SELECT COALESCE(SUM(state = ?), 0), COALESCE(SUM(state = ?), 0) FROM llm_tickets', (ACTIVE, QUEUED)
+            ).fetchone()
+            if active >= self.max_concurrent and queued >= self.queue_max:
+                return None, AdmissionRejected('queue', self._retry_after(queued))
+            ticket = uuid.uuid4().hex
+            conn.execute(
+                'INSERT INTO llm_tickets (ticket, owner, state, enqueued_at, lease_until, pid) VALUES (?, ?, ?, ?, ?, ?)',
+                (ticket, owner, QUEUED, now, now + QUEUED_LEASE, os.getpid())
+            )
+            return ticket, None
+
+        ticket, rejected = self._transact(add)
+        if rejected is not None:
+            self._count(f"rejected_{rejected.reason}")
+            raise rejected
+        self._count('enqueued')
+        return ticket
+
+    def _try_start(self, ticket):
+        """尝试取得生成名额，成功返回0，否则返回排队位置（从1开始）"""
+        def start(conn):
+            now = time.time()
+            row = conn.execute('SELECT state, enqueued_at FROM llm_tickets WHERE ticket = ?', (ticket,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == ACTIVE:
+                return 0
+            active = conn.execute('SELECT COUNT(*) FROM llm_tickets WHERE state = ?', (ACTIVE,)).fetchone()[0]
+            ahead = conn.execute(
+                'SELECT COUNT(*) FROM llm_tickets WHERE state = ? AND (enqueued_at < ? OR (enqueued_at = ? AND ticket < ?))',
+                (QUEUED, row[1], row[1], ticket)
+            ).fetchone()[0]
+            if ahead < self.max_concurrent - active:
+                conn.execute(
+                    'UPDATE llm_tickets SET state = ?, started_at = ?, lease_until = ? WHERE ticket = ?',
+                    (ACTIVE, now, now + ACTIVE_LEASE, ticket)
+                )
+                return 0
+            conn.execute('UPDATE llm_tickets SET lease_until = ? WHERE ticket = ?', (now + QUEUED_LEASE, ticket))
+            return ahead + 1
+        return self._transact(start)
+
+    def wait(self, ticket, timeout=LLM_QUEUE_TIMEOUT, keepalive=10):
+        """
+        排队等待生成名额
+
+        Args:
+            ticket: enqueue返回的票据
+            timeout: 最多等待的秒数
+            keepalive: 排队位置没有变化时，每隔多少秒重复返回一次当前位置，用于SSE保活
+
+        Yields:
+            排队位置（从1开始），位置变化时返回；取得名额后生成器结束
+
+        Raises:
+            AdmissionRejected: 等待超时或票据已过期
+        """
+        started = time.time()
+        deadline = started + timeout
+        last_position, last_yield = None, 0
+        while True:
+            position = self._try_start(ticket)
+            now = time.time()
+            if position is None:
+                self._count('expired')
+                raise AdmissionRejected('expired', MIN_RETRY_AFTER)
+            if position == 0:
+                self._count('admitted_after_queue' if last_position else 'admitted')
+                self._count('wait_seconds', round(now - started, 3))
+                return
+            if now >= deadline:
+                self.release(ticket)
+                self._count('rejected_timeout')
+                raise AdmissionRejected('timeout', self._retry_after(position))
+            if position != last_position or now - last_yield >= keepalive:
+                last_position, last_yield = position, now
+                yield position
+            time.sleep(POLL_INTERVAL)
+
+    def release(self, ticket):
+        """释放票据，可以重复调用"""
+        def delete(conn):
+            row = conn.execute('SELECT state, started_at FROM llm_tickets WHERE ticket = ?', (ticket,)).fetchone()
+            conn.execute('DELETE FROM llm_tickets WHERE ticket = ?', (ticket,))
+            return row
+        row = self._transact(delete)
+        if row and row[0] == ACTIVE and row[1]:
+            with self._stats_lock:
+                self._durations.append(time.time() - row[1])
+            self._count('completed')
+
+    def status(self, owner=None):
+        """当前的生成和排队数量；指定owner时同时返回该session的请求数和建议的重试时间"""
+        def read(conn):
+            active, queued = conn.execute(
+                'SELECT COALESCE(SUM(state = ?), 0), COALESCE(SUM(state = ?), 0) FROM llm_tickets', (ACTIVE, QUEUED)
+            ).fetchone()
+            own = conn.execute('SELECT COUNT(*) FROM llm_tickets WHERE owner = ?', (owner,)).fetchone()[0] if owner else 0
+            return active, queued, own
+        active, queued, own = self._transact(read)
+        status = {'active': active, 'queued': queued, 'max_concurrent': self.max_concurrent,
+                  'queue_max': self.queue_max, 'retry_after': 0}
+        if owner is not None:
+            status['session_requests'] = own
+            if own >= self.max_per_session:
+                status['retry_after'] = MIN_RETRY_AFTER
+            elif active >= self.max_concurrent and queued >= self.queue_max:
+                status['retry_after'] = self._retry_after(queued)
+        return status
+
+    def stats(self):
+        """共享的生成和排队数量，以及当前worker的准入统计"""
+        stats = self.status()
+        with self._stats_lock:
+            stats.update(self._stats)
+            stats['typical_generation_s'] = round(
+                sum(self._durations) / len(self._durations), 1) if self._durations else None
+        stats['max_per_session'] = self.max_per_session
+        stats['pid'] = os.getpid()
+        return stats
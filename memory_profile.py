@@ -0,0 +1,197 @@
+import os
+import random
+import threading
+import time
+import tracemalloc
+
+# 按比例抽样记录请求的内存分配，0表示关闭。开启后被抽样的请求会明显变慢，只在排查内存问题时开启
+MEMORY_PROFILE_RATE = float(os.getenv('MEMORY_PROFILE_RATE', 0))
+# 只抽样这些路由（Flask endpoint名，逗号分隔），为空时抽样所有路由
+MEMORY_PROFILE_ENDPOINTS = [name.strip() for name in os.getenv('MEMORY_PROFILE_ENDPOINTS', '').split(',') if name.strip()]
+# 每个路由保留的分配位置数量
+MEMORY_PROFILE_TOP = int(os.getenv('MEMORY_PROFILE_TOP', 10))
+# 记录分配位置时保留的调用栈深度，越深开销越大
+MEMORY_PROFILE_FRAMES = int(os.getenv('MEMORY_PROFILE_FRAMES', 1))
+
+# 分配位置中忽略的文件（tracemalloc自身和导入机制）
+IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>')
+
+
+def process_memory():
+    """
+    当前进程的常驻内存和峰值常驻内存（KB）
+
+    Returns:
+        {'rss_kb': ..., 'max_rss_kb': ...}，无法读取的项为None
+    """
+    memory = {'rss_kb': None, 'max_rss_kb': None}
+    try:
+        with open('/proc/self/statm') as f:
+            memory['rss_kb'] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Linux上ru_maxrss的单位是KB，macOS上是字节
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory['max_rss_kb'] = max_rss // 1024 if os.uname().sysname == 'Darwin' else max_rss
+    except (ImportError, AttributeError):
+        pass
+    return memory
+
+
+class MemoryProfiler:
+    """
+    按路由抽样记录请求的内存分配
+
+    被抽样的请求开始时启动tracemalloc，结束时记录期间的分配峰值和仍未释放的内存最多的分配位置，
+    然后停止tracemalloc，未抽样的请求没有额外开销。tracemalloc对整个进程生效，
+    每个worker同一时间只抽样一个请求，同时运行的其他线程的分配也会计入该次抽样。
+    """
+
+    def __init__(self, rate=MEMORY_PROFILE_RATE, endpoints=MEMORY_PROFILE_ENDPOINTS, top=MEMORY_PROFILE_TOP,
+                 frames=MEMORY_PROFILE_FRAMES):
+        self.rate = rate
+        self.endpoints = set(endpoints)
+        self.top = top
+        self.frames = frames
+        self._sampling = threading.Lock()
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._stats = {'sampled': 0, 'skipped_busy': 0}
+
+    def should_sample(self, endpoint):
+        if self.rate <= 0 or endpoint is None or endpoint == 'static' or endpoint.startswith('debug_'):
+            return False
+        if self.endpoints and endpoint not in self.endpoints:
+            return False
+        return random.random() < self.rate
+
+    def start(self, endpoint):
+        """
+        请求开始时调用，按抽样比例决定是否记录这个请求
+
+        Returns:
+            记录状态，传给finish；不记录时返回None
+        """
+        if not self.should_sample(endpoint):
+            return None
+        if tracemalloc.is_tracing() or not self._sampling.acquire(blocking=False):
+            # 本worker正在抽样其他请求，或tracemalloc已被其他工具开启
+            with self._lock:
+                self._stats['skipped_busy'] += 1
+            return None
+        tracemalloc.start(self.frames)
+        return {'endpoint': endpoint, 'started': time.perf_counter()}
+
+    def finish(self, sample, status_code=None):
+        """
+        请求结束时调用，记录分配峰值和分配位置并停止tracemalloc，可以重复调用
+
+        Args:
+            sample: start返回的记录状态
+            status_code: 响应状态码，请求出错时为None
+        """
+        if sample is None or sample.get('done'):
+            return
+        sample['done'] = True
+        try:
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+            self._sampling.release()
+        duration_ms = (time.perf_counter() - sample['started']) * 1000
+
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, name) for name in IGNORED_FILES])
+        key_type = 'traceback' if self.frames > 1 else 'lineno'
+        sites = []
+        for stat in snapshot.statistics(key_type)[:self.top]:
+            sites.append({
+                'site': ' <- '.join(f"{frame.filename}:{frame.lineno}" for frame in stat.traceback),
+                'kb': round(stat.size / 1024, 1),
+                'blocks': stat.count
+            })
+
+        with self._lock:
+            self._stats['sampled'] += 1
+            route = self._routes.setdefault(sample['endpoint'], {
+                'samples': 0, 'errors': 0, 'peak_kb_total': 0.0, 'peak_kb_max': 0.0, 'retained_kb_max': 0.0,
+                'ms_total': 0.0, 'top_sites': []
+            })
+            route['samples'] += 1
+            if status_code is None or status_code >= 500:
+                route['errors'] += 1
+            route['peak_kb_total'] += peak / 1024
+            route['ms_total'] += duration_ms
+            route['retained_kb_max'] = max(route['retained_kb_max'], round(current / 1024, 1))
+            route['last_peak_kb'] = round(peak / 1024, 1)
+            if peak / 1024 >= route['peak_kb_max']:
+                # 分配位置取峰值最高的一次抽样
+                route['peak_kb_max'] = round(peak / 1024, 1)
+                route['top_sites'] = sites
+
+    def stats(self, caches=None):
+        """
+        各路由的抽样结果和当前worker的内存
+
+        Args:
+            caches: {缓存名: 字节数}，当前worker内存中各缓存的大小
+        """
+        with self._lock:
+            routes = {}
+            for endpoint, route in self._routes.items():
+                routes[endpoint] = {
+                    'samples': route['samples'],
+                    'errors': route['errors'],
+                    'peak_kb_avg': round(route['peak_kb_total'] / route['samples'], 1),
+                    'peak_kb_max': route['peak_kb_max'],
+                    'last_peak_kb': route['last_peak_kb'],
+                    'retained_kb_max': route['retained_kb_max'],
+                    'ms_avg': round(route['ms_total'] / route['samples'], 1),
+                    'top_sites': list(route['top_sites'])
+                }
+            stats = dict(self._stats)
+        stats.update(process_memory())
+        stats.update({
+            'rate': self.rate,
+            'endpoints': sorted(self.endpoints),
+            'routes': routes,
+            'cache_bytes': caches or {},
+            'pid': os.getpid()
+        })
+        return stats
+
+
+def render_metrics(stats):
+    """
+    把stats()的结果转换为Prometheus文本格式，供监控系统抓取
+
+    每个worker单独返回自己的数据，用pid标签区分
+    """
+    pid = stats['pid']
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ','.join(f'{key}="{str(val)}"' for key, val in [('pid', pid)] + labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+
+    routes = stats['routes']
+    metric('openrun_worker_rss_bytes', 'gauge', 'Worker resident set size',
+           [([], stats['rss_kb'] * 1024 if stats['rss_kb'] is not None else None)])
+    metric('openrun_worker_max_rss_bytes', 'gauge', 'Worker peak resident set size',
+           [([], stats['max_rss_kb'] * 1024 if stats['max_rss_kb'] is not None else None)])
+    metric('openrun_worker_cache_bytes', 'gauge', 'Bytes held by in-memory caches of the worker',
+           [([('cache', name)], size) for name, size in sorted(stats['cache_bytes'].items())])
+    metric('openrun_request_memory_samples_total', 'counter', 'Requests profiled with tracemalloc',
+           [([('endpoint', name)], route['samples']) for name, route in sorted(routes.items())])
+    metric('openrun_request_peak_alloc_bytes_max', 'gauge', 'Largest traced allocation peak of a profiled request',
+           [([('endpoint', name)], int(route['peak_kb_max'] * 1024)) for name, route in sorted(routes.items())])
+    metric('openrun_request_peak_alloc_bytes_avg', 'gauge', 'Average traced allocation peak of profiled requests',
+           [([('endpoint', name)], int(route['peak_kb_avg'] * 1024)) for name, route in sorted(routes.items())])
+    return '\n'.join(lines) + '\n'
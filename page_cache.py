@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import hashlib
+import secrets
+import threading
+
+from db_utils import LocalSqlite
+
+# Strava列表类数据（活动列表、用户信息）的缓存时间，过期后重新拉取
+DASHBOARD_CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 300))
+# 单个活动详情和流数据的缓存时间。已完成的活动基本不变，修改时由webhook失效
+ACTIVITY_CACHE_TTL = int(os.getenv('ACTIVITY_CACHE_TTL', 7 * 24 * 3600))
+# 过期条目保留的时间，重新获取失败（如接近Strava限额）时仍可返回旧数据
+STALE_KEEP_SECONDS = int(os.getenv('CACHE_STALE_KEEP_SECONDS', 24 * 3600))
+# 返回旧数据后条目的有效期延长多久，期间不再重复请求
+STALE_GRACE_SECONDS = int(os.getenv('CACHE_STALE_GRACE_SECONDS', 60))
+
+
+def make_etag(*parts):
+    """根据数据版本计算ETag"""
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+
+def directory_version(path):
+    """
+    目录中文件的修改时间和大小的摘要，模板更新后渲染结果的ETag随之变化
+
+    Returns:
+        (版本摘要, 最新的修改时间)
+    """
+    entries = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            entries.append((os.path.relpath(os.path.join(root, name), path), stat.st_mtime_ns, stat.st_size))
+    latest = max((e[1] for e in entries), default=0) / 1e9
+    return make_etag(sorted(entries)), latest
+
+
+class ResponseCache:
+    """
+    多个gunicorn worker共享的缓存，保存Strava数据和渲染好的页面
+
+    每个条目带有ETag（内容摘要）和更新时间，用于条件请求。
+    """
+
+    def __init__(self, db_path):
+        self.db = LocalSqlite(db_path)
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'stale': 0}
+        self._stats_lock = threading.Lock()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS response_cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, etag TEXT NOT NULL, '
+            'updated_at REAL NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def get(self, key):
+        """
+        读取未过期的条目
+
+        Returns:
+            {'value', 'etag', 'updated_at'}，不存在或已过期时返回None
+        """
+        row = self.db.execute(
+            'SELECT value, etag, updated_at FROM response_cache WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.count('misses')
+            return None
+        self.count('hits')
+        return {'value': json.loads(row[0]), 'etag': row[1], 'updated_at': row[2]}
+
+    def get_meta(self, key):
+        """只读取ETag和更新时间，不反序列化内容"""
+        row = self.db.execute(
+            'SELECT etag, updated_at FROM response_cache WHERE key = ? AND expires_at > ?',
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'updated_at': row[1]}
+
+    def _write(self, conn, key, value, ttl, etag):
+        text = json.dumps(value, separators=(',', ':'))
+        if etag is None:
+            etag = hashlib.sha1(text.encode('utf-8')).hexdigest()[:32]
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO response_cache (key, value, etag, updated_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+            (key, text, etag, now, now + ttl)
+        )
+        return {'value': value, 'etag': etag, 'updated_at': now}
+
+    def put(self, key, value, ttl, etag=None):
+        """保存条目，etag为空时按内容计算"""
+        entry = self._write(self.db.conn(), key, value, ttl, etag)
+        if secrets.randbelow(100) == 0:
+            self.purge_expired()
+        return entry
+
+    def update(self, key, ttl, func):
+        """
+        在事务中读取条目、用func修改后写回，多个worker同时修改同一条目时不会丢失更新
+
+        条目不存在或已过期时不做任何修改，返回None。
+        """
+        conn = self.db.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value FROM response_cache WHERE key = ? AND expires_at > ?', (key, time.time())
+            ).fetchone()
+            entry = None
+            if row is not None:
+                entry = self._write(conn, key, func(json.loads(row[0])), ttl, None)
+            conn.execute('COMMIT')
+            return entry
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def revive(self, key):
+        """
+        获取失败时继续使用已过期的条目，有效期延长STALE_GRACE_SECONDS
+
+        Returns:
+            {'etag', 'updated_at'}，没有可用的旧条目时返回None
+        """
+        now = time.time()
+        updated = self.db.execute(
+            'UPDATE response_cache SET expires_at = ? WHERE key = ? AND expires_at <= ? AND expires_at > ?',
+            (now + STALE_GRACE_SECONDS, key, now, now - STALE_KEEP_SECONDS)
+        ).rowcount
+        if not updated:
+            return None
+        self.count('stale')
+        return self.get_meta(key)
+
+    def ensure(self, key, ttl, fetch):
+        """
+        确保缓存中有未过期的数据，未命中时调用fetch获取并保存
+
+        Returns:
+            {'etag', 'updated_at'}，获取失败且没有旧数据时返回None
+        """
+        meta = self.get_meta(key)
+        if meta is not None:
+            self.count('hits')
+            return meta
+        self.count('misses')
+        value = fetch()
+        if value is None:
+            return self.revive(key)
+        entry = self.put(key, value, ttl)
+        return {'etag': entry['etag'], 'updated_at': entry['updated_at']}
+
+    def get_or_fetch(self, key, ttl, fetch):
+        """
+        读取缓存，未命中时调用fetch获取并保存
+
+        Args:
+            key: 缓存键
+            ttl: 有效期（秒）
+            fetch: 获取数据的函数，失败时返回None（不缓存）
+
+        Returns:
+            缓存条目，获取失败时返回旧数据，没有旧数据时返回None
+        """
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        value = fetch()
+        if value is None:
+            return self.get(key) if self.revive(key) else None
+        return self.put(key, value, ttl)
+
+    def delete(self, key):
+        self.db.execute('DELETE FROM response_cache WHERE key = ?', (key,))
+
+    def delete_prefix(self, prefix):
+        """删除以prefix开头的所有条目，返回删除的数量"""
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return self.db.execute(
+            "DELETE FROM response_cache WHERE key LIKE ? ESCAPE '\\'", (escaped + '%',)
+        ).rowcount
+
+    def iter_prefix(self, prefix, batch_size=50):
+        """
+        按键的顺序分批读取以prefix开头的未过期条目，每批单独查询，不长时间占用读事务
+
+        Yields:
+            (键, 内容)
+        """
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        last_key = ''
+        while True:
+            rows = self.db.execute(
+                "SELECT key, value FROM response_cache WHERE key LIKE ? ESCAPE '\\' AND key > ? AND expires_at > ? "
+                "ORDER BY key LIMIT ?", (escaped + '%', last_key, time.time(), batch_size)
+            ).fetchall()
+            for key, value in rows:
+                yield key, json.loads(value)
+            if len(rows) < batch_size:
+                return
+            last_key = rows[-1][0]
+
+    def purge_expired(self):
+        """删除过期超过STALE_KEEP_SECONDS的条目，返回删除的数量"""
+        return self.db.execute('DELETE FROM response_cache WHERE expires_at <= ?',
+                               (time.time() - STALE_KEEP_SECONDS,)).rowcount
+
+    def stats(self):
+        """条目数量、总大小和当前worker的命中统计"""
+        row = self.db.execute('SELECT COUNT(*), IFNULL(SUM(LENGTH(value)), 0) FROM response_cache').fetchone()
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({'entries': row[0], 'bytes': row[1], 'pid': os.getpid()})
+        return stats
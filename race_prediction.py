@@ -0,0 +1,359 @@
+import os
+import time
+import hashlib
+import threading
+
+from db_utils import LocalSqlite
+from route_analysis import detect_climbs
+from terrain_histograms import MOVING_SPEED, ROUTE_GRADE_STEP_M, format_pace
+
+# 坡度模型的分箱宽度和范围（%），超出范围的坡度按边界计算
+GRADE_STEP = 2
+GRADE_LIMIT = 40
+# 某个坡度的训练距离较少时，按此距离（米）的先验配速与实际配速加权，距离越多越接近实际配速
+PRIOR_DISTANCE_M = float(os.getenv('PREDICTION_PRIOR_DISTANCE_M', 1000))
+# 没有训练数据时的平路配速（秒/米），约6'00"/公里
+DEFAULT_FLAT_PACE = 0.36
+# 长时间比赛的减速：按Riegel公式，预计时间超过训练中的典型时长后乘以 (t / 典型时长) ^ 指数
+FATIGUE_EXPONENT = float(os.getenv('PREDICTION_FATIGUE_EXPONENT', 0.06))
+# 流数据中超过此间隔（秒）的时间差视为暂停，只按此间隔计入
+MAX_SAMPLE_GAP = 30
+
+GRADE_CENTERS = list(range(-GRADE_LIMIT, GRADE_LIMIT + 1, GRADE_STEP))
+MODEL_BINS = len(GRADE_CENTERS)
+# 每个活动保存：各坡度的距离（米）、各坡度的移动时间（秒），最后一个值为活动的移动时间（秒）
+SUMS_SIZE = MODEL_BINS * 2 + 1
+# 分箱参数的版本，修改后旧的数据不再参与拟合，会重新计算
+MODEL_VERSION = hashlib.sha1(repr((GRADE_STEP, GRADE_LIMIT, MOVING_SPEED, MAX_SAMPLE_GAP)).encode('utf-8')).hexdigest()[:12]
+
+
+def prior_pace_ratio(grades):
+    """
+    各坡度相对平路的配速倍数，按Minetti的跑步能量消耗曲线估算
+
+    陡下坡的能量消耗很低，但实际跑速受技术和安全限制，倍数不低于0.8
+
+    Args:
+        grades: 坡度（%），numpy数组
+    """
+    import numpy as np
+
+    i = np.clip(np.asarray(grades, dtype=float) / 100, -0.45, 0.45)
+    cost = 155.4 * i ** 5 - 30.4 * i ** 4 - 43.3 * i ** 3 + 46.3 * i ** 2 + 19.5 * i + 3.6
+    return np.clip(cost / 3.6, 0.8, None)
+
+
+def grade_pace_sums(streams_list):
+    """
+    批量统计多个活动在各坡度的移动距离和时间
+
+    所有活动的流数据拼接后一次完成分箱，与activity_histograms相同，数百个活动只需几次numpy调用。
+
+    Args:
+        streams_list: 活动流数据列表（需要distance、time、grade、velocity）
+
+    Returns:
+        numpy数组，形状为 (活动数, SUMS_SIZE)
+    """
+    import numpy as np
+
+    owners, dists, times, grades, speeds = [], [], [], [], []
+    for i, streams in enumerate(streams_list):
+        distance = np.asarray(streams.get('distance') or [], dtype=float)
+        seconds = np.asarray(streams.get('time') or [], dtype=float)
+        grade = np.asarray(streams.get('grade') or [], dtype=float)
+        velocity = np.asarray(streams.get('velocity') or [], dtype=float)
+        n = min(len(distance), len(seconds), len(grade), len(velocity))
+        if n < 2:
+            continue
+        owners.append(np.full(n - 1, i))
+        dists.append(np.diff(distance[:n]))
+        times.append(np.diff(seconds[:n]))
+        grades.append(grade[1:n])
+        speeds.append(velocity[1:n])
+
+    count = len(streams_list)
+    result = np.zeros((count, SUMS_SIZE))
+    if not owners:
+        return result
+
+    owner = np.concatenate(owners)
+    moving = np.concatenate(speeds) > MOVING_SPEED
+    dist = np.where(moving, np.clip(np.concatenate(dists), 0, None), 0)
+    dt = np.where(moving, np.clip(np.concatenate(times), 0, MAX_SAMPLE_GAP), 0)
+    grade_bin = np.rint((np.clip(np.concatenate(grades), -GRADE_LIMIT, GRADE_LIMIT) + GRADE_LIMIT) / GRADE_STEP).astype(int)
+
+    cells = owner * MODEL_BINS + grade_bin
+    result[:, :MODEL_BINS] = np.bincount(cells, weights=dist, minlength=count * MODEL_BINS).reshape(count, MODEL_BINS)
+    result[:, MODEL_BINS:MODEL_BINS * 2] = np.bincount(
+        cells, weights=dt, minlength=count * MODEL_BINS).reshape(count, MODEL_BINS)
+    result[:, -1] = np.bincount(owner, weights=dt, minlength=count)
+    return result
+
+
+def fit_model(sums, activity_count):
+    """
+    由各坡度的距离和时间拟合坡度-配速模型
+
+    先用Minetti曲线把所有训练折算为平路配速，再对每个坡度用实际配速和先验配速按距离加权，
+    上坡的配速保证随坡度单调变慢。
+
+    Args:
+        sums: 所有活动grade_pace_sums之和
+        activity_count: 参与拟合的活动数量
+
+    Returns:
+        模型字典，paces为各坡度（GRADE_CENTERS）的配速（秒/米）
+    """
+    import numpy as np
+
+    distances = sums[:MODEL_BINS]
+    times = sums[MODEL_BINS:MODEL_BINS * 2]
+    ratio = prior_pace_ratio(GRADE_CENTERS)
+    equivalent = float((distances * ratio).sum())
+    flat = float(times.sum()) / equivalent if equivalent > 0 else DEFAULT_FLAT_PACE
+    paces = (times + PRIOR_DISTANCE_M * flat * ratio) / (distances + PRIOR_DISTANCE_M)
+    zero = GRADE_CENTERS.index(0)
+    paces[zero:] = np.maximum.accumulate(paces[zero:])
+    return {
+        'paces': paces,
+        'flat_pace': flat,
+        'distances': distances,
+        # 训练中的典型时长：平均每次活动的移动时间
+        'typical_seconds': float(sums[-1]) / activity_count if activity_count else 0.0,
+        'activity_count': activity_count,
+        'training_km': float(distances.sum()) / 1000
+    }
+
+
+def route_profile(distances, elevations, step_m=None):
+    """
+    比赛路线按固定间隔重采样后的距离和坡度
+
+    Args:
+        distances: 累计距离列表（公里）
+        elevations: 海拔列表（米）
+
+    Returns:
+        (各小段终点的累计距离（米）, 各小段的坡度（%）, 各小段的长度（米）)，numpy数组
+    """
+    import numpy as np
+
+    step_m = step_m or ROUTE_GRADE_STEP_M
+    d = np.asarray(distances, dtype=float) * 1000
+    e = np.asarray([np.nan if x is None else x for x in elevations], dtype=float)
+    valid = ~np.isnan(d) & ~np.isnan(e)
+    d, e = d[valid], e[valid]
+    if len(d) < 2 or d[-1] <= d[0]:
+        return np.zeros(0), np.zeros(0), np.zeros(0)
+    d, first = np.unique(d, return_index=True)
+    e = e[first]
+    # 最后一小段可能不足一个间隔，保证总距离与路线一致
+    grid = np.append(np.arange(d[0], d[-1], step_m), d[-1])
+    lengths = np.diff(grid)
+    grades = np.diff(np.interp(grid, d, e)) / lengths * 100
+    return grid[1:] - d[0], grades, lengths
+
+
+def predict_times(model, grades, lengths, fatigue_exponent=FATIGUE_EXPONENT):
+    """
+    按坡度-配速模型预测路线上各小段终点的累计时间（秒）
+
+    预计时间超过训练中的典型时长后按Riegel公式逐渐减速
+    """
+    import numpy as np
+
+    paces = np.interp(np.clip(grades, -GRADE_LIMIT, GRADE_LIMIT), GRADE_CENTERS, model['paces'])
+    elapsed = np.cumsum(paces * lengths)
+    typical = model['typical_seconds']
+    if typical > 0 and fatigue_exponent:
+        elapsed = elapsed * np.maximum(elapsed / typical, 1) ** fatigue_exponent
+    return elapsed
+
+
+def format_clock(seconds):
+    """秒 -> 5:03:20"""
+    seconds = int(round(seconds))
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def predict_route(model, gpx_data, checkpoints=None, step_m=None):
+    """
+    预测比赛路线每公里、每个爬升/下降段和各检查点的累计用时
+
+    Args:
+        model: fit_model的结果
+        gpx_data: 路线数据（需要elevation_data）
+        checkpoints: 检查点的距离列表（公里），可选
+
+    Returns:
+        可直接返回给前端的字典
+    """
+    import numpy as np
+
+    elevation_data = gpx_data.get('elevation_data') or {}
+    distances = elevation_data.get('distances', [])
+    elevations = elevation_data.get('elevations', [])
+    ends, grades, lengths = route_profile(distances, elevations, step_m)
+    if not len(ends):
+        return None
+    elapsed = predict_times(model, grades, lengths)
+    total_m = float(ends[-1])
+
+    def time_at(km):
+        return float(np.interp(km * 1000, np.concatenate(([0.0], ends)), np.concatenate(([0.0], elapsed))))
+
+    splits = []
+    previous = 0.0
+    marks = list(range(1, int(total_m // 1000) + 1))
+    if total_m / 1000 > (marks[-1] if marks else 0) + 0.05:
+        marks.append(round(total_m / 1000, 2))
+    for km in marks:
+        at = time_at(km)
+        splits.append({'km': km, 'split_s': round(at - previous), 'elapsed_s': round(at), 'elapsed': format_clock(at)})
+        previous = at
+
+    climbs = []
+    for climb in detect_climbs(distances, elevations):
+        start, end = time_at(climb['start_km']), time_at(climb['end_km'])
+        climbs.append(dict(climb, duration_s=round(end - start), elapsed_s=round(end), elapsed=format_clock(end)))
+
+    points = []
+    for km in sorted(set(checkpoints or [])):
+        if 0 < km <= total_m / 1000 + 1e-6:
+            at = time_at(km)
+            points.append({'km': km, 'elapsed_s': round(at), 'elapsed': format_clock(at)})
+
+    flat_index = GRADE_CENTERS.index(0)
+    return {
+        'total_km': round(total_m / 1000, 2),
+        'total_s': round(float(elapsed[-1])),
+        'total': format_clock(elapsed[-1]),
+        'splits': splits,
+        'climbs': climbs,
+        'checkpoints': points,
+        'model': {
+            'flat_pace': format_pace(model['paces'][flat_index] * 1000 / 60),
+            'grade_paces': [
+                {'grade': grade, 'pace': format_pace(pace * 1000 / 60), 'training_km': round(float(dist) / 1000, 1)}
+                for grade, pace, dist in zip(GRADE_CENTERS, model['paces'], model['distances'])
+                if abs(grade) <= 30
+            ],
+            'activity_count': model['activity_count'],
+            'training_km': round(model['training_km'], 1),
+            'typical_hours': round(model['typical_seconds'] / 3600, 2)
+        }
+    }
+
+
+class GradePaceStore:
+    """
+    每个活动在各坡度的移动距离和时间，保存在SQLite中，所有worker共享
+
+    活动的流数据只在同步时统计一次，运动员的模型由已保存的统计相加后拟合，
+    拟合结果按运动员缓存在每个worker中，活动没有变化时预测只需一次查询。
+    """
+
+    def __init__(self, db_path):
+        self.db = LocalSqlite(db_path)
+        self._models = {}
+        self._lock = threading.Lock()
+        self._stats = {'fits': 0, 'cached': 0}
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS grade_pace_sums ('
+            'owner TEXT NOT NULL, activity_id INTEGER NOT NULL, start_date TEXT, version TEXT NOT NULL, '
+            'sums BLOB NOT NULL, computed_at REAL NOT NULL, PRIMARY KEY (owner, activity_id))'
+        )
+
+    def missing(self, owner, activity_ids):
+        """返回还没有按当前分箱统计的活动ID"""
+        known = {row[0] for row in self.db.execute(
+            'SELECT activity_id FROM grade_pace_sums WHERE owner = ? AND version = ?', (owner, MODEL_VERSION)
+        ).fetchall()}
+        return [activity_id for activity_id in activity_ids if activity_id not in known]
+
+    def add_many(self, owner, items):
+        """
+        统计并保存多个活动
+
+        Args:
+            owner: 运动员标识
+            items: [(活动摘要, 流数据), ...]，活动摘要需要id和start_date_local
+
+        Returns:
+            保存的活动数量
+        """
+        if not items:
+            return 0
+        sums = grade_pace_sums([streams for _, streams in items])
+        now = time.time()
+        conn = self.db.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO grade_pace_sums (owner, activity_id, start_date, version, sums, computed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(owner, activity['id'], activity.get('start_date_local'), MODEL_VERSION, row.tobytes(), now)
+                 for (activity, _), row in zip(items, sums)]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(items)
+
+    def remove(self, owner, activity_id):
+        self.db.execute('DELETE FROM grade_pace_sums WHERE owner = ? AND activity_id = ?', (owner, activity_id))
+
+    def remove_owner(self, owner):
+        self.db.execute('DELETE FROM grade_pace_sums WHERE owner = ?', (owner,))
+        with self._lock:
+            for key in [key for key in self._models if key[0] == owner]:
+                del self._models[key]
+
+    def model(self, owner, since=None):
+        """
+        运动员的坡度-配速模型，活动没有变化时使用缓存的拟合结果
+
+        Args:
+            owner: 运动员标识
+            since: 只使用此日期（YYYY-MM-DD）之后的活动（可选）
+        """
+        import numpy as np
+
+        sql = 'FROM grade_pace_sums WHERE owner = ? AND version = ?'
+        params = [owner, MODEL_VERSION]
+        if since:
+            sql += ' AND start_date >= ?'
+            params.append(since)
+        count, latest, id_sum = self.db.execute(
+            f'SELECT COUNT(*), MAX(computed_at), TOTAL(activity_id) {sql}', params).fetchone()
+        key = (owner, since)
+        version = (count, latest, id_sum)
+        with self._lock:
+            cached = self._models.get(key)
+            if cached is not None and cached[0] == version:
+                self._stats['cached'] += 1
+                return cached[1]
+
+        rows = self.db.execute(f'SELECT sums {sql}', params).fetchall()
+        if rows:
+            sums = np.frombuffer(b''.join(row[0] for row in rows)).reshape(len(rows), SUMS_SIZE).sum(axis=0)
+        else:
+            sums = np.zeros(SUMS_SIZE)
+        model = fit_model(sums, len(rows))
+        with self._lock:
+            self._models[key] = (version, model)
+            self._stats['fits'] += 1
+        return model
+
+    def stats(self):
+        row = self.db.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT owner), IFNULL(SUM(version = ?), 0) FROM grade_pace_sums', (MODEL_VERSION,)
+        ).fetchone()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached_models'] = len(self._models)
+        stats.update({'activities': row[0], 'owners': row[1], 'current_version': row[2], 'version': MODEL_VERSION,
+                      'pid': os.getpid()})
+        return stats
@@ -1,27 +1,101 @@
 #!/bin/bash
+# 滚动重启：启动新的master和worker，健康检查通过后再优雅关闭旧的，整个过程不中断服务
+# 用法: ./restart_server.sh          滚动重启（没有运行中的服务时直接启动）
+#       ./restart_server.sh --cold   停止后重新启动（旧的方式）
 
 # 输出时间戳
 echo "开始重启服务器 - $(date)"
 
 # 切换到项目目录
-cd /home/ubuntu/OpenRunTraining
+APP_DIR=/home/ubuntu/OpenRunTraining
+cd $APP_DIR
 
-# 停止当前运行的所有gunicorn进程
-echo "停止当前运行的服务器..."
-pkill -f gunicorn
+PIDFILE=${GUNICORN_PIDFILE:-$APP_DIR/gunicorn.pid}
+HEALTH_URL=${HEALTH_URL:-http://127.0.0.1:8000/healthz}
+WAIT_SECONDS=30
 
-# 等待2秒确保进程完全停止
-sleep 2
+source env/bin/activate
+
+start_server() {
+    echo "启动新的服务器..."
+    gunicorn -c gunicorn_config.py app:app -D
+}
+
+is_running() {
+    [ -f "$1" ] && kill -0 "$(cat "$1")" 2>/dev/null
+}
 
-# 激活虚拟环境并启动服务器
-echo "启动新的服务器..."
-source env/bin/activate && gunicorn -c gunicorn_config.py app:app -D
+new_server_ready() {
+    # 新旧master共用监听端口，健康检查可能由旧的worker响应，
+    # 必须由新master的worker响应（按/healthz返回的pid判断），并且之后新的worker仍然存活
+    for i in $(seq 1 $WAIT_SECONDS); do
+        if ! kill -0 "$1" 2>/dev/null; then
+            return 1
+        fi
+        WORKERS=$(pgrep -P "$1")
+        if [ -n "$WORKERS" ]; then
+            for j in $(seq 1 10); do
+                PID=$(curl -sf "$HEALTH_URL" | sed -n 's/.*"pid": *\([0-9]*\).*/\1/p')
+                if [ -n "$PID" ] && echo "$WORKERS" | grep -qx "$PID"; then
+                    # fork后立即崩溃的worker会被master换成新的进程，之前的worker都要仍然存活
+                    sleep 3
+                    kill -0 "$1" 2>/dev/null || return 1
+                    for WORKER in $WORKERS; do
+                        kill -0 "$WORKER" 2>/dev/null || return 1
+                    done
+                    return 0
+                fi
+            done
+        fi
+        sleep 1
+    done
+    return 1
+}
+
+if [ "$1" == "--cold" ] || ! is_running "$PIDFILE"; then
+    if is_running "$PIDFILE"; then
+        echo "停止当前运行的服务器..."
+        kill -TERM "$(cat "$PIDFILE")"
+        sleep 2
+    fi
+    start_server
+else
+    OLD_PID=$(cat "$PIDFILE")
+    echo "当前master进程: $OLD_PID，发送USR2启动新的master..."
+    kill -USR2 "$OLD_PID"
+
+    # 新master在旧master退出之前把pid写入 $PIDFILE.2，旧master退出后才接管 $PIDFILE
+    NEW_PID=""
+    for i in $(seq 1 $WAIT_SECONDS); do
+        if [ -s "$PIDFILE.2" ] && [ "$(cat "$PIDFILE.2")" != "$OLD_PID" ]; then
+            NEW_PID=$(cat "$PIDFILE.2")
+            break
+        fi
+        sleep 1
+    done
+
+    if [ -z "$NEW_PID" ]; then
+        echo "新的master没有启动，保留旧的服务器，请检查日志！"
+        exit 1
+    fi
+    echo "新的master进程: $NEW_PID"
+
+    # preload模式下新代码导入失败时新master会直接退出，不会影响旧的服务器
+    if new_server_ready "$NEW_PID"; then
+        echo "新的服务器已就绪，优雅关闭旧的master和worker..."
+        kill -TERM "$OLD_PID"
+    else
+        echo "新的服务器健康检查失败，回滚：关闭新的master，保留旧的服务器"
+        kill -TERM "$NEW_PID"
+        exit 1
+    fi
+fi
 
 # 等待2秒让服务器完全启动
 sleep 2
 
 # 检查服务器是否成功启动
-if pgrep -f gunicorn > /dev/null
+if is_running "$PIDFILE"
 then
     echo "服务器重启成功！"
     echo "运行中的gunicorn进程："
@@ -30,4 +104,4 @@ else
     echo "服务器启动失败，请检查日志！"
 fi
 
-echo "重启操作完成 - $(date)" 
\ No newline at end of file
+echo "重启操作完成 - $(date)"
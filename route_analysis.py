@@ -0,0 +1,334 @@
+import os
+import re
+
+# 路线摘要的默认token预算，控制提示词长度
+ROUTE_SUMMARY_TOKEN_BUDGET = int(os.getenv('ROUTE_SUMMARY_TOKEN_BUDGET', 600))
+
+# 爬升/下降识别的滞回阈值（米），高度反向变化超过此值才认为趋势反转
+CLIMB_THRESHOLD = float(os.getenv('CLIMB_THRESHOLD', 50))
+
+_CJK_RE = re.compile(r'[\u3000-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中文字符按1个token，其余字符按4个字符1个token"""
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _valid_profile(distances, elevations):
+    """过滤掉缺少海拔的点，返回距离和海拔列表"""
+    pairs = [(d, e) for d, e in zip(distances, elevations) if d is not None and e is not None]
+    return [p[0] for p in pairs], [p[1] for p in pairs]
+
+
+def analyze_gpx(gpx_file):
+    """
+    解析GPX并计算轨迹点、距离、海拔和总爬升下降
+
+    Args:
+        gpx_file: GPX文件对象或XML字符串
+
+    Returns:
+        包含points、stats和elevation_data的路线数据
+    """
+    # gpxpy和geopy导入较慢，只在解析GPX时导入
+    import gpxpy
+    from geopy.distance import geodesic
+
+    gpx = gpxpy.parse(gpx_file)
+
+    # 提取轨迹点
+    points = []
+    distances = []
+    elevations = []
+    total_distance = 0
+    elevation_gain = 0
+    elevation_loss = 0
+    last_elevation = None
+
+    for track in gpx.tracks:
+        for segment in track.segments:
+            last_point = None
+            for point in segment.points:
+                points.append([point.latitude, point.longitude])
+                elevations.append(point.elevation)
+
+                if last_point:
+                    # 计算距离
+                    distance = geodesic(
+                        (last_point.latitude, last_point.longitude),
+                        (point.latitude, point.longitude)
+                    ).kilometers
+                    total_distance += distance
+                    distances.append(round(total_distance, 2))
+
+                    # 计算爬升和下降
+                    if last_elevation is not None:
+                        elevation_diff = point.elevation - last_elevation
+                        if elevation_diff > 0:
+                            elevation_gain += elevation_diff
+                        else:
+                            elevation_loss += abs(elevation_diff)
+                else:
+                    distances.append(0)
+
+                last_point = point
+                last_elevation = point.elevation
+
+    return {
+        'points': points,
+        'stats': {
+            'distance': total_distance,
+            'elevation_gain': elevation_gain,
+            'elevation_loss': elevation_loss
+        },
+        'elevation_data': {
+            'distances': distances,
+            'elevations': elevations
+        }
+    }
+
+
+def compute_km_segments(distances, elevations):
+    """
+    计算每公里的爬升、下降和平均坡度
+
+    Args:
+        distances: 累计距离列表（公里）
+        elevations: 海拔列表（米）
+    """
+    distances, elevations = _valid_profile(distances, elevations)
+    km_segments = []
+    if not distances:
+        return km_segments
+
+    curr_km = 1
+    last_elevation = elevations[0]
+    last_dist = 0
+    km_gain = 0
+    km_loss = 0
+
+    for i in range(1, len(distances)):
+        dist = distances[i]
+        elev = elevations[i]
+
+        # 计算高度差
+        elev_diff = elev - last_elevation
+        if elev_diff > 0:
+            km_gain += elev_diff
+        else:
+            km_loss += abs(elev_diff)
+
+        # 如果超过了当前公里，记录数据
+        if int(dist) > curr_km or i == len(distances) - 1:
+            km_dist = dist - last_dist
+            km_grade = (km_gain / (km_dist * 1000)) * 100 if km_dist > 0 else 0
+
+            km_segments.append({
+                'km': curr_km,
+                'start_km': round(last_dist, 2),
+                'end_km': round(dist, 2),
+                'gain': round(km_gain, 1),
+                'loss': round(km_loss, 1),
+                'grade': round(km_grade, 1)
+            })
+
+            # 重置数据
+            curr_km = int(dist) + 1
+            last_dist = dist
+            km_gain = 0
+            km_loss = 0
+
+        last_elevation = elev
+
+    return km_segments
+
+
+def detect_climbs(distances, elevations, threshold=None):
+    """
+    用滞回阈值在整条海拔序列上识别显著的爬升和下降
+
+    只有当海拔相对当前极值反向变化超过阈值时才确认一次趋势反转，
+    因此小的起伏会被并入所在的爬升或下降段。
+
+    Args:
+        distances: 累计距离列表（公里）
+        elevations: 海拔列表（米）
+        threshold: 滞回阈值（米）
+
+    Returns:
+        按出现顺序排列的爬升/下降段列表
+    """
+    if threshold is None:
+        threshold = CLIMB_THRESHOLD
+
+    distances, elevations = _valid_profile(distances, elevations)
+    n = len(elevations)
+    if n < 2:
+        return []
+
+    segments = []
+
+    def add_segment(start, end):
+        change = elevations[end] - elevations[start]
+        if abs(change) < threshold:
+            return
+        length = distances[end] - distances[start]
+        segments.append({
+            'type': 'climb' if change > 0 else 'descent',
+            'start_km': round(distances[start], 2),
+            'end_km': round(distances[end], 2),
+            'distance_km': round(length, 2),
+            'start_elevation': round(elevations[start]),
+            'end_elevation': round(elevations[end]),
+            'elevation_change': round(change),
+            'avg_grade': round(change / (length * 1000) * 100, 1) if length > 0 else 0
+        })
+
+    trend = 0  # 1: 爬升, -1: 下降, 0: 尚未确定
+    pivot = 0
+    candidate = 0
+    low = high = 0
+
+    for i in range(1, n):
+        e = elevations[i]
+        if trend == 0:
+            if e < elevations[low]:
+                low = i
+            if e > elevations[high]:
+                high = i
+            if e - elevations[low] >= threshold:
+                trend, pivot, candidate = 1, low, i
+            elif elevations[high] - e >= threshold:
+                trend, pivot, candidate = -1, high, i
+        elif trend == 1:
+            if e >= elevations[candidate]:
+                candidate = i
+            elif elevations[candidate] - e >= threshold:
+                add_segment(pivot, candidate)
+                trend, pivot, candidate = -1, candidate, i
+        else:
+            if e <= elevations[candidate]:
+                candidate = i
+            elif e - elevations[candidate] >= threshold:
+                add_segment(pivot, candidate)
+                trend, pivot, candidate = 1, candidate, i
+
+    if trend != 0:
+        add_segment(pivot, candidate)
+
+    return segments
+
+
+def _merge_sections(km_segments, section_count):
+    """把每公里数据合并为不超过section_count个连续区段"""
+    if not km_segments:
+        return []
+    size = max(1, -(-len(km_segments) // section_count))
+    sections = []
+    for i in range(0, len(km_segments), size):
+        group = km_segments[i:i + size]
+        gain = sum(s['gain'] for s in group)
+        loss = sum(s['loss'] for s in group)
+        start_km = group[0]['start_km']
+        end_km = group[-1]['end_km']
+        length = end_km - start_km
+        sections.append({
+            'start_km': start_km,
+            'end_km': end_km,
+            'gain': round(gain),
+            'loss': round(loss),
+            'grade': round(gain / (length * 1000) * 100, 1) if length > 0 else 0
+        })
+    return sections
+
+
+def _render_summary(sections, climbs, threshold, extremes):
+    """渲染路线摘要文本"""
+    lines = []
+    if sections:
+        lines.append("\n\n### 全程区段概况:")
+        for s in sections:
+            lines.append(f"- {s['start_km']:.1f}-{s['end_km']:.1f}公里: 爬升{s['gain']}米, 下降{s['loss']}米, 平均坡度{s['grade']}%")
+    if climbs:
+        lines.append(f"\n### 主要爬升与下降（阈值{threshold:.0f}米）:")
+        for c in climbs:
+            name = '爬升' if c['type'] == 'climb' else '下降'
+            lines.append(f"- {name} {c['start_km']:.1f}-{c['end_km']:.1f}公里: {c['start_elevation']}米→{c['end_elevation']}米, "
+                         f"{c['elevation_change']:+d}米, 平均坡度{c['avg_grade']}%")
+    if extremes:
+        lines.append(f"- 最高点: {extremes['max_elevation']}米（{extremes['max_km']:.1f}公里）; "
+                     f"最低点: {extremes['min_elevation']}米（{extremes['min_km']:.1f}公里）")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def summarize_route(gpx_data, token_budget=None, threshold=None, max_sections=20):
+    """
+    生成覆盖全程、长度受限的路线结构化摘要
+
+    摘要包括全程等分区段的爬升下降、显著的爬升/下降段以及最高最低点。
+    超出token预算时，先去掉最不显著的爬升/下降段，再减少区段数量。
+
+    Args:
+        gpx_data: GPX数据对象
+        token_budget: 摘要的token预算
+        threshold: 爬升/下降识别的滞回阈值（米）
+        max_sections: 全程区段的最大数量
+
+    Returns:
+        (摘要文本, 结构化摘要字典)
+    """
+    if token_budget is None:
+        token_budget = ROUTE_SUMMARY_TOKEN_BUDGET
+    if threshold is None:
+        threshold = CLIMB_THRESHOLD
+
+    elevation_data = gpx_data.get('elevation_data') or {}
+    distances, elevations = _valid_profile(elevation_data.get('distances', []),
+                                           elevation_data.get('elevations', []))
+
+    km_segments = compute_km_segments(distances, elevations)
+    climbs = detect_climbs(distances, elevations, threshold)
+
+    extremes = None
+    if elevations:
+        max_i = max(range(len(elevations)), key=elevations.__getitem__)
+        min_i = min(range(len(elevations)), key=elevations.__getitem__)
+        extremes = {
+            'max_elevation': round(elevations[max_i]),
+            'max_km': distances[max_i],
+            'min_elevation': round(elevations[min_i]),
+            'min_km': distances[min_i]
+        }
+
+    section_count = min(max_sections, len(km_segments)) or 1
+    # 按显著程度保留爬升/下降段，输出时恢复原有顺序
+    ranked = sorted(range(len(climbs)), key=lambda i: abs(climbs[i]['elevation_change']), reverse=True)
+    keep = len(climbs)
+
+    while True:
+        sections = _merge_sections(km_segments, section_count)
+        kept_climbs = [climbs[i] for i in sorted(ranked[:keep])]
+        text = _render_summary(sections, kept_climbs, threshold, extremes)
+        if estimate_tokens(text) <= token_budget:
+            break
+        if keep > 3:
+            keep -= 1
+        elif section_count > 4:
+            section_count = max(4, section_count * 2 // 3)
+        elif keep > 0:
+            keep -= 1
+        elif section_count > 1:
+            section_count -= 1
+        else:
+            break
+
+    summary = {
+        'sections': sections,
+        'climbs': kept_climbs,
+        'climb_count': len(climbs),
+        'extremes': extremes,
+        'estimated_tokens': estimate_tokens(text)
+    }
+    return text, summary
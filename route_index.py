@@ -0,0 +1,286 @@
+import os
+import math
+import time
+import hashlib
+
+from db_utils import LocalSqlite
+
+# 网格边长（米）。路线经过的网格作为倒排索引的键，查询时同时匹配相邻网格，
+# 所以相距不超过约一个网格的两段路线都算作重合
+ROUTE_INDEX_CELL_METERS = float(os.getenv('ROUTE_INDEX_CELL_METERS', 250))
+# 没有重合路段、但边界框距离路线在此范围内（公里）的活动作为附近的活动返回
+ROUTE_NEARBY_KM = float(os.getenv('ROUTE_NEARBY_KM', 5))
+
+_METERS_PER_DEGREE = 111320
+# 单次查询的参数数量，低于SQLite的参数上限
+_QUERY_CHUNK = 500
+
+
+class RouteGrid:
+    """
+    把经纬度映射到近似等面积的网格
+
+    纬度方向按固定角度分行，每一行的经度宽度按该行纬度的余弦放大，
+    使网格在各纬度上都接近 cell_meters 见方。网格编号为整数，便于在SQLite中建索引。
+    """
+
+    def __init__(self, cell_meters=ROUTE_INDEX_CELL_METERS):
+        self.cell_meters = cell_meters
+        self.dlat = cell_meters / _METERS_PER_DEGREE
+        self._row_dlon = {}
+
+    def row_dlon(self, row):
+        dlon = self._row_dlon.get(row)
+        if dlon is None:
+            center = -90 + (row + 0.5) * self.dlat
+            dlon = self.dlat / max(math.cos(math.radians(center)), 0.01)
+            self._row_dlon[row] = dlon
+        return dlon
+
+    def cell(self, lat, lon):
+        row = int((lat + 90) // self.dlat)
+        return row * (1 << 24) + int((lon + 180) // self.row_dlon(row))
+
+    def neighbors(self, lat, lon):
+        """点所在网格及其周围8个网格"""
+        dlon = self.row_dlon(int((lat + 90) // self.dlat))
+        return {self.cell(lat + i * self.dlat, lon + j * dlon) for i in (-1, 0, 1) for j in (-1, 0, 1)}
+
+    def sample(self, points):
+        """
+        沿路线按半个网格的间隔取样，返回取样点列表
+
+        Strava的summary_polyline是简化过的折线，相邻点可能相距很远，
+        长线段中间插值取样，保证路线经过的网格都被覆盖；密集的GPX轨迹点则跳过相距很近的点。
+        """
+        if not points:
+            return []
+        step = self.dlat / 2
+        samples = [(points[0][0], points[0][1])]
+        last_lat, last_lon = samples[0]
+        for lat, lon in points[1:]:
+            dlat = lat - last_lat
+            # 经度差按纬度折算成与纬度相同的尺度
+            dlon = (lon - last_lon) * math.cos(math.radians(lat))
+            length = math.hypot(dlat, dlon)
+            if length < step:
+                continue
+            count = int(length // step)
+            for k in range(1, count + 1):
+                t = k / count
+                samples.append((last_lat + (lat - last_lat) * t, last_lon + (lon - last_lon) * t))
+            last_lat, last_lon = lat, lon
+        return samples
+
+    def cells(self, points):
+        return {self.cell(lat, lon) for lat, lon in self.sample(points)}
+
+
+def bounding_box(points):
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    return min(lats), max(lats), min(lons), max(lons)
+
+
+def polyline_fingerprint(activity):
+    """活动路线的摘要，路线未变化的活动同步时跳过"""
+    encoded = (activity.get('map') or {}).get('summary_polyline') or ''
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()[:16]
+
+
+class RouteIndex:
+    """
+    按运动员保存的历史活动路线空间索引
+
+    每个活动按经过的网格写入倒排表 (owner, cell) -> activity_id，查询一条路线时只需按路线经过的
+    网格查找，不用逐个解码和比较所有活动的轨迹。数据保存在SQLite中，所有worker共享。
+    """
+
+    def __init__(self, db_path, grid=None):
+        self.db = LocalSqlite(db_path)
+        self.grid = grid or RouteGrid()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS activity_cells ('
+            'owner TEXT NOT NULL, cell INTEGER NOT NULL, activity_id INTEGER NOT NULL, '
+            'PRIMARY KEY (owner, cell, activity_id)) WITHOUT ROWID'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS activity_cells_activity ON activity_cells (owner, activity_id)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS activity_routes ('
+            'owner TEXT NOT NULL, activity_id INTEGER NOT NULL, name TEXT, sport_type TEXT, start_date TEXT, '
+            'distance REAL, fingerprint TEXT NOT NULL, cell_count INTEGER NOT NULL, '
+            'min_lat REAL, max_lat REAL, min_lon REAL, max_lon REAL, indexed_at REAL NOT NULL, '
+            'PRIMARY KEY (owner, activity_id))'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS route_index_sources (owner TEXT PRIMARY KEY, etag TEXT NOT NULL)'
+        )
+
+    def source_etag(self, owner):
+        """上次同步时活动列表缓存的ETag"""
+        row = self.db.execute('SELECT etag FROM route_index_sources WHERE owner = ?', (owner,)).fetchone()
+        return row[0] if row else None
+
+    def set_source_etag(self, owner, etag):
+        self.db.execute('INSERT OR REPLACE INTO route_index_sources (owner, etag) VALUES (?, ?)', (owner, etag))
+
+    def add_activities(self, owner, activities):
+        """
+        把活动路线加入索引，已索引且路线未变化的活动跳过
+
+        Args:
+            owner: 运动员标识
+            activities: 活动列表，需要id、map.summary_polyline和已解码的decoded_polyline
+
+        Returns:
+            新索引或重新索引的活动数量
+        """
+        known = dict(self.db.execute(
+            'SELECT activity_id, fingerprint FROM activity_routes WHERE owner = ?', (owner,)
+        ).fetchall())
+        conn = self.db.conn()
+        indexed = 0
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for activity in activities:
+                activity_id = activity.get('id')
+                fingerprint = polyline_fingerprint(activity)
+                if activity_id is None or known.get(activity_id) == fingerprint:
+                    continue
+                points = activity.get('decoded_polyline') or []
+                cells = self.grid.cells(points)
+                box = bounding_box(points) if points else (None, None, None, None)
+                if activity_id in known:
+                    conn.execute('DELETE FROM activity_cells WHERE owner = ? AND activity_id = ?', (owner, activity_id))
+                conn.executemany('INSERT OR IGNORE INTO activity_cells (owner, cell, activity_id) VALUES (?, ?, ?)',
+                                 [(owner, cell, activity_id) for cell in cells])
+                conn.execute(
+                    'INSERT OR REPLACE INTO activity_routes (owner, activity_id, name, sport_type, start_date, distance, '
+                    'fingerprint, cell_count, min_lat, max_lat, min_lon, max_lon, indexed_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (owner, activity_id, activity.get('name'), activity.get('sport_type') or activity.get('type'),
+                     activity.get('start_date_local'), activity.get('distance'), fingerprint, len(cells),
+                     *box, time.time())
+                )
+                indexed += 1
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return indexed
+
+    def remove(self, owner, activity_id):
+        self.db.execute('DELETE FROM activity_cells WHERE owner = ? AND activity_id = ?', (owner, activity_id))
+        self.db.execute('DELETE FROM activity_routes WHERE owner = ? AND activity_id = ?', (owner, activity_id))
+
+    def remove_owner(self, owner):
+        """删除运动员的全部索引（取消授权时）"""
+        for table in ('activity_cells', 'activity_routes', 'route_index_sources'):
+            self.db.execute(f'DELETE FROM {table} WHERE owner = ?', (owner,))
+
+    def query(self, owner, points, limit=20, min_overlap=0.02, nearby_km=ROUTE_NEARBY_KM, samples=None):
+        """
+        查找与路线重合或在路线附近的历史活动
+
+        Args:
+            owner: 运动员标识
+            points: 路线的 [纬度, 经度] 列表
+            limit: 每类结果的最大数量
+            min_overlap: 最小重合比例（路线网格中被活动覆盖的比例）
+            nearby_km: 附近活动的距离范围（公里）
+            samples: 预先计算的路线取样点（grid.sample的结果），提供时不再重新取样
+
+        Returns:
+            {'overlapping': [...], 'nearby': [...], 'route_cells': 路线网格数}
+            overlapping按重合比例从高到低排序，overlap为路线被该活动覆盖的比例，
+            activity_share为该活动路线落在比赛路线上的比例
+        """
+        route_cells = set()
+        # 相邻网格 -> 能匹配到的路线网格
+        expanded = {}
+        for lat, lon in (samples if samples is not None else self.grid.sample(points)):
+            cell = self.grid.cell(lat, lon)
+            route_cells.add(cell)
+            for neighbor in self.grid.neighbors(lat, lon):
+                expanded.setdefault(neighbor, set()).add(cell)
+
+        covered = {}
+        matched = {}
+        keys = list(expanded)
+        for i in range(0, len(keys), _QUERY_CHUNK):
+            chunk = keys[i:i + _QUERY_CHUNK]
+            rows = self.db.execute(
+                f"SELECT cell, activity_id FROM activity_cells WHERE owner = ? AND cell IN ({','.join('?' * len(chunk))})",
+                (owner, *chunk)
+            ).fetchall()
+            for cell, activity_id in rows:
+                covered.setdefault(activity_id, set()).update(expanded[cell])
+                matched[activity_id] = matched.get(activity_id, 0) + 1
+
+        total = len(route_cells) or 1
+        scored = [(len(cells) / total, activity_id) for activity_id, cells in covered.items()
+                  if len(cells) / total >= min_overlap]
+        scored.sort(reverse=True)
+        scored = scored[:limit]
+        details = self._details(owner, [activity_id for _, activity_id in scored])
+        overlapping = []
+        for overlap, activity_id in scored:
+            info = details.get(activity_id)
+            if info is None:
+                continue
+            info['overlap'] = round(overlap, 3)
+            info['activity_share'] = round(min(matched[activity_id] / max(info.pop('cell_count'), 1), 1), 3)
+            overlapping.append(info)
+
+        nearby = []
+        if points and nearby_km > 0:
+            min_lat, max_lat, min_lon, max_lon = bounding_box(points)
+            pad_lat = nearby_km * 1000 / _METERS_PER_DEGREE
+            pad_lon = pad_lat / max(math.cos(math.radians((min_lat + max_lat) / 2)), 0.01)
+            rows = self.db.execute(
+                'SELECT activity_id, name, sport_type, start_date, distance FROM activity_routes '
+                'WHERE owner = ? AND max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ? '
+                'ORDER BY start_date DESC',
+                (owner, min_lat - pad_lat, max_lat + pad_lat, min_lon - pad_lon, max_lon + pad_lon)
+            ).fetchall()
+            overlapping_ids = set(covered)
+            nearby = [self._row_to_info(row) for row in rows if row[0] not in overlapping_ids][:limit]
+
+        return {'overlapping': overlapping, 'nearby': nearby, 'route_cells': len(route_cells)}
+
+    def _details(self, owner, activity_ids):
+        details = {}
+        for i in range(0, len(activity_ids), _QUERY_CHUNK):
+            chunk = activity_ids[i:i + _QUERY_CHUNK]
+            rows = self.db.execute(
+                'SELECT activity_id, name, sport_type, start_date, distance, cell_count FROM activity_routes '
+                f"WHERE owner = ? AND activity_id IN ({','.join('?' * len(chunk))})",
+                (owner, *chunk)
+            ).fetchall()
+            for row in rows:
+                info = self._row_to_info(row[:5])
+                info['cell_count'] = row[5]
+                details[row[0]] = info
+        return details
+
+    @staticmethod
+    def _row_to_info(row):
+        return {
+            'id': row[0],
+            'name': row[1],
+            'sport_type': row[2],
+            'start_date': row[3],
+            'distance_km': round((row[4] or 0) / 1000, 2)
+        }
+
+    def stats(self):
+        activities = self.db.execute('SELECT COUNT(*), COUNT(DISTINCT owner) FROM activity_routes').fetchone()
+        cells = self.db.execute('SELECT COUNT(*) FROM activity_cells').fetchone()
+        return {
+            'activities': activities[0],
+            'owners': activities[1],
+            'cells': cells[0],
+            'cell_meters': self.grid.cell_meters
+        }
@@ -0,0 +1,218 @@
+import os
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from route_analysis import summarize_route, ROUTE_SUMMARY_TOKEN_BUDGET, CLIMB_THRESHOLD
+from route_weather import render_route_weather, render_climatology, weather_cell
+from terrain_histograms import route_grade_histogram, ROUTE_GRADE_STEP_M
+
+# 是否在上传GPX后立即在后台预计算路线摘要、天气和提示词数据
+PRECOMPUTE_ENABLED = os.getenv('PRECOMPUTE_ENABLED', '1') == '1'
+# 每个worker同时运行的预计算任务数
+PRECOMPUTE_WORKERS = int(os.getenv('PRECOMPUTE_WORKERS', 2))
+# 后续请求等待正在运行的预计算步骤的最长时间（秒），超时后自行计算
+PRECOMPUTE_WAIT = float(os.getenv('PRECOMPUTE_WAIT', 10))
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# 路线摘要的参数，修改后已预计算的摘要不再使用
+ROUTE_SUMMARY_PARAMS = [ROUTE_SUMMARY_TOKEN_BUDGET, CLIMB_THRESHOLD]
+
+
+def weather_text_for_date(stored_data, date):
+    """
+    提示词中使用的天气文本：优先沿路线的天气表，其次起点的气候统计，都只在日期与比赛日期一致时使用
+
+    Args:
+        stored_data: 路线数据
+        date: 比赛日期（YYYY-MM-DD）
+
+    Returns:
+        天气文本，没有对应日期的数据时返回None
+    """
+    route_weather = stored_data.get('route_weather')
+    weather_climate = stored_data.get('weather_climate')
+    if route_weather and route_weather.get('date') == date:
+        return render_route_weather(route_weather)
+    if weather_climate and weather_climate.get('date') == date:
+        return render_climatology(weather_climate, date)
+    return None
+
+
+def stored_route_summary(stored_data):
+    """预计算的路线摘要 (文本, 结构化摘要)，参数已变化或没有时返回None"""
+    prepared = stored_data.get('route_summary')
+    if prepared and prepared.get('params') == ROUTE_SUMMARY_PARAMS:
+        return prepared['text'], prepared['summary']
+    return None
+
+
+def stored_grade_histogram(stored_data):
+    """预计算的路线坡度直方图（numpy数组），重采样间隔已变化或没有时返回None"""
+    prepared = stored_data.get('grade_histogram')
+    if prepared and prepared.get('step_m') == ROUTE_GRADE_STEP_M:
+        import numpy as np
+        return np.asarray(prepared['values'], dtype=float)
+    return None
+
+
+def stored_route_samples(stored_data, grid):
+    """预计算的空间索引取样点，网格大小已变化或没有时返回None"""
+    prepared = stored_data.get('route_samples')
+    if prepared and prepared.get('cell_meters') == grid.cell_meters:
+        return prepared['points']
+    return None
+
+
+def stored_prompt_data(stored_data, date, weather_text):
+    """预先准备的提示词数据，只在比赛日期、天气文本和路线摘要参数都一致时使用"""
+    prepared = stored_data.get('prompt_data')
+    if (prepared and prepared.get('date') == date and prepared.get('weather_text') == weather_text
+            and prepared.get('params') == ROUTE_SUMMARY_PARAMS):
+        return prepared['data']
+    return None
+
+
+def profile_step(stored_data):
+    """路线摘要（区段、爬升/下降段、最高最低点）和坡度直方图"""
+    gpx_data = stored_data['gpx_data']
+    text, summary = summarize_route(gpx_data)
+    elevation_data = gpx_data.get('elevation_data') or {}
+    histogram = route_grade_histogram(elevation_data.get('distances', []), elevation_data.get('elevations', []))
+    return {
+        'route_summary': {'params': ROUTE_SUMMARY_PARAMS, 'text': text, 'summary': summary},
+        'grade_histogram': {'step_m': ROUTE_GRADE_STEP_M, 'values': histogram.tolist()}
+    }
+
+
+def geometry_step(stored_data, grid):
+    """查询历史活动空间索引时使用的路线取样点"""
+    points = grid.sample(stored_data['gpx_data']['points'])
+    return {'route_samples': {'cell_meters': grid.cell_meters, 'points': points}}
+
+
+def weather_step(stored_data, race_date, fetcher):
+    """
+    预取起点的历史天气和气候统计，保存格式与对应接口一致
+
+    沿路线的天气表需要请求多个天气网格，只在用户请求/get_route_weather时获取
+
+    Args:
+        race_date: 比赛日期（YYYY-MM-DD）
+        fetcher: WeatherFetcher
+    """
+    gpx_data = stored_data['gpx_data']
+    target_date = datetime.strptime(race_date, '%Y-%m-%d')
+    lat, lon = gpx_data['points'][0][:2]
+    cell = weather_cell(float(lat), float(lon))
+    history = fetcher.history(cell, target_date)
+    climate = fetcher.climatology([cell], target_date).get(cell)
+    if climate is not None:
+        climate['date'] = race_date
+    return {
+        'weather_data': history,
+        'weather_climate': climate,
+        'weather_cell': list(cell)
+    }
+
+
+def prompt_step(stored_data, race_date, ai_service):
+    """按比赛日期预先准备提示词中的路线和天气数据，训练地形和训练负荷按请求时的登录状态填入"""
+    weather_text = weather_text_for_date(stored_data, race_date)
+    data = ai_service.prepare_prompt_data(stored_data['gpx_data'], stored_data.get('weather_data', []),
+                                          weather_text=weather_text, route_summary=stored_route_summary(stored_data))
+    return {'prompt_data': {'date': race_date, 'weather_text': weather_text, 'params': ROUTE_SUMMARY_PARAMS,
+                            'data': data}}
+
+
+class PrecomputePipeline:
+    """
+    上传GPX后在后台依次运行的预计算步骤
+
+    每个步骤返回要合并到路线数据中的字段，由update_entry在跨worker的锁内合并写回，
+    步骤和整体的状态保存在路线数据的precompute字段中，任一worker都可以查询。
+    单个步骤失败不影响后续步骤，后续请求发现没有预计算结果时自行计算。
+    """
+
+    def __init__(self, update_entry, max_workers=PRECOMPUTE_WORKERS):
+        """
+        Args:
+            update_entry: update_entry(data_id, 字段字典) -> 合并后的路线数据，数据已不存在时返回None
+            max_workers: 同时运行的预计算任务数
+        """
+        self.update_entry = update_entry
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'completed': 0, 'failed_steps': 0, 'running': 0}
+        self._step_ms = {}
+
+    def _count(self, name, delta=1):
+        with self._lock:
+            self._stats[name] += delta
+
+    def submit(self, data_id, stored_data, steps):
+        """
+        提交一个路线的预计算任务
+
+        Args:
+            data_id: 路线数据ID
+            stored_data: 当前的路线数据
+            steps: [(步骤名, func(路线数据) -> 字段字典), ...]，按顺序运行，后面的步骤能看到前面步骤的结果
+        """
+        status = {
+            'status': PENDING,
+            'submitted_at': time.time(),
+            'steps': {name: {'status': PENDING} for name, _ in steps}
+        }
+        stored_data = self.update_entry(data_id, {'precompute': status}) or stored_data
+        with self._lock:
+            # 线程池在第一次提交时创建，避免在gunicorn fork之前启动线程
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='precompute')
+            self._stats['submitted'] += 1
+        self._executor.submit(self._run, data_id, stored_data, status, steps)
+
+    def _run(self, data_id, stored_data, status, steps):
+        self._count('running')
+        started = time.perf_counter()
+        status['status'] = RUNNING
+        try:
+            for name, func in steps:
+                step = status['steps'][name]
+                step_started = time.perf_counter()
+                try:
+                    updates = func(stored_data) or {}
+                    step['status'] = DONE
+                except Exception as e:
+                    print(f"预计算步骤 {name} 出错 {data_id}: {e}")
+                    updates = {}
+                    step.update(status=FAILED, error=str(e))
+                    self._count('failed_steps')
+                step['ms'] = round((time.perf_counter() - step_started) * 1000, 1)
+                with self._lock:
+                    total, count = self._step_ms.get(name, (0.0, 0))
+                    self._step_ms[name] = (total + step['ms'], count + 1)
+                if name == steps[-1][0]:
+                    status['status'] = FAILED if any(s['status'] == FAILED for s in status['steps'].values()) else DONE
+                    status['total_ms'] = round((time.perf_counter() - started) * 1000, 1)
+                updates['precompute'] = status
+                stored_data = self.update_entry(data_id, updates)
+                if stored_data is None:
+                    # 路线数据已被清理
+                    return
+            self._count('completed')
+        finally:
+            self._count('running', -1)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['avg_step_ms'] = {name: round(total / count, 1) for name, (total, count) in self._step_ms.items()}
+        stats['max_workers'] = self.max_workers
+        return stats
@@ -0,0 +1,450 @@
+import os
+import bisect
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# 沿路线取样的间隔（公里），接近越野赛补给站的间距
+ROUTE_WEATHER_SPACING_KM = float(os.getenv('ROUTE_WEATHER_SPACING_KM', 15))
+# 每条路线最多的取样点数（含起点、终点和最高点）
+ROUTE_WEATHER_MAX_POINTS = int(os.getenv('ROUTE_WEATHER_MAX_POINTS', 8))
+# 并发请求天气接口的线程数
+WEATHER_CONCURRENCY = int(os.getenv('WEATHER_CONCURRENCY', 8))
+# 历史天气按此大小（度）的网格去重和缓存，约5公里，与天气数据的空间分辨率相当
+WEATHER_CELL_DEGREES = float(os.getenv('WEATHER_CELL_DEGREES', 0.05))
+# 历史天气不会变化，缓存时间只用于限制缓存大小
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', 30 * 24 * 3600))
+# 获取过去多少年同一天的天气
+WEATHER_YEARS = 10
+# 气候统计取每年目标日期前后多少天，每年只需一个日期范围请求
+CLIMATE_WINDOW_DAYS = int(os.getenv('CLIMATE_WINDOW_DAYS', 7))
+# 气温垂直递减率（°C/米）
+LAPSE_RATE = 0.0065
+# 间隔点附近有比它高出此值（米）的点时，改用该高点取样
+LOCAL_HIGH_M = 150
+# 降水量超过此值（毫米）的年份计为下雨
+RAIN_THRESHOLD_MM = 0.1
+
+
+def historical_dates(target_date, years=WEATHER_YEARS, now=None):
+    """
+    过去若干年中与目标日期同月同日的日期，2月29日在平年取2月28日
+
+    Returns:
+        YYYY-MM-DD字符串列表，按年份升序，只包含已经过去的日期
+    """
+    from datetime import datetime
+
+    now = now or datetime.now()
+    dates = []
+    for year in range(now.year - years, now.year):
+        try:
+            day = target_date.replace(year=year)
+        except ValueError:
+            day = target_date.replace(year=year, day=28)
+        if day < now:
+            dates.append(day.strftime('%Y-%m-%d'))
+    return dates
+
+
+def climate_windows(target_date, window_days=CLIMATE_WINDOW_DAYS, years=WEATHER_YEARS, now=None):
+    """
+    过去各年目标日期前后window_days天的日期范围，结束日期不晚于昨天
+
+    Returns:
+        [(当年的同一天, 开始日期, 结束日期), ...]，都是YYYY-MM-DD字符串
+    """
+    from datetime import datetime, timedelta
+
+    now = now or datetime.now()
+    yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    windows = []
+    for day in historical_dates(target_date, years, now):
+        center = datetime.strptime(day, '%Y-%m-%d')
+        start = (center - timedelta(days=window_days)).strftime('%Y-%m-%d')
+        end = min((center + timedelta(days=window_days)).strftime('%Y-%m-%d'), yesterday)
+        windows.append((day, start, end))
+    return windows
+
+
+def weather_cell(lat, lon):
+    """点所在的天气网格，返回网格中心的经纬度，同一网格的取样点共用一次请求"""
+    size = WEATHER_CELL_DEGREES
+    return round(round(lat / size) * size, 4), round(round(lon / size) * size, 4)
+
+
+def select_sample_points(gpx_data, spacing_km=None, max_points=None):
+    """
+    选取路线上有代表性的天气取样点
+
+    起点、终点和最高点必选；途中每隔spacing_km取一个点（路线较长时按max_points放大间隔），
+    附近明显更高的点优先（如山顶）。
+    相距不足三分之一间隔的点合并，超过max_points时按重要程度保留。
+
+    Args:
+        gpx_data: 路线数据，需要points和elevation_data
+        spacing_km: 途中取样间隔（公里）
+        max_points: 最多取样点数
+
+    Returns:
+        [{'label', 'km', 'lat', 'lon', 'elevation', 'index'}, ...]，按距离排序
+    """
+    spacing_km = spacing_km or ROUTE_WEATHER_SPACING_KM
+    max_points = max_points or ROUTE_WEATHER_MAX_POINTS
+    points = gpx_data.get('points') or []
+    elevation_data = gpx_data.get('elevation_data') or {}
+    distances = elevation_data.get('distances') or []
+    elevations = elevation_data.get('elevations') or []
+    n = min(len(points), len(distances))
+    if n == 0:
+        return []
+
+    def elevation(i):
+        return elevations[i] if i < len(elevations) else None
+
+    # 索引 -> (标签, 优先级)，优先级数值越小越重要
+    chosen = {0: ('起点', 0), n - 1: ('终点', 0)}
+    with_elevation = [i for i in range(n) if elevation(i) is not None]
+    if with_elevation:
+        chosen.setdefault(max(with_elevation, key=elevation), ('最高点', 1))
+
+    total = distances[n - 1] or 0
+    # 长路线放大间隔，使途中的取样点覆盖全程而不是集中在前半段
+    spacing_km = max(spacing_km, total / max(max_points - 2, 1))
+    km = spacing_km
+    while km < total - spacing_km / 3:
+        i = min(bisect.bisect_left(distances, km, 0, n), n - 1)
+        label = '途中'
+        lo = bisect.bisect_left(distances, km - spacing_km / 4, 0, n)
+        hi = bisect.bisect_right(distances, km + spacing_km / 4, 0, n)
+        window = [j for j in range(lo, hi) if elevation(j) is not None]
+        if window and elevation(i) is not None:
+            highest = max(window, key=elevation)
+            # 高点离已选的点太近时仍用间隔点，避免这一段没有取样
+            far = all(abs(distances[highest] - distances[j]) >= spacing_km / 3 for j in chosen)
+            if elevation(highest) - elevation(i) > LOCAL_HIGH_M and far:
+                i, label = highest, '高点'
+        chosen.setdefault(i, (label, 2))
+        km += spacing_km
+
+    selected = []
+    for i, (label, priority) in sorted(chosen.items(), key=lambda item: (item[1][1], item[0])):
+        if len(selected) >= max_points:
+            break
+        if priority > 0 and any(abs(distances[i] - distances[j]) < spacing_km / 3 for j, _ in selected):
+            continue
+        selected.append((i, label))
+
+    return [{
+        'label': label,
+        'km': round(distances[i], 2),
+        'lat': points[i][0],
+        'lon': points[i][1],
+        'elevation': None if elevation(i) is None else round(elevation(i)),
+        'index': i
+    } for i, label in sorted(selected)]
+
+
+def cell_reference_elevations(gpx_data, cells):
+    """
+    各天气网格内路线的最低海拔
+
+    历史天气来自气象站和再分析数据，代表网格中地势较低处（谷地、城镇）的气温，
+    取样点高出此海拔的部分按递减率修正。
+    """
+    points = gpx_data.get('points') or []
+    elevations = (gpx_data.get('elevation_data') or {}).get('elevations') or []
+    wanted = set(cells)
+    lowest = {}
+    for (lat, lon), elevation in zip(points, elevations):
+        if elevation is None:
+            continue
+        cell = weather_cell(lat, lon)
+        if cell in wanted and (cell not in lowest or elevation < lowest[cell]):
+            lowest[cell] = elevation
+    return lowest
+
+
+class WeatherFetcher:
+    """
+    并发获取历史天气，按 (网格, 开始日期, 结束日期) 去重
+
+    结果保存在共享的响应缓存中，所有worker复用；同一worker内并发请求相同的键时只发出一次请求。
+    """
+
+    def __init__(self, cache, fetch_range, max_workers=WEATHER_CONCURRENCY, ttl=WEATHER_CACHE_TTL):
+        """
+        Args:
+            cache: ResponseCache
+            fetch_range: fetch_range(纬度, 经度, 开始日期, 结束日期) -> 每天的天气记录列表，失败时返回None
+            max_workers: 并发请求数
+            ttl: 缓存时间（秒）
+        """
+        self.cache = cache
+        self.fetch_range = fetch_range
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self._executor = None
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'failures': 0, 'cache_hits': 0, 'coalesced': 0, 'summary_hits': 0}
+
+    @staticmethod
+    def cache_key(cell, start, end):
+        return f"weather:{cell[0]:.4f},{cell[1]:.4f}:{start}:{end}"
+
+    @staticmethod
+    def climate_key(cell, target_date, windows):
+        years = f"{windows[0][0][:4]}-{windows[-1][0][:4]}"
+        return f"climate:{cell[0]:.4f},{cell[1]:.4f}:{target_date.strftime('%m-%d')}:{years}:{windows[0][1][5:]}:{windows[-1][2][5:]}"
+
+    def get_many(self, keys):
+        """
+        获取多个 (网格, 开始日期, 结束日期) 的天气，缓存未命中的键并发请求
+
+        Returns:
+            {键: 每天的天气记录列表}，获取失败的键不在结果中
+        """
+        results = {}
+        futures = {}
+        for key in dict.fromkeys(keys):
+            entry = self.cache.get(self.cache_key(*key))
+            if entry is not None:
+                self._count('cache_hits')
+                results[key] = entry['value']
+            else:
+                futures[key] = self._submit(key)
+        for key, future in futures.items():
+            try:
+                value = future.result()
+            except Exception as e:
+                print(f"获取天气数据出错 {key}: {e}")
+                value = None
+            if value is not None:
+                results[key] = value
+        return results
+
+    def history(self, cell, target_date, window_days=CLIMATE_WINDOW_DAYS):
+        """过去各年目标日期当天的天气，与气候统计共用日期范围请求"""
+        windows = climate_windows(target_date, window_days)
+        ranges = self.get_many([(cell, start, end) for _, start, end in windows])
+        history = []
+        for day, start, end in windows:
+            record = next((r for r in ranges.get((cell, start, end), []) if r.get('date') == day), None)
+            if record is not None:
+                history.append(record)
+        return history
+
+    def climatology(self, cells, target_date, window_days=CLIMATE_WINDOW_DAYS):
+        """
+        各网格在过去各年目标日期前后window_days天内的气候统计
+
+        统计结果按 (网格, 日期) 缓存；未缓存的网格每年一个日期范围请求，所有网格的请求一起并发。
+
+        Returns:
+            {网格: 统计摘要}，没有数据的网格不在结果中
+        """
+        windows = climate_windows(target_date, window_days)
+        if not windows:
+            return {}
+        summaries = {}
+        missing = []
+        for cell in dict.fromkeys(cells):
+            entry = self.cache.get(self.climate_key(cell, target_date, windows))
+            if entry is not None:
+                self._count('summary_hits')
+                summaries[cell] = entry['value']
+            else:
+                missing.append(cell)
+
+        ranges = self.get_many([(cell, start, end) for cell in missing for _, start, end in windows])
+        for cell in missing:
+            found = [ranges[(cell, start, end)] for _, start, end in windows if (cell, start, end) in ranges]
+            summary = climate_summary([record for records in found for record in records])
+            if summary is None:
+                continue
+            summary.update({'years': len(found), 'window_days': window_days})
+            # 部分年份请求失败时不缓存，下次重试
+            if len(found) == len(windows):
+                self.cache.put(self.climate_key(cell, target_date, windows), summary, self.ttl)
+            summaries[cell] = summary
+        return summaries
+
+    def _submit(self, key):
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                return future
+            # 线程池在第一次请求时创建，避免在gunicorn fork之前启动线程
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='weather')
+            future = self._executor.submit(self._fetch, key)
+            self._inflight[key] = future
+            return future
+
+    def _fetch(self, key):
+        (lat, lon), start, end = key
+        try:
+            self._count('requests')
+            value = self.fetch_range(lat, lon, start, end)
+            if value is None:
+                self._count('failures')
+            else:
+                self.cache.put(self.cache_key(*key), value, self.ttl)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'inflight': len(self._inflight), 'max_workers': self.max_workers})
+        return stats
+
+
+def climate_summary(records):
+    """
+    多年多日天气记录的气候统计
+
+    Args:
+        records: 每天的天气记录
+
+    Returns:
+        气温和风速的P10/P50/P90、湿度中位数、降水概率等，没有记录时返回None
+    """
+    import numpy as np
+
+    if not records:
+        return None
+
+    def column(name):
+        return np.array([np.nan if r.get(name) is None else r[name] for r in records], dtype=float)
+
+    def percentiles(values, digits=1):
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return [None, None, None]
+        return [round(float(v), digits) for v in np.percentile(values, [10, 50, 90])]
+
+    temp = percentiles(column('temperature'))
+    wind = percentiles(column('windspeed'))
+    humidity = percentiles(column('humidity'), 0)
+    precip = column('precipitation')
+    precip = precip[~np.isnan(precip)]
+    conditions = Counter(r['conditions'] for r in records if r.get('conditions'))
+
+    return {
+        'days': len(records),
+        'temp_p10': temp[0],
+        'temp_p50': temp[1],
+        'temp_p90': temp[2],
+        'humidity_p50': humidity[1],
+        'rain_probability': round(float(np.mean(precip > RAIN_THRESHOLD_MM)), 2) if len(precip) else None,
+        'precip_p90': round(float(np.percentile(precip, 90)), 1) if len(precip) else None,
+        'wind_p50': wind[1],
+        'wind_p90': wind[2],
+        'conditions': conditions.most_common(1)[0][0] if conditions else None
+    }
+
+
+def adjust_temperature(summary, adjustment):
+    """按海拔修正气候统计中的气温"""
+    summary = dict(summary)
+    for name in ('temp_p10', 'temp_p50', 'temp_p90'):
+        if summary.get(name) is not None:
+            summary[name] = round(summary[name] + adjustment, 1)
+    return summary
+
+
+def render_climate(summary):
+    """单个地点的气候统计渲染为一行文本"""
+    parts = []
+    if summary.get('temp_p50') is not None:
+        parts.append(f"气温中位数 {summary['temp_p50']}°C（P10~P90: {summary['temp_p10']}~{summary['temp_p90']}）")
+    if summary.get('humidity_p50') is not None:
+        parts.append(f"湿度 {summary['humidity_p50']:.0f}%")
+    if summary.get('rain_probability') is not None:
+        parts.append(f"降水概率 {summary['rain_probability'] * 100:.0f}%（日降水量P90 {summary['precip_p90']}mm）")
+    if summary.get('wind_p50') is not None:
+        parts.append(f"风速 {summary['wind_p50']}km/h（P90 {summary['wind_p90']}）")
+    if summary.get('conditions'):
+        parts.append(f"多为{summary['conditions']}")
+    return "，".join(parts)
+
+
+def render_climatology(summary, date):
+    """把起点的气候统计渲染为提示词中的文本"""
+    if not summary:
+        return "无天气数据"
+    return (f"{date}前后{summary['window_days']}天、过去{summary['years']}年共{summary['days']}天的历史天气: "
+            + render_climate(summary))
+
+
+def build_route_weather(gpx_data, target_date, fetcher, spacing_km=None, max_points=None, window_days=CLIMATE_WINDOW_DAYS):
+    """
+    沿路线多点取样的气候统计
+
+    Args:
+        gpx_data: 路线数据
+        target_date: 比赛日期（datetime）
+        fetcher: WeatherFetcher
+        window_days: 每年取目标日期前后的天数
+
+    Returns:
+        {'date', 'years', 'window_days', 'lapse_rate', 'cells', 'sections': [...]}
+        每个section为一个取样点及其代表的路段（相邻取样点的中点之间）
+    """
+    samples = select_sample_points(gpx_data, spacing_km, max_points)
+    cells = [weather_cell(s['lat'], s['lon']) for s in samples]
+    references = cell_reference_elevations(gpx_data, cells)
+    climate = fetcher.climatology(cells, target_date, window_days)
+
+    total = samples[-1]['km'] if samples else 0
+    sections = []
+    for i, (sample, cell) in enumerate(zip(samples, cells)):
+        reference = references.get(cell)
+        adjustment = 0.0
+        if sample['elevation'] is not None and reference is not None:
+            adjustment = LAPSE_RATE * (reference - sample['elevation'])
+        section = {
+            'label': sample['label'],
+            'km': sample['km'],
+            'from_km': 0 if i == 0 else round((samples[i - 1]['km'] + sample['km']) / 2, 1),
+            'to_km': round(total, 1) if i == len(samples) - 1 else round((sample['km'] + samples[i + 1]['km']) / 2, 1),
+            'lat': sample['lat'],
+            'lon': sample['lon'],
+            'elevation': sample['elevation'],
+            'reference_elevation': None if reference is None else round(reference),
+            'temp_adjustment': round(adjustment, 1)
+        }
+        section.update(adjust_temperature(climate[cell], adjustment) if cell in climate else {'days': 0})
+        sections.append(section)
+
+    return {
+        'date': target_date.strftime('%Y-%m-%d'),
+        'years': len(climate_windows(target_date, window_days)),
+        'window_days': window_days,
+        'lapse_rate': LAPSE_RATE * 1000,
+        'cells': len(set(cells)),
+        'sections': sections
+    }
+
+
+def render_route_weather(route_weather):
+    """把沿路线的天气表渲染为提示词中的文本"""
+    if not route_weather or not route_weather.get('sections'):
+        return "无天气数据"
+    lines = [f"过去{route_weather['years']}年比赛日前后{route_weather['window_days']}天的历史天气，按路线取样点分段"
+             f"（气温已按海拔修正，递减率{route_weather['lapse_rate']:.1f}°C/公里）:"]
+    for s in route_weather['sections']:
+        head = f"- {s['label']} {s['km']:.1f}公里（{s['from_km']:g}~{s['to_km']:g}公里段）"
+        if s['elevation'] is not None:
+            head += f" 海拔{s['elevation']}米"
+        lines.append(f"{head}: " + (render_climate(s) if s.get('days') else "无数据"))
+    return "\n".join(lines)
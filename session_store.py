@@ -0,0 +1,148 @@
+import os
+import time
+import secrets
+
+from flask import request
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface, session_json_serializer
+from itsdangerous import Signer, BadSignature
+from werkzeug.datastructures import CallbackDict
+
+from db_utils import LocalSqlite
+
+# 服务端session的有效期（按最后一次写入计算）
+SESSION_TTL_HOURS = float(os.getenv('SESSION_TTL_HOURS', 24 * 30))
+# 新cookie值的前缀，用于区分旧版的cookie session
+SESSION_ID_PREFIX = 's1.'
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """只在cookie中保存session id，数据保存在服务端"""
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.expires_at = None
+        self.previous_sid = None
+
+    def regenerate(self):
+        """换用新的session id（登录时调用，防止session固定攻击），旧id的数据在保存时删除"""
+        if not self.new:
+            self.previous_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class SqliteSessionInterface(SessionInterface):
+    """
+    基于SQLite的服务端session，多个gunicorn worker共享同一个数据库文件
+
+    cookie中只保存签名后的随机session id。旧版把全部数据存放在cookie中的session
+    会在首次请求时自动迁移到服务端，并替换为新的id cookie。
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, db_path, ttl_seconds=None):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds or SESSION_TTL_HOURS * 3600
+        self.legacy_interface = SecureCookieSessionInterface()
+        self.db = LocalSqlite(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-session')
+
+    def _load(self, sid):
+        row = self.db.execute(
+            'SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?', (sid, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        return self.serializer.loads(row[0]), row[1]
+
+    def _save(self, sid, data):
+        expires_at = time.time() + self.ttl_seconds
+        self.db.execute(
+            'INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)',
+            (sid, self.serializer.dumps(data), expires_at)
+        )
+        return expires_at
+
+    def delete(self, sid):
+        self.db.execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def purge_expired(self):
+        """删除过期的session，返回删除的数量"""
+        return self.db.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie and cookie.startswith(SESSION_ID_PREFIX):
+            try:
+                sid = self._signer(app).unsign(cookie[len(SESSION_ID_PREFIX):]).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                loaded = self._load(sid)
+                if loaded is not None:
+                    session = ServerSideSession(loaded[0], sid=sid)
+                    session.expires_at = loaded[1]
+                    return session
+        elif cookie:
+            # 迁移旧版cookie session：解出数据后保存到服务端，响应时换成新的id cookie
+            legacy = self.legacy_interface.open_session(app, request)
+            if legacy:
+                session = ServerSideSession(dict(legacy), sid=secrets.token_urlsafe(32), new=True)
+                session.modified = True
+                return session
+
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.previous_sid:
+            self.delete(session.previous_sid)
+
+        if not session:
+            if not session.new:
+                self.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            elif name in request.cookies:
+                # 无效或已迁移为空的旧cookie，让浏览器删除
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # 只在数据变化或有效期过半时写库，避免每个请求都写
+        half_life = time.time() + self.ttl_seconds / 2
+        if session.modified or session.expires_at is None or session.expires_at < half_life:
+            self._save(session.sid, dict(session))
+            if secrets.randbelow(100) == 0:
+                self.purge_expired()
+
+        if session.new:
+            response.set_cookie(
+                name,
+                SESSION_ID_PREFIX + self._signer(app).sign(session.sid).decode('utf-8'),
+                max_age=int(self.ttl_seconds),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
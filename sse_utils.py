@@ -0,0 +1,86 @@
+import os
+import json
+import asyncio
+
+# SSE合并发送配置：按时间预算或字节阈值触发发送，先到者为准
+SSE_FLUSH_INTERVAL_MS = int(os.getenv('SSE_FLUSH_INTERVAL_MS', 40))
+SSE_FLUSH_BYTES = int(os.getenv('SSE_FLUSH_BYTES', 512))
+
+
+def sse_event(payload):
+    """将字典编码为一个SSE数据帧"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def coalesce_stream(source, flush_interval_ms=None, flush_bytes=None):
+    """
+    合并上游的小文本块，减少SSE帧数量
+
+    缓冲区中第一个文本块到达后开始计时，超过时间预算或累计字节数达到阈值时
+    立即发送。即使上游暂时没有新数据，计时到期也会发送，保证感知延迟不变。
+
+    Args:
+        source: 产生字符串的异步迭代器
+        flush_interval_ms: 时间预算（毫秒），<=0 表示每个文本块单独发送
+        flush_bytes: 字节阈值
+    """
+    if flush_interval_ms is None:
+        flush_interval_ms = SSE_FLUSH_INTERVAL_MS
+    if flush_bytes is None:
+        flush_bytes = SSE_FLUSH_BYTES
+
+    iterator = source.__aiter__()
+
+    # 不合并时直接透传，保持原有的逐块发送行为
+    if flush_interval_ms <= 0:
+        async for chunk in iterator:
+            if isinstance(chunk, str) and chunk:
+                yield chunk
+        return
+
+    loop = asyncio.get_event_loop()
+    flush_interval = flush_interval_ms / 1000
+    flush_ready = asyncio.Event()
+    state = {'buffer': [], 'bytes': 0, 'timer': None, 'finished': False}
+
+    # 单独的任务读取上游，每个文本块只做一次追加，不额外创建任务
+    async def produce():
+        try:
+            async for chunk in iterator:
+                if not isinstance(chunk, str) or not chunk:
+                    continue
+                if not state['buffer']:
+                    state['timer'] = loop.call_later(flush_interval, flush_ready.set)
+                state['buffer'].append(chunk)
+                state['bytes'] += len(chunk.encode('utf-8'))
+                if state['bytes'] >= flush_bytes:
+                    flush_ready.set()
+        finally:
+            state['finished'] = True
+            flush_ready.set()
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            await flush_ready.wait()
+            flush_ready.clear()
+            if state['timer'] is not None:
+                state['timer'].cancel()
+                state['timer'] = None
+
+            if state['buffer']:
+                text = "".join(state['buffer'])
+                state['buffer'] = []
+                state['bytes'] = 0
+                yield text
+
+            if state['finished'] and not state['buffer']:
+                break
+
+        # 上游出错时把异常抛给调用方
+        producer.result()
+    finally:
+        if state['timer'] is not None:
+            state['timer'].cancel()
+        if not producer.done():
+            producer.cancel()
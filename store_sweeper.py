@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import random
+import threading
+from datetime import datetime
+
+try:
+    import fcntl  # 跨进程文件锁，仅在类Unix系统可用
+except ImportError:
+    fcntl = None
+
+# 持久化路线数据的过期时间（按最后访问时间计算）
+DATA_STORE_TTL_HOURS = float(os.getenv('DATA_STORE_TTL_HOURS', 168))
+# data_store目录的总容量上限，超出后按最近最少访问淘汰
+DATA_STORE_MAX_BYTES = int(os.getenv('DATA_STORE_MAX_BYTES', 500 * 1024 * 1024))
+# 清理间隔（秒），0表示不启动后台清理
+DATA_STORE_SWEEP_INTERVAL = int(os.getenv('DATA_STORE_SWEEP_INTERVAL', 600))
+# 超出容量时清理到上限的这个比例，避免每次只删一个文件
+QUOTA_LOW_WATERMARK = 0.9
+
+LOCK_FILE = '.sweep.lock'
+STATS_FILE = '.last_sweep.json'
+DATA_SUFFIX = '.pkl'
+# 路线数据的预计算状态文件，见app.save_precompute_status
+STATUS_SUFFIX = '.status'
+
+
+def touch_data_file(data_dir, data_id):
+    """更新数据文件的修改时间，作为最后访问时间用于LRU淘汰"""
+    try:
+        os.utime(os.path.join(data_dir, f"{data_id}{DATA_SUFFIX}"), None)
+    except OSError:
+        pass
+
+
+def read_last_sweep(data_dir):
+    """读取最近一次清理的统计信息（任一worker写入）"""
+    try:
+        with open(os.path.join(data_dir, STATS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _remove_if_unchanged(path, mtime):
+    """文件在扫描后没有被访问过才删除，返回释放的字节数"""
+    try:
+        stat = os.stat(path)
+        if stat.st_mtime != mtime:
+            return 0
+        os.remove(path)
+        return stat.st_size
+    except OSError:
+        return 0
+
+
+def sweep_data_store(data_dir, ttl_seconds=None, max_bytes=None, min_interval=0):
+    """
+    清理data_store目录：删除过期文件，并在超出容量时按最近最少访问淘汰
+
+    多个worker同时调用时只有拿到文件锁的一个会执行，其余直接返回None。
+    min_interval 大于0时，如果其他worker在这段时间内已经清理过，也直接返回None。
+
+    Args:
+        data_dir: 数据目录
+        ttl_seconds: 过期时间（秒）
+        max_bytes: 容量上限（字节）
+        min_interval: 两次清理的最小间隔（秒）
+
+    Returns:
+        清理统计信息，未执行时返回None
+    """
+    if ttl_seconds is None:
+        ttl_seconds = DATA_STORE_TTL_HOURS * 3600
+    if max_bytes is None:
+        max_bytes = DATA_STORE_MAX_BYTES
+
+    lock_file = open(os.path.join(data_dir, LOCK_FILE), 'a')
+    try:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+
+        if min_interval:
+            last = read_last_sweep(data_dir)
+            if last and time.time() - last.get('finished_at', 0) < min_interval:
+                return None
+
+        started = time.time()
+        now = started
+        entries = []
+        expired_files = 0
+        expired_bytes = 0
+
+        with os.scandir(data_dir) as it:
+            for entry in it:
+                if not entry.name.endswith((DATA_SUFFIX, STATUS_SUFFIX, '.tmp')):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                # 过期文件、写入中断留下的临时文件和预计算异常退出留下的状态文件直接删除
+                if now - stat.st_mtime > ttl_seconds:
+                    freed = _remove_if_unchanged(entry.path, stat.st_mtime)
+                    if freed:
+                        expired_files += 1
+                        expired_bytes += freed
+                        continue
+                if entry.name.endswith(DATA_SUFFIX):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total_bytes = sum(e[1] for e in entries)
+        bytes_before = total_bytes + expired_bytes
+        evicted_files = 0
+        evicted_bytes = 0
+
+        if total_bytes > max_bytes:
+            target = max_bytes * QUOTA_LOW_WATERMARK
+            entries.sort()
+            for mtime, size, path in entries:
+                if total_bytes <= target:
+                    break
+                freed = _remove_if_unchanged(path, mtime)
+                if freed:
+                    evicted_files += 1
+                    evicted_bytes += freed
+                    total_bytes -= freed
+
+        stats = {
+            'pid': os.getpid(),
+            'started_at': started,
+            'finished_at': time.time(),
+            'duration_ms': round((time.time() - started) * 1000, 1),
+            'files_before': len(entries) + expired_files,
+            'files_after': len(entries) - evicted_files,
+            'bytes_before': bytes_before,
+            'bytes_after': total_bytes,
+            'expired_files': expired_files,
+            'evicted_files': evicted_files,
+            'reclaimed_bytes': expired_bytes + evicted_bytes,
+            'ttl_seconds': ttl_seconds,
+            'max_bytes': max_bytes
+        }
+
+        tmp_path = os.path.join(data_dir, STATS_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, os.path.join(data_dir, STATS_FILE))
+        return stats
+    finally:
+        lock_file.close()
+
+
+def start_sweeper(data_dir, interval=None, on_tick=None, log_path="logs/cleanup_temp_data.log"):
+    """
+    启动后台清理线程
+
+    每个worker都会启动一个线程，但磁盘清理由文件锁和最小间隔保证同一时间只有一个worker执行。
+
+    Args:
+        data_dir: 数据目录
+        interval: 清理间隔（秒）
+        on_tick: 每轮调用的回调，用于清理worker自己的内存数据
+        log_path: 清理日志路径
+    """
+    if interval is None:
+        interval = DATA_STORE_SWEEP_INTERVAL
+    if interval <= 0:
+        return None
+
+    def run():
+        # 随机错开各worker的首次清理时间
+        time.sleep(random.uniform(0, interval / 10))
+        while True:
+            try:
+                if on_tick:
+                    on_tick()
+                stats = sweep_data_store(data_dir, min_interval=interval * 0.9)
+                if stats and (stats['reclaimed_bytes'] or stats['files_before']):
+                    with open(log_path, "a") as log_file:
+                        log_file.write(f"\n====== 清理data_store {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ======\n")
+                        log_file.write(f"过期删除: {stats['expired_files']} 个文件, 容量淘汰: {stats['evicted_files']} 个文件\n")
+                        log_file.write(f"释放空间: {stats['reclaimed_bytes'] / 1024 / 1024:.2f} MB, "
+                                       f"剩余: {stats['files_after']} 个文件 {stats['bytes_after'] / 1024 / 1024:.2f} MB\n")
+            except Exception as e:
+                print(f"清理data_store出错: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name='data-store-sweeper', daemon=True)
+    thread.start()
+    return thread
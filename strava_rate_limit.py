@@ -0,0 +1,262 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import requests
+
+from db_utils import LocalSqlite
+
+# Strava的读取限额：每15分钟和每天的请求数。响应头中的实际限额会覆盖这里的默认值
+STRAVA_RATE_LIMIT_15MIN = int(os.getenv('STRAVA_RATE_LIMIT_15MIN', 100))
+STRAVA_RATE_LIMIT_DAILY = int(os.getenv('STRAVA_RATE_LIMIT_DAILY', 1000))
+# 令牌桶容量占15分钟限额的比例：允许短时突发，但单个用户不能在几秒内用完整个窗口
+STRAVA_BURST_SHARE = float(os.getenv('STRAVA_BURST_SHARE', 0.25))
+# 后台任务（推送预取、历史数据同步）最多使用各窗口限额的比例，其余留给用户访问
+BACKGROUND_SHARE = float(os.getenv('STRAVA_BACKGROUND_SHARE', 0.8))
+# 后台任务取令牌时桶中至少要保留的令牌比例
+BACKGROUND_RESERVE = 0.4
+# 用户访问最多排队等待的时间（秒），超过后使用缓存数据或返回错误
+INTERACTIVE_WAIT = float(os.getenv('STRAVA_INTERACTIVE_WAIT', 3))
+# 排队时的最长轮询间隔（秒）
+POLL_INTERVAL = 0.5
+
+WINDOW_SECONDS = 900
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_local = threading.local()
+
+
+class StravaRateLimited(requests.exceptions.RequestException):
+    """接近Strava限额，请求没有发出"""
+
+    def __init__(self, retry_after, priority):
+        super().__init__(f"Strava请求已达限额（{priority}），{retry_after:.0f}秒后重试")
+        self.retry_after = retry_after
+        self.priority = priority
+
+
+class PriorityContext:
+    def __init__(self, priority, timeout):
+        self.priority = priority
+        self.timeout = timeout
+        # 在此范围内最近一次因限额被拒绝的请求
+        self.limited = None
+
+
+@contextmanager
+def strava_priority(priority, timeout=0):
+    """
+    在此范围内发出的Strava请求使用指定的优先级
+
+    Args:
+        priority: INTERACTIVE 或 BACKGROUND
+        timeout: 没有配额时最多排队等待的时间（秒）
+
+    Yields:
+        PriorityContext，请求被拒绝后可通过limited取得异常
+    """
+    previous = getattr(_local, 'context', None)
+    _local.context = PriorityContext(priority, timeout)
+    try:
+        yield _local.context
+    finally:
+        _local.context = previous
+
+
+def parse_rate_headers(headers):
+    """
+    解析Strava响应头中的限额和用量，优先使用读取限额（X-ReadRateLimit-*）
+
+    Returns:
+        ((15分钟限额, 每日限额), (15分钟用量, 每日用量))，没有相关响应头时返回None
+    """
+    for prefix in ('X-ReadRateLimit', 'X-RateLimit'):
+        limit = headers.get(f'{prefix}-Limit')
+        usage = headers.get(f'{prefix}-Usage')
+        if not limit or not usage:
+            continue
+        try:
+            limits = tuple(int(x) for x in limit.split(',')[:2])
+            used = tuple(int(x) for x in usage.split(',')[:2])
+        except ValueError:
+            continue
+        if len(limits) == 2 and len(used) == 2:
+            return limits, used
+    return None
+
+
+def _utc_day(now):
+    return datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d')
+
+
+def _seconds_to_utc_midnight(now):
+    return 86400 - now % 86400
+
+
+class RateLimitScheduler:
+    """
+    所有worker共享的Strava请求调度器
+
+    用量和令牌桶保存在SQLite中：每次请求前在事务中取一个令牌并计入当前15分钟窗口和当天的用量，
+    收到响应后按响应头中Strava统计的用量校正。令牌按15分钟限额匀速补充，用户访问可以用完全部配额，
+    后台任务只能使用一部分并为用户访问保留令牌；没有配额时排队等待，超过等待时间抛出StravaRateLimited。
+    """
+
+    def __init__(self, db_path, short_limit=STRAVA_RATE_LIMIT_15MIN, daily_limit=STRAVA_RATE_LIMIT_DAILY):
+        self.db = LocalSqlite(db_path)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS strava_rate_limit ('
+            'id INTEGER PRIMARY KEY CHECK (id = 1), tokens REAL NOT NULL, refilled_at REAL NOT NULL, '
+            'window_start REAL NOT NULL, window_used INTEGER NOT NULL, window_limit INTEGER NOT NULL, '
+            'day TEXT NOT NULL, day_used INTEGER NOT NULL, day_limit INTEGER NOT NULL, '
+            'throttled_until REAL NOT NULL DEFAULT 0)'
+        )
+        now = time.time()
+        self.db.execute(
+            'INSERT OR IGNORE INTO strava_rate_limit (id, tokens, refilled_at, window_start, window_used, window_limit, '
+            'day, day_used, day_limit) VALUES (1, ?, ?, ?, 0, ?, ?, 0, ?)',
+            (short_limit * STRAVA_BURST_SHARE, now, now - now % WINDOW_SECONDS, short_limit, _utc_day(now), daily_limit)
+        )
+
+    def _count(self, priority, outcome):
+        with self._stats_lock:
+            key = f"{priority}_{outcome}"
+            self._stats[key] = self._stats.get(key, 0) + 1
+
+    @staticmethod
+    def _roll(state, now):
+        """进入新的15分钟窗口或新的一天时清零用量，并按经过的时间补充令牌"""
+        window_start = now - now % WINDOW_SECONDS
+        if state['window_start'] != window_start:
+            state['window_start'] = window_start
+            state['window_used'] = 0
+        if state['day'] != _utc_day(now):
+            state['day'] = _utc_day(now)
+            state['day_used'] = 0
+        capacity = max(state['window_limit'] * STRAVA_BURST_SHARE, 1)
+        rate = state['window_limit'] / WINDOW_SECONDS
+        state['tokens'] = min(capacity, state['tokens'] + max(now - state['refilled_at'], 0) * rate)
+        state['refilled_at'] = now
+        return capacity, rate
+
+    def _transact(self, func):
+        conn = self.db.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, refilled_at, window_start, window_used, window_limit, day, day_used, day_limit, '
+                'throttled_until FROM strava_rate_limit WHERE id = 1'
+            ).fetchone()
+            state = dict(zip(('tokens', 'refilled_at', 'window_start', 'window_used', 'window_limit', 'day',
+                              'day_used', 'day_limit', 'throttled_until'), row))
+            result = func(state)
+            conn.execute(
+                'UPDATE strava_rate_limit SET tokens = ?, refilled_at = ?, window_start = ?, window_used = ?, '
+                'window_limit = ?, day = ?, day_used = ?, day_limit = ?, throttled_until = ? WHERE id = 1',
+                (state['tokens'], state['refilled_at'], state['window_start'], state['window_used'],
+                 state['window_limit'], state['day'], state['day_used'], state['day_limit'], state['throttled_until'])
+            )
+            conn.execute('COMMIT')
+            return result
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _try_acquire(self, priority):
+        """尝试取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        def take(state):
+            now = time.time()
+            capacity, rate = self._roll(state, now)
+            share, need = (1.0, 1.0) if priority == INTERACTIVE else (BACKGROUND_SHARE, 1 + capacity * BACKGROUND_RESERVE)
+            if now < state['throttled_until']:
+                return state['throttled_until'] - now
+            if state['day_used'] >= state['day_limit'] * share:
+                return _seconds_to_utc_midnight(now)
+            if state['window_used'] >= state['window_limit'] * share:
+                return state['window_start'] + WINDOW_SECONDS - now
+            if state['tokens'] < need:
+                return (need - state['tokens']) / rate
+            state['tokens'] -= 1
+            state['window_used'] += 1
+            state['day_used'] += 1
+            return 0
+        return self._transact(take)
+
+    def acquire(self, priority=None, timeout=None):
+        """
+        为一个Strava请求取得配额，没有配额时排队等待
+
+        Args:
+            priority: 默认使用strava_priority设置的优先级，未设置时为INTERACTIVE
+            timeout: 最多等待的秒数，默认按优先级（用户访问INTERACTIVE_WAIT秒，后台任务不等待）
+
+        Raises:
+            StravaRateLimited: 等待超时
+        """
+        context = getattr(_local, 'context', None)
+        if priority is None:
+            priority = context.priority if context else INTERACTIVE
+        if timeout is None:
+            timeout = context.timeout if context else INTERACTIVE_WAIT
+        deadline = time.time() + timeout
+        waited = False
+        while True:
+            wait = self._try_acquire(priority)
+            if wait <= 0:
+                self._count(priority, 'queued' if waited else 'granted')
+                return
+            remaining = deadline - time.time()
+            if wait > remaining:
+                self._count(priority, 'limited')
+                error = StravaRateLimited(wait, priority)
+                if context is not None:
+                    context.limited = error
+                raise error
+            waited = True
+            time.sleep(min(wait, POLL_INTERVAL))
+
+    def observe(self, headers, status_code=200):
+        """按响应头校正共享的用量和限额；收到429时暂停到下一个窗口"""
+        parsed = parse_rate_headers(headers)
+        if parsed is None and status_code != 429:
+            return
+
+        def update(state):
+            now = time.time()
+            self._roll(state, now)
+            if parsed is not None:
+                (state['window_limit'], state['day_limit']), (window_used, day_used) = parsed
+                state['window_used'] = max(state['window_used'], window_used)
+                state['day_used'] = max(state['day_used'], day_used)
+            if status_code == 429:
+                self._count('strava', '429')
+                if state['day_used'] >= state['day_limit']:
+                    state['throttled_until'] = now + _seconds_to_utc_midnight(now)
+                else:
+                    state['throttled_until'] = state['window_start'] + WINDOW_SECONDS
+                state['tokens'] = 0
+        self._transact(update)
+
+    def stats(self):
+        """共享的用量和当前worker的调度统计"""
+        def read(state):
+            self._roll(state, time.time())
+            return dict(state)
+        state = self._transact(read)
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'window_used': state['window_used'],
+            'window_limit': state['window_limit'],
+            'day_used': state['day_used'],
+            'day_limit': state['day_limit'],
+            'tokens': round(state['tokens'], 2),
+            'throttled_for_s': round(max(state['throttled_until'] - time.time(), 0), 1),
+            'pid': os.getpid()
+        })
+        return stats
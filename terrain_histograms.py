@@ -0,0 +1,289 @@
+import os
+import time
+import hashlib
+
+from db_utils import LocalSqlite
+
+# 坡度分箱边界（%），两端为开区间
+GRADE_EDGES = [-20, -12, -8, -4, -1, 1, 4, 8, 12, 20]
+# 配速分箱边界（分钟/公里）
+PACE_EDGES = [4, 4.5, 5, 5.5, 6, 6.5, 7, 8, 9, 10, 12, 15]
+# 比赛路线按此间隔（米）重采样后计算坡度，GPX海拔的逐点噪声不会放大成极端坡度
+ROUTE_GRADE_STEP_M = float(os.getenv('ROUTE_GRADE_STEP_M', 50))
+# 低于此速度（米/秒）的流数据点视为停止，不计入移动时间和配速
+MOVING_SPEED = 0.5
+# 计入训练地形的运动类型
+TERRAIN_SPORT_TYPES = ('Run', 'TrailRun')
+
+GRADE_BINS = len(GRADE_EDGES) + 1
+PACE_BINS = len(PACE_EDGES) + 1
+# 每个活动保存的直方图：各坡度的距离（米）、各坡度的移动时间（秒）、坡度×配速的距离（米）
+HISTOGRAM_SIZE = GRADE_BINS * 2 + GRADE_BINS * PACE_BINS
+# 分箱边界的版本，修改边界后旧的直方图不再参与汇总，会按新边界重新计算
+BINS_VERSION = hashlib.sha1(repr((GRADE_EDGES, PACE_EDGES, MOVING_SPEED)).encode('utf-8')).hexdigest()[:12]
+
+
+def _range_labels(edges, unit):
+    labels = [f"<{edges[0]}{unit}"]
+    labels += [f"{low}~{high}{unit}" for low, high in zip(edges, edges[1:])]
+    labels.append(f">{edges[-1]}{unit}")
+    return labels
+
+
+GRADE_LABELS = _range_labels(GRADE_EDGES, '%')
+PACE_LABELS = _range_labels(PACE_EDGES, '')
+
+
+def format_pace(pace):
+    """分钟/公里 -> 5'30\""""
+    if not pace:
+        return '-'
+    minutes = int(pace)
+    return f"{minutes}'{int(round((pace - minutes) * 60)):02d}\""
+
+
+def route_grade_histogram(distances, elevations, step_m=None):
+    """
+    比赛路线各坡度区间的距离
+
+    Args:
+        distances: 累计距离列表（公里），即路线数据的elevation_data.distances
+        elevations: 海拔列表（米）
+        step_m: 重采样间隔（米）
+
+    Returns:
+        numpy数组，各坡度区间的距离（米）
+    """
+    import numpy as np
+
+    step_m = step_m or ROUTE_GRADE_STEP_M
+    d = np.asarray(distances, dtype=float) * 1000
+    e = np.asarray([np.nan if x is None else x for x in elevations], dtype=float)
+    valid = ~np.isnan(d) & ~np.isnan(e)
+    d, e = d[valid], e[valid]
+    if len(d) < 2 or d[-1] - d[0] < step_m:
+        return np.zeros(GRADE_BINS)
+    # 距离需要单调递增才能插值，重复的距离只保留第一个点
+    d, first = np.unique(d, return_index=True)
+    e = e[first]
+    grid = np.arange(d[0], d[-1], step_m)
+    grades = np.diff(np.interp(grid, d, e)) / step_m * 100
+    bins = np.searchsorted(GRADE_EDGES, grades, side='right')
+    return np.bincount(bins, minlength=GRADE_BINS).astype(float) * step_m
+
+
+def activity_histograms(streams_list):
+    """
+    批量计算多个活动的坡度和配速直方图
+
+    所有活动的流数据拼接后一次完成分箱，用活动序号作为bincount的高位，
+    数百个活动只需几次numpy调用。
+
+    Args:
+        streams_list: 活动流数据列表（get_activity_streams的返回值，需要distance、time、grade、velocity）
+
+    Returns:
+        numpy数组，形状为 (活动数, HISTOGRAM_SIZE)
+    """
+    import numpy as np
+
+    owners, dists, times, grades, speeds = [], [], [], [], []
+    for i, streams in enumerate(streams_list):
+        distance = np.asarray(streams.get('distance') or [], dtype=float)
+        seconds = np.asarray(streams.get('time') or [], dtype=float)
+        grade = np.asarray(streams.get('grade') or [], dtype=float)
+        velocity = np.asarray(streams.get('velocity') or [], dtype=float)
+        n = min(len(distance), len(seconds), len(grade), len(velocity))
+        if n < 2:
+            continue
+        # 每个点代表它与前一个点之间的一小段
+        owners.append(np.full(n - 1, i))
+        dists.append(np.diff(distance[:n]))
+        times.append(np.diff(seconds[:n]))
+        grades.append(grade[1:n])
+        speeds.append(velocity[1:n])
+
+    result = np.zeros((len(streams_list), HISTOGRAM_SIZE))
+    if not owners:
+        return result
+
+    owner = np.concatenate(owners)
+    dist = np.clip(np.concatenate(dists), 0, None)
+    dt = np.clip(np.concatenate(times), 0, None)
+    speed = np.concatenate(speeds)
+    moving = speed > MOVING_SPEED
+    dist = np.where(moving, dist, 0)
+    dt = np.where(moving, dt, 0)
+
+    grade_bin = np.searchsorted(GRADE_EDGES, np.concatenate(grades), side='right')
+    pace = np.divide(1000 / 60, speed, out=np.full_like(speed, np.inf), where=moving)
+    pace_bin = np.searchsorted(PACE_EDGES, pace, side='right')
+
+    count = len(streams_list)
+    result[:, :GRADE_BINS] = np.bincount(
+        owner * GRADE_BINS + grade_bin, weights=dist, minlength=count * GRADE_BINS).reshape(count, GRADE_BINS)
+    result[:, GRADE_BINS:GRADE_BINS * 2] = np.bincount(
+        owner * GRADE_BINS + grade_bin, weights=dt, minlength=count * GRADE_BINS).reshape(count, GRADE_BINS)
+    cells = GRADE_BINS * PACE_BINS
+    result[:, GRADE_BINS * 2:] = np.bincount(
+        owner * cells + grade_bin * PACE_BINS + pace_bin, weights=dist, minlength=count * cells).reshape(count, cells)
+    return result
+
+
+def split_histogram(histogram):
+    """拆分为 (各坡度距离, 各坡度移动时间, 坡度×配速距离矩阵)"""
+    return (histogram[:GRADE_BINS],
+            histogram[GRADE_BINS:GRADE_BINS * 2],
+            histogram[GRADE_BINS * 2:].reshape(GRADE_BINS, PACE_BINS))
+
+
+class TerrainHistogramStore:
+    """
+    每个活动的坡度和配速直方图，保存在SQLite中，所有worker共享
+
+    活动的流数据只在第一次同步时分箱一次，运动员的整体分布由已保存的直方图相加得到，
+    不需要再读取原始流数据。
+    """
+
+    def __init__(self, db_path):
+        self.db = LocalSqlite(db_path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS terrain_histograms ('
+            'owner TEXT NOT NULL, activity_id INTEGER NOT NULL, start_date TEXT, bins TEXT NOT NULL, '
+            'histogram BLOB NOT NULL, computed_at REAL NOT NULL, PRIMARY KEY (owner, activity_id))'
+        )
+
+    def missing(self, owner, activity_ids):
+        """返回还没有按当前分箱计算直方图的活动ID"""
+        known = {row[0] for row in self.db.execute(
+            'SELECT activity_id FROM terrain_histograms WHERE owner = ? AND bins = ?', (owner, BINS_VERSION)
+        ).fetchall()}
+        return [activity_id for activity_id in activity_ids if activity_id not in known]
+
+    def add_many(self, owner, items):
+        """
+        计算并保存多个活动的直方图
+
+        Args:
+            owner: 运动员标识
+            items: [(活动摘要, 流数据), ...]，活动摘要需要id和start_date_local
+
+        Returns:
+            保存的活动数量
+        """
+        if not items:
+            return 0
+        histograms = activity_histograms([streams for _, streams in items])
+        now = time.time()
+        conn = self.db.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO terrain_histograms (owner, activity_id, start_date, bins, histogram, computed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                [(owner, activity['id'], activity.get('start_date_local'), BINS_VERSION, histogram.tobytes(), now)
+                 for (activity, _), histogram in zip(items, histograms)]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(items)
+
+    def remove(self, owner, activity_id):
+        self.db.execute('DELETE FROM terrain_histograms WHERE owner = ? AND activity_id = ?', (owner, activity_id))
+
+    def remove_owner(self, owner):
+        self.db.execute('DELETE FROM terrain_histograms WHERE owner = ?', (owner,))
+
+    def aggregate(self, owner, since=None):
+        """
+        汇总运动员的直方图
+
+        Args:
+            owner: 运动员标识
+            since: 只汇总此日期（YYYY-MM-DD）之后的活动（可选）
+
+        Returns:
+            (汇总的直方图, 活动数量)
+        """
+        import numpy as np
+
+        sql = 'SELECT histogram FROM terrain_histograms WHERE owner = ? AND bins = ?'
+        params = [owner, BINS_VERSION]
+        if since:
+            sql += ' AND start_date >= ?'
+            params.append(since)
+        rows = self.db.execute(sql, params).fetchall()
+        if not rows:
+            return np.zeros(HISTOGRAM_SIZE), 0
+        return np.frombuffer(b''.join(row[0] for row in rows)).reshape(len(rows), HISTOGRAM_SIZE).sum(axis=0), len(rows)
+
+    def stats(self):
+        row = self.db.execute(
+            'SELECT COUNT(*), COUNT(DISTINCT owner), IFNULL(SUM(bins = ?), 0) FROM terrain_histograms', (BINS_VERSION,)
+        ).fetchone()
+        return {'activities': row[0], 'owners': row[1], 'current_bins': row[2], 'bins_version': BINS_VERSION}
+
+
+def compare_terrain(race_distances, training_histogram, activity_count):
+    """
+    对比比赛路线与训练中各坡度的距离占比，以及训练中各坡度的平均配速
+
+    Args:
+        race_distances: route_grade_histogram的结果
+        training_histogram: TerrainHistogramStore.aggregate的结果
+        activity_count: 参与汇总的活动数量
+
+    Returns:
+        可直接返回给前端的字典
+    """
+    import numpy as np
+
+    train_distances, train_times, grade_pace = split_histogram(training_histogram)
+    race_total = race_distances.sum()
+    train_total = train_distances.sum()
+    race_share = race_distances / race_total if race_total > 0 else np.zeros(GRADE_BINS)
+    train_share = train_distances / train_total if train_total > 0 else np.zeros(GRADE_BINS)
+    # 平均配速 = 移动时间 / 距离
+    pace = np.divide(train_times / 60, train_distances / 1000,
+                     out=np.zeros(GRADE_BINS), where=train_distances > 0)
+
+    grades = []
+    for i, label in enumerate(GRADE_LABELS):
+        grades.append({
+            'grade': label,
+            'race_km': round(float(race_distances[i]) / 1000, 2),
+            'race_share': round(float(race_share[i]), 4),
+            'training_km': round(float(train_distances[i]) / 1000, 1),
+            'training_share': round(float(train_share[i]), 4),
+            'training_pace': round(float(pace[i]), 2) if pace[i] else None
+        })
+    return {
+        'grade_labels': GRADE_LABELS,
+        'pace_labels': PACE_LABELS,
+        'grades': grades,
+        # 坡度×配速的训练距离（公里），用于前端热力图
+        'training_grade_pace_km': np.round(grade_pace / 1000, 2).tolist(),
+        'race_km': round(float(race_total) / 1000, 2),
+        'training_km': round(float(train_total) / 1000, 1),
+        'activity_count': activity_count
+    }
+
+
+def render_terrain_comparison(comparison, min_share=0.01):
+    """把地形对比渲染为提示词中的文本，只列出比赛中占比不低于min_share的坡度区间"""
+    if not comparison or not comparison['activity_count']:
+        return "无训练历史数据"
+    lines = [f"最近{comparison['activity_count']}次跑步共{comparison['training_km']}公里的坡度分布与比赛路线对比:"]
+    gaps = []
+    for row in comparison['grades']:
+        if row['race_share'] < min_share:
+            continue
+        lines.append(f"- 坡度{row['grade']}: 比赛占{row['race_share'] * 100:.1f}%（{row['race_km']}公里），"
+                     f"训练占{row['training_share'] * 100:.1f}%，训练平均配速{format_pace(row['training_pace'])}")
+        if row['race_share'] >= 0.05 and row['training_share'] < row['race_share'] / 2:
+            gaps.append(row['grade'])
+    if gaps:
+        lines.append(f"- 训练明显不足的坡度区间: {'、'.join(gaps)}")
+    return "\n".join(lines)
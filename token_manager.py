@@ -0,0 +1,170 @@
+import os
+import time
+import hashlib
+import threading
+
+from db_utils import LocalSqlite
+
+# 令牌在过期前多少秒开始刷新。Strava只会在令牌剩余不足1小时时签发新令牌，
+# 过早刷新只会拿回同一个令牌，白白多一次请求
+TOKEN_REFRESH_MARGIN = int(os.getenv('STRAVA_TOKEN_REFRESH_MARGIN', 300))
+# 刷新租约的有效期（秒），持有租约的worker异常退出后其他worker可以接手
+REFRESH_LEASE_SECONDS = 30
+# 等待其他worker完成刷新时的轮询间隔
+LEASE_POLL_INTERVAL = 0.1
+
+
+def token_key(athlete_id=None, refresh_token=None):
+    """按运动员ID标识令牌；旧session没有运动员ID时使用刷新令牌的哈希"""
+    if athlete_id:
+        return f"athlete:{athlete_id}"
+    if refresh_token:
+        return "rt:" + hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()[:24]
+    return None
+
+
+def needs_refresh(expires_at, margin=None):
+    """令牌是否需要刷新"""
+    if margin is None:
+        margin = TOKEN_REFRESH_MARGIN
+    if not expires_at:
+        return True
+    return time.time() > expires_at - margin
+
+
+class TokenManager:
+    """
+    按运动员管理Strava令牌，所有worker共享服务端缓存的令牌
+
+    同一运动员的并发刷新只会发出一次请求：worker内部用线程锁排队，
+    worker之间通过数据库中的刷新租约选出一个worker发请求，其余worker等待并复用结果。
+    """
+
+    def __init__(self, db_path):
+        self.db = LocalSqlite(db_path)
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS strava_tokens ('
+            'key TEXT PRIMARY KEY, access_token TEXT, refresh_token TEXT, expires_at INTEGER, '
+            'lease_until REAL DEFAULT 0, refreshes INTEGER DEFAULT 0, coalesced INTEGER DEFAULT 0, '
+            'failures INTEGER DEFAULT 0, updated_at REAL)'
+        )
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get(self, key):
+        """读取服务端缓存的令牌"""
+        row = self.db.execute(
+            'SELECT access_token, refresh_token, expires_at FROM strava_tokens WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'access_token': row[0], 'refresh_token': row[1], 'expires_at': row[2]}
+
+    def store(self, key, token_data):
+        """保存令牌，只在比已缓存的令牌更新时覆盖"""
+        self.db.execute(
+            'INSERT INTO strava_tokens (key, access_token, refresh_token, expires_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET access_token = excluded.access_token, '
+            'refresh_token = excluded.refresh_token, expires_at = excluded.expires_at, '
+            'updated_at = excluded.updated_at '
+            'WHERE excluded.expires_at >= IFNULL(strava_tokens.expires_at, 0)',
+            (key, token_data.get('access_token'), token_data.get('refresh_token'),
+             token_data.get('expires_at'), time.time())
+        )
+
+    def delete(self, key):
+        """删除令牌（运动员取消授权时）"""
+        self.db.execute('DELETE FROM strava_tokens WHERE key = ?', (key,))
+
+    def _count(self, key, column):
+        self.db.execute(f'UPDATE strava_tokens SET {column} = {column} + 1 WHERE key = ?', (key,))
+
+    def _acquire_lease(self, key):
+        now = time.time()
+        cursor = self.db.execute(
+            'UPDATE strava_tokens SET lease_until = ? WHERE key = ? AND IFNULL(lease_until, 0) < ?',
+            (now + REFRESH_LEASE_SECONDS, key, now)
+        )
+        return cursor.rowcount == 1
+
+    def _release_lease(self, key):
+        self.db.execute('UPDATE strava_tokens SET lease_until = 0 WHERE key = ?', (key,))
+
+    def _wait_for_refresh(self, key):
+        """等待持有租约的worker完成刷新"""
+        deadline = time.time() + REFRESH_LEASE_SECONDS
+        while time.time() < deadline:
+            time.sleep(LEASE_POLL_INTERVAL)
+            token = self.get(key)
+            if token and not needs_refresh(token['expires_at']):
+                return token
+            row = self.db.execute('SELECT lease_until FROM strava_tokens WHERE key = ?', (key,)).fetchone()
+            if row is None or (row[0] or 0) < time.time():
+                return None
+        return None
+
+    def get_fresh_token(self, key, current, refresh_func):
+        """
+        返回可用的令牌，需要时刷新，并发刷新合并为一次请求
+
+        Args:
+            key: 令牌标识，见token_key
+            current: session中的令牌（access_token、refresh_token、expires_at）
+            refresh_func: 用刷新令牌换新令牌的函数，失败时返回None
+
+        Returns:
+            令牌字典，刷新失败时返回None
+        """
+        if current and current.get('refresh_token'):
+            self.store(key, current)
+
+        token = self.get(key)
+        if token and not needs_refresh(token['expires_at']):
+            return token
+
+        with self._lock_for(key):
+            # 排队期间可能已被同一worker的其他线程刷新
+            token = self.get(key)
+            if token is None:
+                return None
+            if not needs_refresh(token['expires_at']):
+                self._count(key, 'coalesced')
+                return token
+
+            if not self._acquire_lease(key):
+                self._count(key, 'coalesced')
+                waited = self._wait_for_refresh(key)
+                if waited is not None:
+                    return waited
+                # 持有租约的worker失败或超时，自己尝试一次
+                if not self._acquire_lease(key):
+                    return None
+
+            try:
+                token_data = refresh_func(token['refresh_token'])
+                if not token_data:
+                    self._count(key, 'failures')
+                    return None
+                self.store(key, token_data)
+                self._count(key, 'refreshes')
+                return self.get(key)
+            finally:
+                self._release_lease(key)
+
+    def stats(self):
+        """刷新次数统计"""
+        totals = self.db.execute(
+            'SELECT COUNT(*), IFNULL(SUM(refreshes), 0), IFNULL(SUM(coalesced), 0), IFNULL(SUM(failures), 0) '
+            'FROM strava_tokens'
+        ).fetchone()
+        return {
+            'tokens': totals[0],
+            'refreshes': totals[1],
+            'coalesced': totals[2],
+            'failures': totals[3]
+        }
@@ -0,0 +1,275 @@
+import os
+import time
+from datetime import datetime
+
+from db_utils import LocalSqlite
+
+# 心率储备法的静息心率和最大心率
+HR_REST = int(os.getenv('TRAINING_HR_REST', 60))
+HR_MAX = int(os.getenv('TRAINING_HR_MAX', 190))
+# 体能（CTL）和疲劳（ATL）的时间常数（天）
+CTL_DAYS = 42
+ATL_DAYS = 7
+# 没有心率数据时，按时长估算负荷：每小时的负荷乘以运动类型的强度系数
+FALLBACK_LOAD_PER_HOUR = float(os.getenv('TRAINING_FALLBACK_LOAD_PER_HOUR', 60))
+SPORT_INTENSITY = {
+    'Run': 1.0, 'TrailRun': 1.1, 'VirtualRun': 1.0, 'Ride': 0.7, 'VirtualRide': 0.7, 'MountainBikeRide': 0.8,
+    'Swim': 0.8, 'Hike': 0.6, 'Walk': 0.4, 'WeightTraining': 0.6, 'Workout': 0.6
+}
+DEFAULT_INTENSITY = 0.6
+# 流数据中超过此间隔（秒）的时间差视为暂停，只按此间隔计入
+MAX_SAMPLE_GAP = 30
+# 心率参数的版本，修改后已保存的负荷会重新计算
+PARAMS_VERSION = f"{HR_REST}-{HR_MAX}-{FALLBACK_LOAD_PER_HOUR}"
+
+
+def _trimp_per_minute(hrr):
+    """Banister TRIMP的每分钟权重，hrr为心率储备比例（numpy数组或浮点数）"""
+    import numpy as np
+    return hrr * 0.64 * np.exp(1.92 * hrr)
+
+
+def hr_stream_loads(streams_list, hr_rest=HR_REST, hr_max=HR_MAX):
+    """
+    根据心率流数据批量计算多个活动的TRIMP
+
+    Args:
+        streams_list: 活动流数据列表（需要time和heartrate），没有心率的活动结果为NaN
+
+    Returns:
+        numpy数组，每个活动的负荷
+    """
+    import numpy as np
+
+    owners, gaps, rates = [], [], []
+    for i, streams in enumerate(streams_list):
+        seconds = np.asarray(streams.get('time') or [], dtype=float)
+        heartrate = np.asarray(streams.get('heartrate') or [], dtype=float)
+        n = min(len(seconds), len(heartrate))
+        if n < 2:
+            continue
+        owners.append(np.full(n - 1, i))
+        gaps.append(np.diff(seconds[:n]))
+        rates.append(heartrate[1:n])
+
+    loads = np.full(len(streams_list), np.nan)
+    if not owners:
+        return loads
+    owner = np.concatenate(owners)
+    minutes = np.clip(np.concatenate(gaps), 0, MAX_SAMPLE_GAP) / 60
+    hrr = np.clip((np.concatenate(rates) - hr_rest) / (hr_max - hr_rest), 0, 1)
+    sums = np.bincount(owner, weights=minutes * _trimp_per_minute(hrr), minlength=len(streams_list))
+    has_hr = np.bincount(owner, minlength=len(streams_list)) > 0
+    loads[has_hr] = sums[has_hr]
+    return loads
+
+
+def summary_load(activity, hr_rest=HR_REST, hr_max=HR_MAX):
+    """
+    没有心率流数据时根据活动摘要估算负荷
+
+    有平均心率时按平均心率计算TRIMP，否则按时长和运动类型的强度系数估算。
+
+    Returns:
+        (负荷, 计算方式)
+    """
+    minutes = (activity.get('moving_time') or 0) / 60
+    average_hr = activity.get('average_heartrate')
+    if average_hr:
+        hrr = min(max((average_hr - hr_rest) / (hr_max - hr_rest), 0), 1)
+        return float(minutes * _trimp_per_minute(hrr)), 'average_hr'
+    intensity = SPORT_INTENSITY.get(activity.get('sport_type') or activity.get('type'), DEFAULT_INTENSITY)
+    return minutes / 60 * FALLBACK_LOAD_PER_HOUR * intensity, 'duration'
+
+
+def activity_date(activity):
+    return (activity.get('start_date_local') or '')[:10]
+
+
+class TrainingLoadStore:
+    """
+    每个活动的训练负荷，保存在SQLite中，所有worker共享
+
+    新同步的活动只计算一次负荷，体能/疲劳曲线由已保存的负荷重新计算，不需要重新读取流数据。
+    """
+
+    def __init__(self, db_path):
+        self.db = LocalSqlite(db_path)
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS training_loads ('
+            'owner TEXT NOT NULL, activity_id INTEGER NOT NULL, day TEXT NOT NULL, load REAL NOT NULL, '
+            'method TEXT NOT NULL, params TEXT NOT NULL, computed_at REAL NOT NULL, '
+            'PRIMARY KEY (owner, activity_id))'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS training_loads_day ON training_loads (owner, params, day)'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS training_load_sources (owner TEXT PRIMARY KEY, etag TEXT NOT NULL)'
+        )
+
+    def source_etag(self, owner):
+        """上次同步时活动列表缓存的ETag"""
+        row = self.db.execute('SELECT etag FROM training_load_sources WHERE owner = ?', (owner,)).fetchone()
+        return row[0] if row else None
+
+    def set_source_etag(self, owner, etag):
+        self.db.execute('INSERT OR REPLACE INTO training_load_sources (owner, etag) VALUES (?, ?)', (owner, etag))
+
+    def missing(self, owner, activity_ids):
+        """返回还没有按当前参数计算负荷的活动ID"""
+        known = {row[0] for row in self.db.execute(
+            'SELECT activity_id FROM training_loads WHERE owner = ? AND params = ?', (owner, PARAMS_VERSION)
+        ).fetchall()}
+        return [activity_id for activity_id in activity_ids if activity_id not in known]
+
+    def add_many(self, owner, items):
+        """
+        计算并保存多个活动的负荷
+
+        Args:
+            owner: 运动员标识
+            items: [(活动摘要, 流数据或None), ...]，有心率流数据时按流数据计算
+
+        Returns:
+            保存的活动数量
+        """
+        if not items:
+            return 0
+        with_streams = [i for i, (_, streams) in enumerate(items) if streams and streams.get('heartrate')]
+        stream_loads = dict(zip(with_streams, hr_stream_loads([items[i][1] for i in with_streams])))
+
+        rows = []
+        now = time.time()
+        for i, (activity, _) in enumerate(items):
+            load = stream_loads.get(i)
+            if load is not None and load == load:
+                load, method = float(load), 'hr_stream'
+            else:
+                load, method = summary_load(activity)
+            rows.append((owner, activity['id'], activity_date(activity), round(load, 2), method, PARAMS_VERSION, now))
+
+        conn = self.db.conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT OR REPLACE INTO training_loads (owner, activity_id, day, load, method, params, computed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', rows
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return len(rows)
+
+    def remove(self, owner, activity_id):
+        self.db.execute('DELETE FROM training_loads WHERE owner = ? AND activity_id = ?', (owner, activity_id))
+
+    def remove_owner(self, owner):
+        for table in ('training_loads', 'training_load_sources'):
+            self.db.execute(f'DELETE FROM {table} WHERE owner = ?', (owner,))
+
+    def daily_loads(self, owner):
+        """按日期汇总的负荷，[(日期, 负荷), ...]"""
+        return self.db.execute(
+            "SELECT day, SUM(load) FROM training_loads WHERE owner = ? AND params = ? AND day != '' "
+            'GROUP BY day ORDER BY day', (owner, PARAMS_VERSION)
+        ).fetchall()
+
+    def version(self, owner):
+        """负荷数据的版本，用于页面ETag"""
+        row = self.db.execute(
+            'SELECT COUNT(*), MAX(computed_at), TOTAL(load) FROM training_loads WHERE owner = ?', (owner,)
+        ).fetchone()
+        return list(row)
+
+    def stats(self):
+        rows = self.db.execute('SELECT method, COUNT(*) FROM training_loads GROUP BY method').fetchall()
+        owners = self.db.execute('SELECT COUNT(DISTINCT owner) FROM training_loads').fetchone()[0]
+        return {'activities': sum(count for _, count in rows), 'owners': owners, 'by_method': dict(rows),
+                'params': PARAMS_VERSION}
+
+
+def _ewma(daily, days):
+    """
+    指数加权平均：x_t = x_{t-1} + (load_t - x_{t-1}) / days
+
+    展开后是负荷与指数核的卷积，权重小于1e-6的部分截断。
+    """
+    import numpy as np
+
+    alpha = 1 / days
+    length = min(len(daily), int(np.ceil(np.log(1e-6) / np.log(1 - alpha))) + 1)
+    kernel = alpha * (1 - alpha) ** np.arange(length)
+    return np.convolve(daily, kernel)[:len(daily)]
+
+
+def load_series(daily_loads, end_date=None):
+    """
+    由每日负荷计算体能（CTL）、疲劳（ATL）和状态（TSB）曲线
+
+    Args:
+        daily_loads: [(YYYY-MM-DD, 负荷), ...]
+        end_date: 曲线的结束日期（默认今天），之后的日子负荷为0，曲线按时间常数衰减
+
+    Returns:
+        {'dates', 'load', 'ctl', 'atl', 'tsb'}，都是按天排列的列表；没有数据时返回None
+    """
+    import numpy as np
+
+    if not daily_loads:
+        return None
+    days = np.array([d for d, _ in daily_loads], dtype='datetime64[D]')
+    start = days.min()
+    end = max(np.datetime64(end_date or datetime.now().strftime('%Y-%m-%d'), 'D'), days.max())
+    count = int((end - start).astype(int)) + 1
+    daily = np.bincount((days - start).astype(int), weights=[load for _, load in daily_loads], minlength=count)
+
+    ctl = _ewma(daily, CTL_DAYS)
+    atl = _ewma(daily, ATL_DAYS)
+    # 状态为前一天的体能减疲劳，当天训练不影响当天的状态
+    tsb = np.concatenate([[0.0], ctl[:-1] - atl[:-1]])
+    return {
+        'dates': np.datetime_as_string(start + np.arange(count)).tolist(),
+        'load': np.round(daily, 1).tolist(),
+        'ctl': np.round(ctl, 1).tolist(),
+        'atl': np.round(atl, 1).tolist(),
+        'tsb': np.round(tsb, 1).tolist()
+    }
+
+
+def summarize_load(series, weeks=6):
+    """
+    当前的体能、疲劳和状态，以及最近几周的周负荷和体能变化
+
+    Returns:
+        摘要字典，没有数据时返回None
+    """
+    if not series:
+        return None
+    ctl, atl, tsb, load = series['ctl'], series['atl'], series['tsb'], series['load']
+    weekly = []
+    for w in range(weeks, 0, -1):
+        end = len(load) - (w - 1) * 7
+        start = max(end - 7, 0)
+        if end <= 0:
+            continue
+        weekly.append({'week_end': series['dates'][end - 1], 'load': round(sum(load[start:end]), 1)})
+    return {
+        'date': series['dates'][-1],
+        'ctl': ctl[-1],
+        'atl': atl[-1],
+        'tsb': tsb[-1],
+        'ctl_change_28d': round(ctl[-1] - ctl[max(len(ctl) - 29, 0)], 1),
+        'weekly_load': weekly
+    }
+
+
+def render_training_load(summary):
+    """把训练负荷摘要渲染为提示词中的文本"""
+    if not summary:
+        return "无训练负荷数据"
+    weekly = "，".join(f"{w['week_end']}: {w['load']:.0f}" for w in summary['weekly_load'])
+    return (f"截至{summary['date']}: 体能(CTL) {summary['ctl']:.1f}，疲劳(ATL) {summary['atl']:.1f}，"
+            f"状态(TSB) {summary['tsb']:+.1f}，近28天体能变化 {summary['ctl_change_28d']:+.1f}\n"
+            f"最近{len(summary['weekly_load'])}周每周负荷(TRIMP): {weekly}")
@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import random
+import threading
+
+from db_utils import LocalSqlite
+
+# 处理一个事件的租约时间（秒），处理中的worker异常退出后其他worker可以接手
+EVENT_LEASE_SECONDS = 120
+# 失败重试的最大次数
+EVENT_MAX_ATTEMPTS = 5
+# 没有事件时的轮询间隔（秒），同一worker入队的事件会立即唤醒处理线程
+EVENT_POLL_INTERVAL = float(os.getenv('STRAVA_WEBHOOK_POLL_INTERVAL', 5))
+# 已处理的事件保留时间（秒）
+EVENT_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+class WebhookQueue:
+    """
+    Strava推送事件队列，保存在SQLite中，所有worker共享
+
+    接收推送的请求只负责入队并立即返回（Strava要求2秒内响应），
+    每个worker的后台线程通过租约领取事件，保证同一事件只被一个worker处理。
+    """
+
+    def __init__(self, db_path):
+        self.db = LocalSqlite(db_path)
+        self._wakeup = threading.Event()
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS strava_events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, object_type TEXT NOT NULL, object_id INTEGER NOT NULL, '
+            'aspect_type TEXT NOT NULL, owner_id INTEGER NOT NULL, updates TEXT, event_time INTEGER, '
+            'received_at REAL NOT NULL, lease_until REAL DEFAULT 0, attempts INTEGER DEFAULT 0, '
+            'done_at REAL, error TEXT)'
+        )
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS strava_events_pending ON strava_events (done_at, lease_until)'
+        )
+
+    def enqueue(self, event):
+        """
+        保存推送事件，同一对象已有相同的待处理事件时不重复入队
+
+        Args:
+            event: Strava推送的事件（object_type、object_id、aspect_type、owner_id、updates、event_time）
+
+        Returns:
+            是否新入队
+        """
+        duplicate = self.db.execute(
+            'SELECT 1 FROM strava_events WHERE object_type = ? AND object_id = ? AND aspect_type = ? '
+            'AND owner_id = ? AND done_at IS NULL AND attempts = 0',
+            (event['object_type'], event['object_id'], event['aspect_type'], event['owner_id'])
+        ).fetchone()
+        if duplicate:
+            return False
+        self.db.execute(
+            'INSERT INTO strava_events (object_type, object_id, aspect_type, owner_id, updates, event_time, received_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (event['object_type'], event['object_id'], event['aspect_type'], event['owner_id'],
+             json.dumps(event.get('updates') or {}), event.get('event_time'), time.time())
+        )
+        self._wakeup.set()
+        return True
+
+    def claim(self):
+        """领取最早的待处理事件，没有时返回None"""
+        now = time.time()
+        row = self.db.execute(
+            'UPDATE strava_events SET lease_until = ?, attempts = attempts + 1 '
+            'WHERE id = (SELECT id FROM strava_events WHERE done_at IS NULL AND lease_until < ? ORDER BY id LIMIT 1) '
+            'RETURNING id, object_type, object_id, aspect_type, owner_id, updates, event_time, attempts',
+            (now + EVENT_LEASE_SECONDS, now)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            'id': row[0],
+            'object_type': row[1],
+            'object_id': row[2],
+            'aspect_type': row[3],
+            'owner_id': row[4],
+            'updates': json.loads(row[5] or '{}'),
+            'event_time': row[6],
+            'attempts': row[7]
+        }
+
+    def complete(self, event_id):
+        self.db.execute('UPDATE strava_events SET done_at = ?, error = NULL WHERE id = ?', (time.time(), event_id))
+
+    def fail(self, event_id, attempts, error):
+        """处理失败：按指数退避重试，超过最大次数后放弃"""
+        if attempts >= EVENT_MAX_ATTEMPTS:
+            self.db.execute('UPDATE strava_events SET done_at = ?, error = ? WHERE id = ?',
+                            (time.time(), str(error), event_id))
+        else:
+            retry_at = time.time() + min(2 ** attempts * 10, 600)
+            self.db.execute('UPDATE strava_events SET lease_until = ?, error = ? WHERE id = ?',
+                            (retry_at, str(error), event_id))
+
+    def defer(self, event_id, delay, reason):
+        """延后处理事件（如Strava限额不足），不计入失败次数"""
+        self.db.execute('UPDATE strava_events SET lease_until = ?, attempts = attempts - 1, error = ? WHERE id = ?',
+                        (time.time() + delay, str(reason), event_id))
+
+    def purge_done(self):
+        """删除已处理的旧事件，返回删除的数量"""
+        return self.db.execute('DELETE FROM strava_events WHERE done_at IS NOT NULL AND done_at < ?',
+                               (time.time() - EVENT_RETENTION_SECONDS,)).rowcount
+
+    def wait(self, timeout):
+        """等待新事件入队或超时"""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def stats(self):
+        row = self.db.execute(
+            'SELECT COUNT(*), '
+            'IFNULL(SUM(done_at IS NULL), 0), '
+            'IFNULL(SUM(done_at IS NOT NULL AND error IS NULL), 0), '
+            'IFNULL(SUM(done_at IS NOT NULL AND error IS NOT NULL), 0), '
+            'AVG(CASE WHEN done_at IS NOT NULL AND error IS NULL THEN done_at - received_at END) '
+            'FROM strava_events'
+        ).fetchone()
+        return {
+            'total': row[0],
+            'pending': row[1],
+            'processed': row[2],
+            'failed': row[3],
+            'avg_latency_s': round(row[4], 3) if row[4] is not None else None
+        }
+
+
+def start_webhook_worker(queue, handler, log_path="logs/strava_webhook.log"):
+    """
+    启动处理推送事件的后台线程
+
+    Args:
+        queue: WebhookQueue
+        handler: 处理单个事件的函数，失败时抛出异常；异常带有retry_after属性时延后重试，不计入失败次数
+        log_path: 日志路径
+    """
+
+    def log(message):
+        with open(log_path, "a") as log_file:
+            log_file.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} [{os.getpid()}] {message}\n")
+
+    def run():
+        while True:
+            try:
+                event = queue.claim()
+                if event is None:
+                    if random.randrange(100) == 0:
+                        queue.purge_done()
+                    queue.wait(EVENT_POLL_INTERVAL)
+                    continue
+                try:
+                    handler(event)
+                    queue.complete(event['id'])
+                    log(f"处理完成: {event['object_type']} {event['object_id']} {event['aspect_type']}")
+                except Exception as e:
+                    retry_after = getattr(e, 'retry_after', None)
+                    if retry_after is not None:
+                        queue.defer(event['id'], retry_after, e)
+                        log(f"延后处理: {event['object_type']} {event['object_id']} {event['aspect_type']}: {e}")
+                        continue
+                    queue.fail(event['id'], event['attempts'], e)
+                    log(f"处理失败（第{event['attempts']}次）: {event['object_type']} {event['object_id']} "
+                        f"{event['aspect_type']}: {e}")
+            except Exception as e:
+                print(f"处理Strava推送事件出错: {e}")
+                time.sleep(EVENT_POLL_INTERVAL)
+
+    thread = threading.Thread(target=run, name='strava-webhook-worker', daemon=True)
+    thread.start()
+    return thread